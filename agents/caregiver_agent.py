@@ -1,11 +1,43 @@
-import os, re, json
-from typing import Dict, Optional
-from langchain_groq import ChatGroq
-from langchain.schema import HumanMessage, SystemMessage
+import os, re, json, time
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.runnables import Runnable, RunnableLambda
 from dotenv import load_dotenv
 
+from utils.llm_utils import HedgePolicy, hedge_from_env, invoke_with_timeout, model_name as llm_model_name
+from utils.rate_limit import attach_rate_limiter
+from utils.token_utils import compact_text
+from utils.tracing import span, tracer
+
 load_dotenv(dotenv_path=".env")
 
+# Notes in flight at once for summarize_many (bounded so a large upload doesn't trip rate limits)
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv("CAREGIVER_BATCH_CONCURRENCY", "8"))
+# Per-note LLM call timeout in summarize_many (a hung call fails that note and frees its slot)
+DEFAULT_BATCH_CALL_TIMEOUT_S = float(os.getenv("CAREGIVER_BATCH_TIMEOUT_S", "60"))
+# Token budget for the note inside the summary prompt (0 = no trimming; whitespace, boilerplate
+# and duplicate lines are always removed)
+DEFAULT_NOTE_TOKEN_BUDGET = int(os.getenv("CAREGIVER_NOTE_TOKEN_BUDGET", "6000"))
+
+
+@dataclass
+class BatchStats:
+    """Progress of a summarize_many run (updated as results come in)."""
+    notes: int = 0
+    done: int = 0
+    errors: int = 0
+    elapsed_s: float = 0.0
+
+    @property
+    def notes_per_minute(self) -> float:
+        return self.done / self.elapsed_s * 60.0 if self.elapsed_s > 0 else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        return {"notes": self.notes, "done": self.done, "errors": self.errors,
+                "elapsed_s": round(self.elapsed_s, 3), "notes_per_minute": round(self.notes_per_minute, 1)}
+
+
 class CaregiverCompanionAgent:
     """Summarizes and explains medical notes in layman's terms."""
 
@@ -14,20 +46,130 @@ class CaregiverCompanionAgent:
         "Your task: summarize, explain medical terms, and list brief actionable points. Do NOT give medical advice."
     )
 
-    def __init__(self, groq_api_key: Optional[str] = None, model_name="openai/gpt-oss-20b", temperature=0.0):
+    def __init__(self, groq_api_key: Optional[str] = None, model_name="openai/gpt-oss-20b", temperature=0.0, client=None,
+                 note_token_budget: int = DEFAULT_NOTE_TOKEN_BUDGET, hedge: Optional[HedgePolicy] = None):
 
         self.api_key = groq_api_key or os.getenv("GROQ_API_KEY")
+        self.last_batch: Optional[BatchStats] = None
+        self.note_token_budget = note_token_budget
+        # Optional hedging of summaries (single and batch) to a secondary model (see utils.llm_utils.HedgePolicy)
+        self.hedge = hedge
+        if client is not None:
+            # Any LangChain chat model (e.g. a simulated one for benchmarks)
+            self.client = client
+            attach_rate_limiter(self.client)
+            return
         if not self.api_key:
             raise ValueError("GROQ_API_KEY must be set.")
 
-        # Initialize the ChatGroq client
+        # Initialize the ChatGroq client (imported here so startup only pays for it when used)
+        from langchain_groq import ChatGroq
         self.client = ChatGroq(model=model_name, groq_api_key=self.api_key, temperature=temperature)
+        # Every call (single, batch) acquires from the process-wide Groq limiter for this model
+        attach_rate_limiter(self.client, "groq")
+        self.hedge = hedge or hedge_from_env(self.client)
 
     def summarize_and_explain(self, text: str, redact_phi: bool = True) -> Dict[str, object]:
         if not text.strip():
-            return {"summary": "", "explanations": [], "action_items": [], "raw_response": ""}
+            return self._empty_result()
 
         text = self._redact_phi(text) if redact_phi else text
+        response = invoke_with_timeout(self.client, self._messages(self._compact(text)), stage="caregiver_summary",
+                                       hedge=self.hedge)
+        raw = getattr(response, "content", str(response))
+        return self._parse_response(raw, text)
+
+    # ----------------------------
+    # Bulk summarization
+    # ----------------------------
+    def summarize_many(self, notes: Iterable[str], redact_phi: bool = True,
+                       max_concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+                       call_timeout_s: Optional[float] = DEFAULT_BATCH_CALL_TIMEOUT_S) -> Iterator[Tuple[int, Dict[str, object]]]:
+        """
+        Summarize many notes, yielding (index, result) in completion order.
+
+        Notes are redacted and summarized by a runnable batch with at most `max_concurrency`
+        in flight (redaction runs in the same worker threads, overlapping other notes' LLM
+        calls). Each call goes through invoke_with_timeout like a single note: `call_timeout_s`
+        per call, the request deadline, hedging, and stage "caregiver_batch" in the token
+        ledger. A note that fails or times out yields a result with an "error" key instead of
+        failing the batch. Progress, including notes per minute, is in self.last_batch.
+        """
+        notes = list(notes)
+        stats = self.last_batch = BatchStats(notes=len(notes))
+        started = time.perf_counter()
+        pending = [i for i, n in enumerate(notes) if n.strip()]
+        for i in (i for i, n in enumerate(notes) if not n.strip()):
+            yield self._finish(stats, started, i, self._empty_result())
+        if pending:
+            chain = self._batch_chain(redact_phi, call_timeout_s)
+            config = {"max_concurrency": max(1, max_concurrency)}
+            for j, out in chain.batch_as_completed([notes[i] for i in pending], config=config, return_exceptions=True):
+                yield self._finish(stats, started, pending[j], self._batch_result(out))
+        self._record_batch(stats)
+
+    async def asummarize_many(self, notes: Iterable[str], redact_phi: bool = True,
+                              max_concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+                              call_timeout_s: Optional[float] = DEFAULT_BATCH_CALL_TIMEOUT_S) -> AsyncIterator[Tuple[int, Dict[str, object]]]:
+        """Async summarize_many (abatch_as_completed on the caller's event loop)."""
+        notes = list(notes)
+        stats = self.last_batch = BatchStats(notes=len(notes))
+        started = time.perf_counter()
+        pending = [i for i, n in enumerate(notes) if n.strip()]
+        for i in (i for i, n in enumerate(notes) if not n.strip()):
+            yield self._finish(stats, started, i, self._empty_result())
+        if pending:
+            chain = self._batch_chain(redact_phi, call_timeout_s)
+            config = {"max_concurrency": max(1, max_concurrency)}
+            async for j, out in chain.abatch_as_completed([notes[i] for i in pending], config=config,
+                                                          return_exceptions=True):
+                yield self._finish(stats, started, pending[j], self._batch_result(out))
+        self._record_batch(stats)
+
+    def _batch_chain(self, redact_phi: bool, call_timeout_s: Optional[float]) -> Runnable:
+        """
+        note -> (redacted text, LLM response), as one runnable so batch() runs both per note.
+        Sync steps: abatch runs them in executor threads, with the caller's context (deadline).
+        """
+        def prepare(note: str) -> Dict[str, object]:
+            text = self._redact_phi(note) if redact_phi else note
+            return {"text": text, "messages": self._messages(self._compact(text))}
+
+        def call(item: Dict[str, object]) -> Tuple[str, BaseMessage]:
+            return item["text"], invoke_with_timeout(self.client, item["messages"], call_timeout_s,
+                                                     stage="caregiver_batch", hedge=self.hedge)
+
+        return RunnableLambda(prepare) | RunnableLambda(call)
+
+    def _batch_result(self, out: object) -> Dict[str, object]:
+        if isinstance(out, Exception):
+            return {**self._empty_result(), "error": f"{type(out).__name__}: {out}"}
+        text, response = out
+        return self._parse_response(getattr(response, "content", str(response)), text)
+
+    @staticmethod
+    def _finish(stats: BatchStats, started: float, index: int, result: Dict[str, object]) -> Tuple[int, Dict[str, object]]:
+        stats.done += 1
+        stats.errors += "error" in result
+        stats.elapsed_s = time.perf_counter() - started
+        return index, result
+
+    @staticmethod
+    def _record_batch(stats: BatchStats) -> None:
+        tracer.record("caregiver.summarize_many", stats.elapsed_s * 1000.0, **stats.summary())
+
+    # ----------------------------
+    # Helpers
+    # ----------------------------
+    def _compact(self, text: str) -> str:
+        """The note as sent to the LLM: cleaned up and trimmed to note_token_budget (utils.token_utils)."""
+        with span("caregiver.compact", budget_tokens=self.note_token_budget) as s:
+            c = compact_text(text, self.note_token_budget, llm_model_name(self.client))
+            s.set(tokens_before=c.tokens_before, tokens_after=c.tokens_after,
+                  dropped_lines=c.dropped_lines, trimmed_lines=c.trimmed_lines)
+        return c.text
+
+    def _messages(self, text: str) -> List[BaseMessage]:
         prompt = f"""
         Given the medical notes below:
         1. Write a 2-4 sentence plain-language summary.
@@ -37,13 +179,14 @@ class CaregiverCompanionAgent:
         Return JSON with keys: summary, explanations, action_items, unclear.
         \n\n{text}
         """
-        messages = [
+        return [
             SystemMessage(content=self.DEFAULT_SYSTEM_PROMPT),
             HumanMessage(content=prompt)
         ]
-        response = self.client(messages)
-        raw = getattr(response, "content", str(response))
-        return self._parse_response(raw, text)
+
+    @staticmethod
+    def _empty_result() -> Dict[str, object]:
+        return {"summary": "", "explanations": [], "action_items": [], "raw_response": ""}
 
     @staticmethod
     def _redact_phi(text: str) -> str:
@@ -1,24 +1,84 @@
 from __future__ import annotations
-from typing import List, Dict, TypedDict, Optional
+from typing import Any, List, Dict, TypedDict, Optional
 import os
 import re
+import threading
 import math
+import time
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from langchain_openai import ChatOpenAI
-from langchain.schema import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage, HumanMessage
 
+from pipelines.http_fetch import fetch_stats
 from pipelines.provider_json_retrieval import (
-    scrape_json_url,
-    filter_providers_by_zip,
+    _normalize_zip,
+    expand_specialty_tokens,
+    get_zip_codes_within_distance,
+    load_provider_json,
+    specialty_matches,
 )
+from pipelines.provider_federation import DirectorySource, load_federated_directory, sources_from_env
+from pipelines.provider_refresh import DEFAULT_REFRESH_S, DirectoryRefresher
+from pipelines.provider_store import ROW_FIELDS, ProviderRows
+from pipelines.provider_stream import search_top_k, stream_nearby
+from utils.cancel_utils import check_cancelled
+from utils.deadline import remaining as deadline_remaining
+from utils.llm_utils import HedgePolicy, hedge_from_env, invoke_with_timeout, model_name
+from utils.metrics import LatencyWindow
+from utils.rate_limit import attach_rate_limiter, rate_limit_summary
+from utils.result_cache import ResultCache
+from utils.token_utils import fit_lines, token_ledger
+from utils.tracing import span
 
 DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
 ANTHEM_URL = "https://www22.anthem.com/CMS/PROVIDERS_CAM.json"
 
+INITIAL_RADIUS = 15.0
+EXPANDED_RADIUS = 30.0
+TOP_K = 5
+
+# Search-stage result cache (entries also drop whenever the directory version changes)
+RESULT_CACHE_SIZE = int(os.getenv("PROVIDER_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL_S = float(os.getenv("PROVIDER_CACHE_TTL_S", "900"))
+
+# Conversational sessions: a follow-up turn ("any within 40 miles?", "only cardiology") re-ranks
+# the session's candidate set (see _session_candidates) for SESSION_RADIUS miles around its ZIP
+# instead of searching the directory again; the set is capped at SESSION_MAX_CANDIDATES rows
+SESSION_RADIUS = float(os.getenv("PROVIDER_SESSION_RADIUS", str(EXPANDED_RADIUS)))
+SESSION_MAX_CANDIDATES = int(os.getenv("PROVIDER_SESSION_MAX_CANDIDATES", "1500"))
+# Fields a session candidate keeps (the session is checkpointed every turn; `_raw` is not)
+SESSION_FIELDS = ROW_FIELDS + ("source", "key")
+
+# Words of a follow-up turn that are not a specialty ("any within 40 miles?" -> nothing left)
+_FOLLOW_UP_FILLER = re.compile(
+    r"\b(?:any|only|just|also|instead|what|about|how|show|me|find|see|ones?|options?|providers?|doctors?|"
+    r"near(?:by)?|closer|within|around|in|of|the|a|an|and|or|those|them|there|is|are|can|you|i|"
+    r"please|more|miles?|mi|radius|zip)\b|\d+|[^\w\s]",
+    re.IGNORECASE,
+)
+
+# Token budget for the provider listing inside the summary prompt (results are ranked, so the
+# nearest ones are kept; 0 = no limit)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROVIDER_PROMPT_TOKEN_BUDGET", "1500"))
+
+# Latency budget (seconds) for a provider search; unset means no budget (always LLM summary).
+DEFAULT_LATENCY_BUDGET_S = float(os.getenv("PROVIDER_LATENCY_BUDGET_S")) if os.getenv("PROVIDER_LATENCY_BUDGET_S") else None
+# Assumed summary latency until we have observed some real calls.
+DEFAULT_SUMMARY_LATENCY_S = 1.5
+# The summary latency estimate only uses calls from the last SUMMARY_LATENCY_MAX_AGE_S seconds.
+# While it says the LLM won't fit the budget, one request per SUMMARY_PROBE_INTERVAL_S tries it
+# anyway (cut off at the budget, template on timeout), so the LLM tier comes back when the model
+# is fast again, or starts at all when the default estimate is over the budget.
+SUMMARY_LATENCY_MAX_AGE_S = float(os.getenv("PROVIDER_SUMMARY_LATENCY_MAX_AGE_S", "600"))
+SUMMARY_PROBE_INTERVAL_S = float(os.getenv("PROVIDER_SUMMARY_PROBE_S", "30"))
+
+# Response tiers
+TIER_LLM = "llm"            # formatted results + LLM-written summary
+TIER_TEMPLATE = "template"  # formatted results + deterministic templated summary
+
 SYSTEM_BASE = """You are ProviderCompanion, an empathetic healthcare provider assistant.
 Your job is to find and summarize nearby healthcare providers for a user's request.
 Be concise, accurate, and friendly. Never give a medical diagnosis."""
@@ -30,20 +90,77 @@ class ProviderState(TypedDict, total=False):
     procedure: str
     results: List[Dict[str, str]]
 
+class ProviderSession(TypedDict, total=False):
+    """Follow-up state of one conversation (kept in the graph state by the checkpointer)."""
+    zip_code: str
+    procedure: str
+    radii: List[float]                # search radii of the last turn
+    version: str                      # directory version the candidates came from
+    candidates: List[Dict[str, Any]]  # nearest TOP_K providers per specialty within SESSION_RADIUS
+    covered_zips: int                 # leading ZIPs (nearest first) whose rows are all in candidates
+    turns: int
+
 class ProviderAgent:
-    def __init__(self, model: str = DEFAULT_MODEL, temperature: float = 0.2):
-        self.llm = ChatOpenAI(model=model, temperature=temperature)
+    def __init__(self, model: str = DEFAULT_MODEL, temperature: float = 0.2,
+                 latency_budget_s: Optional[float] = DEFAULT_LATENCY_BUDGET_S,
+                 directory_url: str = ANTHEM_URL, llm=None,
+                 sources: Optional[List[DirectorySource]] = None,
+                 snapshot_path: Optional[str] = os.getenv("PROVIDER_SNAPSHOT"),
+                 shard_dir: Optional[str] = os.getenv("PROVIDER_SHARDS"),
+                 refresh_interval_s: Optional[float] = DEFAULT_REFRESH_S,
+                 result_cache: Optional[ResultCache] = None,
+                 hedge: Optional[HedgePolicy] = None):
+        # `llm` lets callers inject any LangChain chat model (e.g. a simulated one for benchmarks)
+        if llm is None:
+            from langchain_openai import ChatOpenAI  # imported here so startup only pays for it when used
+            # Response headers (x-ratelimit-*) feed the shared OpenAI rate limiter
+            llm = ChatOpenAI(model=model, temperature=temperature, include_response_headers=True)
+            hedge = hedge or hedge_from_env(llm)
+        attach_rate_limiter(llm)
+        self.llm = llm
+        # Optional hedging of the summary call to a secondary model (see utils.llm_utils.HedgePolicy)
+        self.hedge = hedge
+        self.latency_budget_s = latency_budget_s
+        self.directory_url = directory_url
+        # Several payer directories (federated + deduplicated) instead of the single directory_url;
+        # defaults to PROVIDER_SOURCES from the environment when set.
+        self.sources = sources if sources is not None else sources_from_env()
+        # A compiled snapshot (pipelines/provider_snapshot.py) takes precedence over both:
+        # it is mmap'ed once and searched via its ZIP / specialty indexes.
+        self.snapshot_path = snapshot_path
+        # Or a ZIP3-sharded directory (pipelines/provider_shards.py): only shards inside the
+        # search radius are opened, with an LRU of hot shards.
+        self.shard_dir = shard_dir
+
+        # The directory is loaded + indexed in the background now and reloaded every
+        # refresh_interval_s (<= 0: load once); None loads it on every request instead.
+        self.refresher: Optional[DirectoryRefresher] = None
+        if refresh_interval_s is not None:
+            self.refresher = DirectoryRefresher(self._open_directory, interval_s=refresh_interval_s).start()
+
+        # Candidates per (ZIP, radius rings, specialty tokens), for the current directory version
+        self.result_cache = result_cache or ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_S, name="provider_search")
+
+        # Recent latencies: the summary LLM call, and whole requests per served tier
+        self.summary_latency = LatencyWindow(max_age_s=SUMMARY_LATENCY_MAX_AGE_S)
+        self.tier_latency: Dict[str, LatencyWindow] = {}
+        self._last_summary_attempt = float("-inf")
+        self._probe_lock = threading.Lock()
+        self.summary_probes = 0
 
     # Utility methods
 
     def extract_zip_radius(self, text: str) -> tuple[str, float]:
-        """Extracts ZIP and radius from user input (defaults to 25mi)."""
+        """Extracts ZIP ('' if missing) and radius from user input (defaults to 25mi)."""
         m_zip = re.search(r"\b(\d{5})\b", text)
-        zip_code = m_zip.group(1)
+        zip_code = m_zip.group(1) if m_zip else ""
+        return zip_code, self.explicit_radius(text) or 25.0
 
+    @staticmethod
+    def explicit_radius(text: str) -> Optional[float]:
+        """Radius in miles if the user gave one ("within 40 miles", "10mi"), else None."""
         m_radius = re.search(r"(\d{1,2})\s*(?:mi|miles?)", text.lower())
-        radius = float(m_radius.group(1)) if m_radius else 25.0
-        return zip_code, radius
+        return float(m_radius.group(1)) if m_radius else None
 
     def detect_procedure(self, text: str) -> str:
         """LLM-based reasoning to detect what procedure/service the user is asking for."""
@@ -70,7 +187,7 @@ class ProviderAgent:
             SystemMessage(content="You map a healthcare request to likely specialties or procedures."),
             HumanMessage(content=f"User asked: '{text}'. Return only the most likely specialty names, comma-separated (no explanations)."),
         ]
-        result = self.llm.invoke(messages)
+        result = invoke_with_timeout(self.llm, messages, stage="detect_procedure")
         raw = result.content.strip().lower()
         raw = re.sub(r"the most likely.*?is", "", raw)
         raw = re.sub(r"[^a-z, ]", "", raw)
@@ -79,7 +196,7 @@ class ProviderAgent:
 
     # Main provider search
 
-    def find_nearby_providers(self, user_query: str) -> str:
+    def find_nearby_providers(self, user_query: str, latency_budget_s: Optional[float] = None) -> str:
         """
         Main entrypoint:
         - Detects procedure and zip/radius.
@@ -88,48 +205,239 @@ class ProviderAgent:
         - Falls back to closest 5 providers if still empty.
         - Outputs formatted list + short summary.
         """
-        from pipelines.provider_json_retrieval import filter_providers_by_specialty
+        return self.search(user_query, latency_budget_s=latency_budget_s)["response_text"]
+
+    def search(self, user_query: str, latency_budget_s: Optional[float] = None,
+               session: Optional[ProviderSession] = None) -> Dict[str, object]:
+        """
+        Same as find_nearby_providers, but also reports which response tier was served.
+
+        Returns a dict with: response_text, tier ('llm' | 'template'), tier_reason,
+        elapsed_s and latency_budget_s.
+
+        session: the conversation's ProviderSession ({} for a new one) to answer follow-up
+        turns from; the result then also has the updated "session". A turn without a ZIP (or
+        with the session's ZIP) is a follow-up: it keeps the session's ZIP, its procedure unless
+        the turn names another, and its radius unless the turn gives one.
+        """
+        with span("provider.search") as s:
+            result = self._search(user_query, latency_budget_s, session)
+            s.set(tier=result["tier"], tier_reason=result["tier_reason"])
+            return result
+
+    def _search(self, user_query: str, latency_budget_s: Optional[float],
+                session: Optional[ProviderSession] = None) -> Dict[str, object]:
+        started = time.monotonic()
+        budget = self.latency_budget_s if latency_budget_s is None else latency_budget_s
+        # The request deadline (utils.deadline), if sooner, is the budget: a late summary becomes a template
+        left = deadline_remaining()
+        if left is not None and (budget is None or left < budget):
+            budget = left
 
-        # --- Extract base info ---
+        # --- Extract base info (a follow-up reuses the session's ZIP and procedure) ---
         zip_code, _ = self.extract_zip_radius(user_query)
-        procedure = self.detect_procedure(user_query)
+        follow_up = bool(session and session.get("zip_code")) and zip_code in ("", session["zip_code"])
+        if follow_up:
+            zip_code = session["zip_code"]
+        if not zip_code:
+            text = "Please include a 5-digit ZIP code so I can look for providers near you."
+            return self._report(text, TIER_TEMPLATE, "no_zip", started, budget, session)
+        try:
+            procedure = self._follow_up_procedure(user_query, session) if follow_up else self.detect_procedure(user_query)
+        except TimeoutError:
+            print("⚠️ No time left to detect the procedure; searching all nearby providers.")
+            procedure = ""
+
+        radii = [INITIAL_RADIUS, EXPANDED_RADIUS]
+        if session is not None:
+            explicit = self.explicit_radius(user_query)
+            radii = [explicit] if explicit else (list(session.get("radii") or radii) if follow_up else radii)
 
-        initial_radius = 15.0
-        expanded_radius = 30.0
-        print(f"→ Searching for procedure '{procedure}' near ZIP {zip_code} within {initial_radius} miles")
+        print(f"→ Searching for procedure '{procedure}' near ZIP {zip_code} within {radii[0]} miles")
 
+        check_cancelled()
         try:
-            all_providers = scrape_json_url(ANTHEM_URL)
-            providers = filter_providers_by_zip(all_providers, zip_code, initial_radius)
+            if session is None:
+                top_providers, radius, note = self._find_candidates(zip_code, procedure)
+            else:
+                (top_providers, radius, note), session = self._find_in_session(
+                    session, follow_up, zip_code, procedure, radii
+                )
         except Exception as e:
-            return f"⚠️ Failed to load provider data: {e}"
+            return self._report(f"⚠️ Failed to load provider data: {e}", TIER_TEMPLATE, "error", started, budget, session)
+
+        if not top_providers:
+            text = (
+                f"No providers found near {zip_code} within {radii[-1]:g} miles "
+                f"for '{procedure or 'general care'}'."
+            )
+            return self._report(text, TIER_TEMPLATE, "no_results", started, budget, session)
+
+        joined = self.format_results(top_providers)
+        check_cancelled()
+
+        # --- Summary tier: LLM only when the remaining budget allows it ---
+        remaining = None if budget is None else budget - (time.monotonic() - started)
+        expected = self.summary_latency.p(50, default=DEFAULT_SUMMARY_LATENCY_S)
+        over_budget = remaining is not None and remaining < expected
+        probe = over_budget and remaining > 0 and self._probe_due()
+        if over_budget and not probe:
+            summary, tier, reason = self.templated_summary(zip_code, procedure, top_providers, radius, note), TIER_TEMPLATE, "budget"
+        else:
+            summary, tier, reason = self._llm_summary(user_query, joined, remaining, probe)
+            if summary is None:
+                summary = self.templated_summary(zip_code, procedure, top_providers, radius, note)
 
-        # Primary specialty filtering
-        specialty_filtered = []
-        if procedure:
-            specialty_filtered = filter_providers_by_specialty(providers, [procedure])
+        return self._report(f"{joined}\n\n{summary}", tier, reason, started, budget, session)
 
-        # Fallback 1: expand radius if no matches
-        if not specialty_filtered:
-            print(f"⚠️ No specialty match within {initial_radius} miles. Expanding search radius to {expanded_radius} miles...")
-            providers = filter_providers_by_zip(all_providers, zip_code, expanded_radius)
+    def _find_candidates(self, zip_code: str, procedure: str) -> tuple[List[Dict[str, str]], float, str]:
+        """
+        Data stage of the search (no LLM). Returns (top providers, radius used, note) where
+        note is '' | 'expanded' | 'closest'. Results are cached per normalized query and
+        directory version; identical concurrent queries are computed once.
+        """
+        with span("provider.load_directory") as s:
+            directory = self._load_directory()
+            s.set(rows=len(directory))
+
+        # Search only depends on the expanded specialty tokens, so "MRI" and "mri, radiology" can share an entry
+        key = (zip_code, (INITIAL_RADIUS, EXPANDED_RADIUS), frozenset(expand_specialty_tokens([procedure])) if procedure else frozenset())
+        with span("provider.candidates") as s:
+            (top, radius, note), outcome = self.result_cache.get_or_compute(
+                key, lambda: self._rank_candidates(directory, zip_code, procedure),
+                version=str(getattr(directory, "version", "") or ""),
+            )
+            s.set(cache="hit" if outcome != "miss" else "miss", outcome=outcome)
+        return list(top), radius, note
+
+    def _rank_candidates(self, directory, zip_code: str, procedure: str,
+                         radii: tuple = (INITIAL_RADIUS, EXPANDED_RADIUS)) -> tuple[List[Dict[str, str]], float, str]:
+        # Each search streams rows nearest first and stops after TOP_K matches (pipelines/provider_stream.py)
+        # Primary specialty filtering, then fallback 1: expand the radius if no matches
+        for i, radius in enumerate(radii):
+            if i:
+                print(f"⚠️ No specialty match within {radii[i - 1]} miles. Expanding search radius to {radius} miles...")
             if procedure:
-                specialty_filtered = filter_providers_by_specialty(providers, [procedure])
+                specialty_filtered = search_top_k(directory, zip_code, radius, [procedure], TOP_K, fallback=False)
+                if specialty_filtered:
+                    return specialty_filtered, radius, "expanded" if i else ""
 
         # Fallback 2: show any nearby providers if still none
-        if not specialty_filtered:
-            if not providers:
-                return (
-                    f"No providers found near {zip_code} within {expanded_radius} miles "
-                    f"for '{procedure or 'general care'}'."
-                )
-            print(f"⚠️ Still no specialty match — showing 5 closest providers within {expanded_radius} miles.")
-            specialty_filtered = providers[:5]
+        radius = radii[-1]
+        providers = search_top_k(directory, zip_code, radius, k=TOP_K)
+        if providers:
+            print(f"⚠️ Still no specialty match — showing {TOP_K} closest providers within {radius} miles.")
+        return providers, radius, "closest"
+
+    # Conversational sessions
+
+    def _find_in_session(self, session: ProviderSession, follow_up: bool, zip_code: str, procedure: str,
+                         radii: List[float]) -> tuple[tuple[List[Dict[str, str]], float, str], ProviderSession]:
+        """
+        Data stage for a session turn. A follow-up re-ranks the session's candidates when they are
+        from the live directory version and cover the radius; otherwise a new candidate set is
+        streamed from the directory (and searched directly if even that can't cover the radius).
+        Returns ((top providers, radius used, note), updated session).
+        """
+        with span("provider.session", follow_up=follow_up) as s:
+            version = self._directory_version()
+            candidates = session.get("candidates")
+            reuse = (
+                follow_up and candidates is not None
+                and (version is None or version == session.get("version"))
+                and self._covers(session.get("covered_zips", 0), zip_code, radii[-1])
+            )
+            if reuse:
+                source, covered, version = candidates, session["covered_zips"], session.get("version", "")
+            else:
+                with span("provider.load_directory") as ls:
+                    directory = self._load_directory()
+                    ls.set(rows=len(directory))
+                version = str(getattr(directory, "version", "") or "")
+                candidates, covered = self._session_candidates(directory, zip_code)
+                source = candidates if self._covers(covered, zip_code, radii[-1]) else directory
+            found = self._rank_candidates(source, zip_code, procedure, tuple(radii))
+            s.set(reused=reuse, candidates=len(candidates))
+        return found, ProviderSession(
+            zip_code=zip_code, procedure=procedure, radii=list(radii), version=version,
+            candidates=candidates, covered_zips=covered, turns=session.get("turns", 0) + 1,
+        )
+
+    def _follow_up_procedure(self, text: str, session: ProviderSession) -> str:
+        """The session's procedure if the turn names no other; a named specialty is used as is
+        when some candidate matches it (no LLM call), else detected like a new request."""
+        rest = " ".join(_FOLLOW_UP_FILLER.sub(" ", text).split())
+        if not rest:
+            return session.get("procedure", "")
+        tokens = expand_specialty_tokens([rest])
+        if any(specialty_matches(c.get("specialty", ""), tokens) for c in session.get("candidates") or []):
+            return rest
+        return self.detect_procedure(rest)
+
+    def _directory_version(self) -> Optional[str]:
+        """Version of the live directory, without loading it (None when there is no refresher)."""
+        if self.refresher is None:
+            return None
+        return str(getattr(self.refresher.current(), "version", "") or "")
+
+    @staticmethod
+    def _session_candidates(directory, zip_code: str) -> tuple[List[Dict[str, Any]], int]:
+        """
+        Candidate set for a session: within SESSION_RADIUS, nearest ZIP first, the first TOP_K
+        rows of each distinct specialty string. A top-k search within that radius (with any
+        specialty filter, or none) only ever picks such rows, so re-ranking the set answers it
+        exactly as the directory would. Returns (rows, leading ZIPs covered): all ZIPs in the
+        radius unless SESSION_MAX_CANDIDATES cut the stream short. Rows keep SESSION_FIELDS only.
+        """
+        zips = get_zip_codes_within_distance(zip_code, SESSION_RADIUS)
+        per_specialty: Dict[str, int] = {}
+        rows: List[Dict[str, Any]] = []
+        for row in stream_nearby(directory, zip_code, SESSION_RADIUS):
+            spec = str(row.get("specialty") or "")
+            seen = per_specialty.get(spec, 0)
+            if seen >= TOP_K:
+                continue
+            if len(rows) == SESSION_MAX_CANDIDATES:
+                # This row's ZIP is cut short: only the ZIPs before it are complete
+                cut = _normalize_zip(row.get("zip", ""))
+                return rows, zips.index(cut) if cut in zips else 0
+            per_specialty[spec] = seen + 1
+            rows.append({f: row[f] for f in SESSION_FIELDS if f in row})
+        return rows, len(zips)
+
+    @staticmethod
+    def _covers(covered_zips: int, zip_code: str, radius: float) -> bool:
+        # ZIPs within a smaller radius are a prefix of the nearest-first ZIP list
+        return radius <= SESSION_RADIUS and len(get_zip_codes_within_distance(zip_code, radius)) <= covered_zips
 
-        # Format top 5 results
-        top_providers = specialty_filtered[:5]
+    def _load_directory(self):
+        """The live directory: the refresher's current version, or a fresh load without one."""
+        if self.refresher is not None:
+            return self.refresher.current(timeout=deadline_remaining())  # a first load waits at most until the deadline
+        return self._open_directory()
+
+    def _open_directory(self):
+        """
+        Load the provider directory as an object with search(zip, radius, specialties): the
+        mmap'ed snapshot or shard directory when configured, else the federated store over
+        self.sources, else directory_url.
+        """
+        if self.snapshot_path:
+            from pipelines.provider_snapshot import open_snapshot
+            return open_snapshot(self.snapshot_path)
+        if self.shard_dir:
+            from pipelines.provider_shards import ShardedProviderStore
+            return ShardedProviderStore(self.shard_dir)
+        if self.sources:
+            return load_federated_directory(self.sources)
+        rows, version = load_provider_json(self.directory_url)
+        return ProviderRows(rows, version=version)
+
+    @staticmethod
+    def format_results(providers: List[Dict[str, str]]) -> str:
+        """One line per provider: name | specialty | address | phone | website."""
         lines = []
-        for p in top_providers:
+        for p in providers:
             parts = [
                 f"**{p.get('name', 'Unknown')}**",
                 p.get("specialty", ""),
@@ -138,17 +446,90 @@ class ProviderAgent:
                 p.get("website", ""),
             ]
             lines.append(" | ".join([x for x in parts if x]))
+        return "\n".join(lines)
+
+    @staticmethod
+    def templated_summary(zip_code: str, procedure: str, providers: List[Dict[str, str]], radius: float, note: str) -> str:
+        """Deterministic 2–3 sentence summary used when there is no time for the LLM."""
+        what = procedure or "general care"
+        n = len(providers)
+        cities = sorted({p.get("city", "").title() for p in providers if p.get("city")})
+        where = f" in {', '.join(cities[:3])}" if cities else ""
+        text = f"Here {'is' if n == 1 else 'are'} {n} provider option{'' if n == 1 else 's'}{where} within {radius:g} miles of {zip_code}."
+        if note == "expanded":
+            text += f" No match for '{what}' within {INITIAL_RADIUS:g} miles, so the search radius was expanded to {radius:g} miles."
+        elif note == "closest":
+            text += f" None matched '{what}' directly, so these are the nearest providers in the directory."
+        else:
+            text += f" They match your request for '{what}'."
+        return text + " Please call ahead to confirm availability and coverage."
 
-        joined = "\n".join(lines)
+    def _probe_due(self) -> bool:
+        """True for at most one request per SUMMARY_PROBE_INTERVAL_S without an LLM summary attempt."""
+        with self._probe_lock:
+            now = time.monotonic()
+            if now - self._last_summary_attempt < SUMMARY_PROBE_INTERVAL_S:
+                return False
+            self._last_summary_attempt = now
+            self.summary_probes += 1
+            return True
 
+    def _llm_summary(self, user_query: str, joined: str, timeout_s: Optional[float],
+                     probe: bool = False) -> tuple[Optional[str], str, str]:
+        """
+        Returns (summary or None, tier, reason). The LLM call is cancelled at the deadline.
+        probe: the estimate said the call would not fit; if it does, the estimate is stale.
+        """
         # Summary prompt for LLM
+        listing = fit_lines(joined.splitlines(), PROMPT_TOKEN_BUDGET, model_name(self.llm))
         summary_prompt = f"""User asked: "{user_query}"
         Here are nearby providers found in Anthem data:
-        {joined}
+        {listing}
         Provide a short, friendly summary (2–3 sentences) describing these options and note if the search radius was expanded.
         """
-        summary = self.llm.invoke([
-            SystemMessage(content=SYSTEM_BASE),
-            HumanMessage(content=summary_prompt)
-        ])
-        return f"{joined}\n\n{summary.content.strip()}"
\ No newline at end of file
+        messages = [SystemMessage(content=SYSTEM_BASE), HumanMessage(content=summary_prompt)]
+        t0 = self._last_summary_attempt = time.monotonic()
+        try:
+            summary = invoke_with_timeout(self.llm, messages, timeout_s, stage="provider_summary", hedge=self.hedge)
+        except TimeoutError:
+            # A timed-out call only says the LLM is at least this slow. That is news when it is
+            # slower than the estimate; a call cut off sooner (a short budget) would drag it down.
+            elapsed = time.monotonic() - t0
+            if elapsed >= self.summary_latency.p(50, default=DEFAULT_SUMMARY_LATENCY_S):
+                self.summary_latency.record(elapsed)
+            return None, TIER_TEMPLATE, "timeout"
+        except Exception as e:
+            print(f"⚠️ Summary LLM unavailable, using templated summary ({type(e).__name__}: {e})")
+            return None, TIER_TEMPLATE, "error"
+        if probe:
+            # Faster than the estimate: the slow spell is over, start the estimate again from here
+            self.summary_latency.clear()
+        self.summary_latency.record(time.monotonic() - t0)
+        return summary.content.strip(), TIER_LLM, "probe" if probe else "ok"
+
+    def _report(self, text: str, tier: str, reason: str, started: float, budget: Optional[float],
+                session: Optional[ProviderSession] = None) -> Dict[str, object]:
+        elapsed = time.monotonic() - started
+        self.tier_latency.setdefault(tier, LatencyWindow()).record(elapsed)
+        report = {
+            "response_text": text,
+            "tier": tier,
+            "tier_reason": reason,
+            "elapsed_s": elapsed,
+            "latency_budget_s": budget,
+        }
+        if session is not None:
+            report["session"] = session
+        return report
+
+    def latency_report(self) -> Dict[str, Dict[str, float]]:
+        """Per-tier request latency (count, p50, p95, p99, max), the LLM summary latency, search cache, rate limiter, token / cost, hedging and HTTP fetch stats."""
+        report = {tier: window.summary() for tier, window in self.tier_latency.items()}
+        report["llm_summary_call"] = {**self.summary_latency.summary(), "probes": self.summary_probes}
+        report["result_cache"] = self.result_cache.summary()
+        report["rate_limits"] = rate_limit_summary()
+        report["tokens"] = token_ledger.summary()
+        if self.hedge is not None:
+            report["hedge"] = self.hedge.summary()
+        report["http"] = fetch_stats()
+        return report
@@ -1,4 +1,5 @@
 import os
+import sys
 import gradio as gr
 from datetime import date
 from dotenv import load_dotenv
@@ -11,10 +12,12 @@ from langchain.chains import create_extraction_chain
 from langchain_community.document_loaders import WebBaseLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
 
 from prompts import INTENT_DETECTION_TEMPLATE, DATE_EXTRACTOR_PROMPT_TEMPLATE
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.embedding_service import get_embedding_service
+
 # --- 1. Load Environment and Models (on startup) ---
 load_dotenv()
 
@@ -39,7 +42,7 @@ try:
     splits = text_splitter.split_documents(docs)
 
     # Create embeddings and vector store
-    embedding_model = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    embedding_model = get_embedding_service("all-MiniLM-L6-v2").as_langchain()
     vectorstore = Chroma.from_documents(documents=splits, embedding=embedding_model)
 
     # Create the retriever
@@ -0,0 +1,38 @@
+# benchmarks/fake_embeddings.py
+"""
+Deterministic simulated sentence encoder for offline embedding benchmarks.
+
+Costs CPU like a small transformer on CPU: a fixed overhead per encode call (tokenizer setup,
+forward-pass dispatch) plus a cost per text, spent busy (holding the GIL) rather than sleeping.
+Vectors are derived from a hash of the text, so equal texts get equal vectors.
+"""
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import List
+
+import numpy as np
+
+
+def _busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class SimulatedEncoder:
+    """Picklable (for worker processes): texts -> float32[len(texts), dim]."""
+
+    def __init__(self, call_overhead_s: float = 0.004, per_text_s: float = 0.0004, dim: int = 384):
+        self.call_overhead_s = call_overhead_s
+        self.per_text_s = per_text_s
+        self.dim = dim
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        _busy(self.call_overhead_s + self.per_text_s * len(texts))
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            seed = int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        return out
@@ -0,0 +1,100 @@
+# benchmarks/fake_llm.py
+"""
+Deterministic simulated chat model for offline benchmarks.
+
+Latency specs:
+  fixed:0.5            always 0.5 s
+  uniform:0.2,1.5      uniform between 0.2 and 1.5 s
+  lognormal:0.8,0.5    lognormal with median 0.8 s and sigma 0.5 (long tail)
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import PrivateAttr
+
+
+def parse_latency(spec: str):
+    """Return a function rng -> seconds for a latency spec string."""
+    kind, _, args = spec.partition(":")
+    vals = [float(v) for v in args.split(",") if v] if args else []
+    if kind == "fixed":
+        return lambda rng: vals[0] if vals else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(vals[0], vals[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(vals[0]), vals[1])
+    raise ValueError(f"Unknown latency spec: {spec!r}")
+
+
+class SimulatedChatModel(BaseChatModel):
+    """Answers each of the repo's prompts with a canned, well-formed response after a simulated delay."""
+
+    latency: str = "fixed:0.0"
+    seed: int = 0
+    model_name: str = "simulated"
+
+    _rng: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated"
+
+    def _delay(self) -> float:
+        with self._lock:
+            return max(0.0, parse_latency(self.latency)(self._rng))
+
+    @staticmethod
+    def _respond(messages: List[BaseMessage]) -> str:
+        system = " ".join(str(m.content) for m in messages if m.type == "system").lower()
+        human = " ".join(str(m.content) for m in messages if m.type == "human")
+        if "classify the user's request" in system:
+            return "provider" if any(ch.isdigit() for ch in human) else "caregiver"
+        if "medical-notes translator" in system:
+            return json.dumps({
+                "summary": "The patient has a minor illness and should rest.",
+                "explanations": [{"term": "rhinitis", "explanation": "a stuffy or runny nose"}],
+                "action_items": ["Rest", "Drink fluids", "Attend the follow-up visit"],
+                "unclear": [],
+            })
+        if "map a healthcare request" in system:
+            return "internal medicine, primary care"
+        return "These nearby providers match your request. Call ahead to confirm availability."
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        text = self._respond(messages)
+        prompt_tokens = sum(len(str(m.content)) for m in messages) // 4
+        message = AIMessage(
+            content=text,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": len(text) // 4,
+                "total_tokens": prompt_tokens + len(text) // 4,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay())
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay())
+        return self._result(messages)
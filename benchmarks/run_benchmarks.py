@@ -0,0 +1,681 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Offline benchmark suite (no Anthem, CDC, Groq or OpenAI access needed).
+
+- Provider data comes from synthetic Anthem-format directories (benchmarks/synthetic_directory.py)
+- LLM calls go to SimulatedChatModel with a configurable latency distribution
+
+Measures throughput, latency percentiles and peak memory for:
+  scrape_json_url, filter_providers_by_zip, filter_providers_by_specialty,
+  simple_retriever (keyword mode) and full build_final_graph invocations.
+Also compares process cold start (load + first search) and RSS for the JSON directory
+vs a compiled mmap snapshot (pipelines/provider_snapshot.py), and refreshing a directory
+with a 1% change from scratch vs by delta, and the combined ZIP + specialty search
+as dict loops vs NumPy column masks (pipelines/provider_columns.py), and a top-5 search as a
+full filtered list vs the streaming pipeline (pipelines/provider_stream.py). Caregiver notes
+per minute are compared for one call per note vs the batched summarize_many, and caregiver
+call latency (p50/p95/p99) without vs with hedging to a second simulated model, and embedding
+texts/sec for one encoder call per text vs the shared micro-batched service (utils/embedding_service.py)
+in-process, with a worker pool, and from its vector cache. Provider lookup latency behind a
+backlog of long caregiver summaries is compared for a FIFO worker pool vs the request scheduler
+(orchestrators/request_scheduler.py), and pre-fork server throughput and total memory (PSS)
+for 1 vs N worker processes sharing the snapshot vs N workers each loading the JSON directory
+(orchestrators/prefork_server.py).
+
+Usage:
+  python -m benchmarks.run_benchmarks --rows 10000 100000
+  python -m benchmarks.run_benchmarks --rows 10000 --llm-latency lognormal:0.8,0.6 --graph-requests 50
+  python -m benchmarks.run_benchmarks --rows 1000000 5000000 --no-memory --only scrape filter_zip
+  python -m benchmarks.run_benchmarks --rows 100000 1000000 --only snapshot
+  python -m benchmarks.run_benchmarks --rows 1000000 --no-memory --only columns
+  python -m benchmarks.run_benchmarks --only embeddings --embed-texts 5000 --embed-workers 4
+  python -m benchmarks.run_benchmarks --rows 10000 --only scheduler --sched-workers 8
+  python -m benchmarks.run_benchmarks --rows 100000 --only prefork --prefork-workers 4
+  python -m benchmarks.run_benchmarks --rows 10000 --compare benchmarks/results/bench-20251018-120000.json
+
+Results are written to benchmarks/results/bench-<timestamp>.json.
+"""
+
+from __future__ import annotations
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic_directory import BENCH_ZIP, write_directory
+from benchmarks.fake_embeddings import SimulatedEncoder
+from benchmarks.fake_llm import SimulatedChatModel
+from pipelines.provider_json_retrieval import (
+    scrape_json_url,
+    filter_providers_by_zip,
+    filter_providers_by_specialty,
+    simple_retriever,
+)
+from pipelines.provider_snapshot import compile_snapshot, open_snapshot
+from pipelines.provider_store import ProviderRows, search_rows
+from utils.metrics import percentile
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+GRAPH_QUERIES = [
+    f"MRI near {BENCH_ZIP}",
+    f"colonoscopy in {BENCH_ZIP}",
+    f"pediatric doctor near {BENCH_ZIP}",
+    "Patient presented with acute rhinitis and a persistent cough. Recommended rest and fluids.",
+    "Please summarize these notes: BP 150/95, started lisinopril 10 mg daily, recheck in 2 weeks.",
+]
+
+
+# ----------------------------
+# Measurement helpers
+# ----------------------------
+def time_calls(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    durations = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - t0)
+    total = sum(durations)
+    return {
+        "runs": repeat,
+        "mean_ms": total / repeat * 1000.0,
+        "p50_ms": percentile(durations, 50) * 1000.0,
+        "p95_ms": percentile(durations, 95) * 1000.0,
+        "p99_ms": percentile(durations, 99) * 1000.0,
+        "throughput_per_s": repeat / total if total else 0.0,
+    }
+
+
+def peak_memory_mb(fn: Callable[[], Any]) -> float:
+    """Peak Python heap allocated while running fn once (tracemalloc)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 1e6
+
+
+def measure(name: str, rows: int, fn: Callable[[], Any], repeat: int, memory: bool,
+            per_call_rows: Optional[int] = None) -> Dict[str, Any]:
+    stats = time_calls(fn, repeat)
+    result: Dict[str, Any] = {"benchmark": name, "rows": rows, **stats}
+    if per_call_rows:
+        result["rows_per_s"] = per_call_rows * stats["throughput_per_s"]
+    if memory:
+        result["peak_mem_mb"] = peak_memory_mb(fn)
+    print(
+        f"  {name:<30} rows={rows:<9} p50={stats['p50_ms']:>10.2f} ms  p95={stats['p95_ms']:>10.2f} ms"
+        + (f"  peak={result['peak_mem_mb']:.1f} MB" if memory else "")
+    )
+    return result
+
+
+# ----------------------------
+# Benchmarks
+# ----------------------------
+def bench_pipeline(path: str, rows: int, repeat: int, memory: bool, only: List[str]) -> List[Dict[str, Any]]:
+    results = []
+    providers = scrape_json_url(path)
+
+    if "scrape" in only:
+        results.append(measure("scrape_json_url", rows, lambda: scrape_json_url(path),
+                               max(1, repeat // 2), memory, per_call_rows=len(providers)))
+    if "filter_zip" in only:
+        results.append(measure("filter_providers_by_zip", rows,
+                               lambda: filter_providers_by_zip(providers, BENCH_ZIP, 15.0),
+                               repeat, memory, per_call_rows=len(providers)))
+    if "filter_zip" in only:
+        # Uncached radius lookups: materialized neighbour table vs the bounding-box scan
+        from pipelines.provider_json_retrieval import _bbox_scan
+        from pipelines.zip_neighbors import ensure_table
+        table = ensure_table()
+        if table is not None:
+            results.append(measure("zip_radius.table", rows, lambda: table.neighbors_within(BENCH_ZIP, 30.0),
+                                   repeat, memory))
+        results.append(measure("zip_radius.scan", rows, lambda: _bbox_scan(BENCH_ZIP, 30.0), repeat, memory))
+    if "filter_specialty" in only:
+        results.append(measure("filter_providers_by_specialty", rows,
+                               lambda: filter_providers_by_specialty(providers, ["radiology, diagnostic imaging"]),
+                               repeat, memory, per_call_rows=len(providers)))
+    if "columns" in only:
+        # Combined ZIP + specialty search: dict loops (search_rows) vs NumPy masks
+        from pipelines.provider_columns import ProviderColumns
+        query = (BENCH_ZIP, 30.0, ["cardiology"])
+        results.append(measure("columns.build", rows, lambda: ProviderColumns(providers), max(1, repeat // 2), memory,
+                               per_call_rows=len(providers)))
+        columns = ProviderColumns(providers)
+        results.append(measure("search.loops", rows, lambda: search_rows(providers, *query), repeat, memory,
+                               per_call_rows=len(providers)))
+        results.append(measure("search.columns", rows, lambda: columns.search(*query), repeat, memory,
+                               per_call_rows=len(providers)))
+    if "stream" in only:
+        # Top-5 for a search: full filtered list then slice vs the streaming pipeline (nearest first, early exit)
+        from pipelines.provider_columns import ProviderColumns
+        from pipelines.provider_stream import search_top_k
+        columns = ProviderColumns(providers)
+        for label, specialties in (("match", ["cardiology"]), ("fallback", ["no such specialty"])):
+            results.append(measure(f"top_k.list.{label}", rows, lambda: columns.search(BENCH_ZIP, 30.0, specialties)[:5],
+                                   repeat, memory, per_call_rows=len(providers)))
+            results.append(measure(f"top_k.stream.{label}", rows,
+                                   lambda: search_top_k(columns, BENCH_ZIP, 30.0, specialties, k=5),
+                                   repeat, memory, per_call_rows=len(providers)))
+    if "retriever" in only:
+        docs = [f"{p['name']} | {p['specialty']} | {p['city']} {p['zip']}" for p in providers[:50000]]
+        results.append(measure("simple_retriever", len(docs),
+                               lambda: simple_retriever(docs, f"radiology imaging {BENCH_ZIP}", k=5, use_vectors=False),
+                               repeat, memory, per_call_rows=len(docs)))
+    return results
+
+
+# Runs in a fresh interpreter: both loaders are imported up front so the baseline is equal.
+_COLD_START = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+from pipelines.provider_json_retrieval import scrape_json_url
+from pipelines.provider_snapshot import open_snapshot
+from pipelines.provider_store import ProviderRows
+rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+directory = open_snapshot({path!r}) if {mode!r} == "snapshot" else ProviderRows(scrape_json_url({path!r}))
+t1 = time.perf_counter()
+n = len(directory.search({zip!r}, 15.0, ["radiology"]))
+t2 = time.perf_counter()
+print(json.dumps({{"load_ms": (t1 - t0) * 1000, "first_search_ms": (t2 - t1) * 1000, "results": n,
+                  "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "rss_baseline_mb": rss_before / 1024}}))
+"""
+
+
+def cold_start(mode: str, path: str) -> Dict[str, Any]:
+    """Load + first search in a new process; RSS is the child's peak (includes touched mmap pages)."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = _COLD_START.format(root=root, path=path, mode=mode, zip=BENCH_ZIP)
+    out = subprocess.check_output([sys.executable, "-c", code], text=True, cwd=root)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def bench_snapshot(path: str, rows: int, repeat: int, memory: bool) -> List[Dict[str, Any]]:
+    snap_path = os.path.splitext(path)[0] + ".snap"
+    t0 = time.perf_counter()
+    compile_snapshot(scrape_json_url(path), snap_path)
+    compile_s = time.perf_counter() - t0
+    print(f"  compiled snapshot in {compile_s:.2f}s ({os.path.getsize(snap_path) / 1e6:.1f} MB vs "
+          f"{os.path.getsize(path) / 1e6:.1f} MB JSON)")
+
+    results = []
+    for mode, source in (("json", path), ("snapshot", snap_path)):
+        runs = [cold_start(mode, source) for _ in range(max(1, repeat // 2))]
+        load = [r["load_ms"] for r in runs]
+        result = {
+            "benchmark": f"cold_start.{mode}",
+            "rows": rows,
+            "runs": len(runs),
+            "p50_ms": percentile(load, 50),
+            "p95_ms": percentile(load, 95),
+            "first_search_p50_ms": percentile([r["first_search_ms"] for r in runs], 50),
+            "rss_mb": max(r["rss_mb"] for r in runs),
+            "rss_over_baseline_mb": max(r["rss_mb"] - r["rss_baseline_mb"] for r in runs),
+        }
+        if mode == "snapshot":
+            result["compile_s"] = compile_s
+        print(f"  {result['benchmark']:<30} rows={rows:<9} load p50={result['p50_ms']:>10.2f} ms  "
+              f"first search={result['first_search_p50_ms']:.1f} ms  RSS={result['rss_mb']:.0f} MB "
+              f"(+{result['rss_over_baseline_mb']:.0f} MB)")
+        results.append(result)
+
+    with open_snapshot(snap_path) as snap:
+        results.append(measure("snapshot.search", rows, lambda: snap.search(BENCH_ZIP, 15.0, ["radiology"]),
+                               repeat, memory))
+    return results
+
+
+def mutate(providers: List[Dict[str, Any]], fraction: float, seed: int = 7) -> List[Dict[str, Any]]:
+    """A next-day directory: `fraction` of rows changed, split between edits, removals and additions."""
+    import random
+    rnd = random.Random(seed)
+    new = list(providers)
+    n = max(3, int(len(new) * fraction)) // 3
+    for i in rnd.sample(range(len(new)), n):
+        new[i] = {**new[i], "phone": f"555{i:07d}"[:10]}
+    for i in sorted(rnd.sample(range(len(new)), n), reverse=True):
+        del new[i]
+    new += [{**providers[i], "name": f"{providers[i]['name']} (new site {i})"} for i in range(n)]
+    return new
+
+
+class _IndexedRows(ProviderRows):
+    """ProviderRows as served without NumPy: the row index instead of the column engine."""
+
+    def columns(self) -> None:
+        return None
+
+
+def bench_delta(path: str, rows: int, repeat: int, memory: bool) -> List[Dict[str, Any]]:
+    """
+    DirectoryRefresher.refresh() (rebase + prewarm) of a directory with a 1% change, for the
+    column engine and for the row index (no NumPy): first load (full build) vs on top of a
+    live version (the columns are rebuilt; the row index is diffed + delta-applied).
+    """
+    from pipelines.provider_refresh import DirectoryRefresher
+
+    providers = scrape_json_url(path)
+    refreshed = mutate(providers, 0.01)
+    results = []
+    for engine, cls in (("columns", ProviderRows), ("index", _IndexedRows)):
+        refresher = DirectoryRefresher(lambda: cls(refreshed), interval_s=0, prewarm_zips=[])
+        live = cls(providers)
+        refresher._prewarm(live)
+
+        def refresh(previous: Any) -> None:
+            refresher._current = previous
+            refresher.refresh()
+
+        results.append(measure(f"refresh.{engine}.first_load", rows, lambda: refresh(None), repeat, memory))
+        results.append(measure(f"refresh.{engine}.on_live", rows, lambda: refresh(live), repeat, memory))
+    return results
+
+
+def bench_graph(path: str, rows: int, requests: int, latency: str, memory: bool) -> Dict[str, Any]:
+    from agents.caregiver_agent import CaregiverCompanionAgent
+    from agents.provider_agent import ProviderAgent
+    from graphs.final_graph import build_final_graph
+
+    caregiver = CaregiverCompanionAgent(client=SimulatedChatModel(latency=latency, seed=1))
+    provider = ProviderAgent(llm=SimulatedChatModel(latency=latency, seed=2), directory_url=path)
+    app = build_final_graph(caregiver, provider)
+
+    counter = {"i": 0}
+
+    def one_request():
+        q = GRAPH_QUERIES[counter["i"] % len(GRAPH_QUERIES)]
+        counter["i"] += 1
+        app.invoke({"mode": None, "text": q})
+
+    return measure("build_final_graph", rows, one_request, requests, memory)
+
+
+def bench_caregiver_batch(notes: int, latency: str, concurrency: int) -> List[Dict[str, Any]]:
+    """Notes per minute: one summarize_and_explain call per note vs summarize_many."""
+    from agents.caregiver_agent import CaregiverCompanionAgent
+
+    agent = CaregiverCompanionAgent(client=SimulatedChatModel(latency=latency, seed=3))
+    batch = [GRAPH_QUERIES[3 + i % 2] for i in range(notes)]
+    results = []
+    for name, run in (
+        ("caregiver.serial", lambda: [agent.summarize_and_explain(n) for n in batch]),
+        ("caregiver.summarize_many", lambda: list(agent.summarize_many(batch, max_concurrency=concurrency))),
+    ):
+        t0 = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - t0
+        results.append({"benchmark": name, "rows": notes, "runs": 1, "p50_ms": elapsed * 1000.0,
+                        "notes_per_minute": notes / elapsed * 60.0})
+        print(f"  {name:<30} notes={notes:<8} {elapsed:>8.2f} s  {notes / elapsed * 60.0:>10.1f} notes/min")
+    return results
+
+
+def bench_hedge(calls: int, latency: str) -> List[Dict[str, Any]]:
+    """Caregiver summary latency percentiles: primary model only vs hedged to a secondary."""
+    from agents.caregiver_agent import CaregiverCompanionAgent
+    from utils.llm_utils import HedgePolicy
+
+    results = []
+    for name, hedged in (("hedge.off", False), ("hedge.on", True)):
+        secondary = SimulatedChatModel(latency=latency, seed=11, model_name="simulated-secondary")
+        hedge = HedgePolicy(secondary, min_delay_s=0.0) if hedged else None
+        agent = CaregiverCompanionAgent(client=SimulatedChatModel(latency=latency, seed=7), hedge=hedge)
+        durations = []
+        for i in range(calls):
+            t0 = time.perf_counter()
+            agent.summarize_and_explain(GRAPH_QUERIES[3 + i % 2])
+            durations.append(time.perf_counter() - t0)
+        ms = [d * 1000.0 for d in durations]
+        stats = hedge.summary() if hedge else {}
+        row = {"benchmark": name, "rows": calls, "runs": calls, "p50_ms": percentile(ms, 50),
+               "p95_ms": percentile(ms, 95), "p99_ms": percentile(ms, 99),
+               "hedge_rate": stats.get("hedge_rate", 0.0), "p99_saved_s": stats.get("p99_saved_s")}
+        results.append(row)
+        print(f"  {name:<30} calls={calls:<7} p50={row['p50_ms']:>8.1f} ms  p95={row['p95_ms']:>8.1f} ms  "
+              f"p99={row['p99_ms']:>8.1f} ms  hedge_rate={row['hedge_rate']:.2%}  "
+              f"p99_saved_s={row['p99_saved_s']}")
+    return results
+
+
+def bench_embeddings(texts: int, concurrency: int, workers: int) -> List[Dict[str, Any]]:
+    """Texts/sec from `concurrency` caller threads embedding one text each call."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from utils.embedding_service import EmbeddingService
+
+    encoder = SimulatedEncoder()
+    corpus = [f"What are the symptoms of condition {i}?" for i in range(texts)]
+    services = {"embed.service": EmbeddingService("bench", encoder=encoder)}
+    if workers > 0:
+        services["embed.service_pool"] = EmbeddingService("bench", encoder=encoder, workers=workers)
+        services["embed.service_pool"].embed(["warmup"])  # start the workers outside the timing
+    cases = [("embed.per_call", lambda t: encoder([t])[0])]
+    cases += [(name, svc.embed_one) for name, svc in services.items()]
+    cases.append(("embed.cached", services["embed.service"].embed_one))  # same texts again
+
+    results = []
+    for name, embed_one in cases:
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as ex:
+            list(ex.map(embed_one, corpus))
+        elapsed = time.perf_counter() - t0
+        row = {"benchmark": name, "rows": texts, "runs": 1, "p50_ms": elapsed * 1000.0,
+               "texts_per_s": texts / elapsed}
+        results.append(row)
+        print(f"  {name:<30} texts={texts:<8} {elapsed:>8.2f} s  {row['texts_per_s']:>10.1f} texts/s")
+    for svc in services.values():
+        svc.close()
+    return results
+
+
+def bench_scheduler(path: str, rows: int, long_notes: int, lookups: int, workers: int) -> List[Dict[str, Any]]:
+    """
+    A backlog of long caregiver notes (slow LLM), then provider lookups arriving every 50 ms:
+    lookup and note latency through one FIFO pool vs the RequestScheduler, same worker count.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from agents.caregiver_agent import CaregiverCompanionAgent
+    from agents.provider_agent import ProviderAgent
+    from graphs.final_graph import build_final_graph
+    from orchestrators.request_scheduler import RequestScheduler
+
+    caregiver = CaregiverCompanionAgent(client=SimulatedChatModel(latency="fixed:2.0", model_name="simulated-long"))
+    provider = ProviderAgent(llm=SimulatedChatModel(latency="lognormal:0.1,0.3", seed=5, model_name="simulated-fast"),
+                             directory_url=path)
+    app = build_final_graph(caregiver, provider)
+    app.invoke({"mode": None, "text": GRAPH_QUERIES[0]})  # load the directory outside the timing
+    note = "Please summarize these notes:\n" + "\n".join(
+        f"Visit {i}: BP {120 + i % 40}/{80 + i % 15}, lisinopril {10 + i % 3 * 10} mg daily, recheck in {i % 4 + 1} weeks."
+        for i in range(400)
+    )
+
+    def timed(submit: Callable[[Dict[str, Any]], Any], state: Dict[str, Any], latencies: List[float]):
+        t0 = time.perf_counter()
+        future = submit(state)
+        future.add_done_callback(lambda f: latencies.append((time.perf_counter() - t0) * 1000.0))
+        return future
+
+    results = []
+    for name in ("scheduler.fifo", "scheduler.weighted"):
+        if name == "scheduler.fifo":
+            pool = ThreadPoolExecutor(workers)
+            submit, close = (lambda st: pool.submit(app.invoke, st)), pool.shutdown
+        else:
+            sched = RequestScheduler(app, workers=workers)
+            submit, close = sched.submit, sched.close
+        started = time.perf_counter()
+        note_ms: List[float] = []
+        lookup_ms: List[float] = []
+        futures = [timed(submit, {"mode": None, "text": note}, note_ms) for _ in range(long_notes)]
+        for i in range(lookups):
+            futures.append(timed(submit, {"mode": None, "text": GRAPH_QUERIES[i % 3]}, lookup_ms))
+            time.sleep(0.05)
+        for f in futures:
+            f.result()
+        drained = time.perf_counter() - started
+        close()
+        row = {"benchmark": name, "rows": rows, "runs": lookups, "p50_ms": percentile(lookup_ms, 50),
+               "p95_ms": percentile(lookup_ms, 95), "note_p50_ms": percentile(note_ms, 50), "notes_drained_s": drained}
+        results.append(row)
+        print(f"  {name:<30} lookups={lookups:<6} p50={row['p50_ms']:>8.1f} ms  p95={row['p95_ms']:>8.1f} ms  "
+              f"{long_notes} long notes drained in {drained:.2f} s")
+    return results
+
+
+# Runs the pre-fork server in a fresh interpreter (a forking parent must not have other threads)
+_PREFORK_SERVER = """
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks.fake_llm import SimulatedChatModel
+from orchestrators.prefork_server import PreforkServer
+
+def factory(snapshot_path):
+    from agents.caregiver_agent import CaregiverCompanionAgent
+    from agents.provider_agent import ProviderAgent
+    from graphs.final_graph import build_final_graph
+    llm = SimulatedChatModel(latency={latency!r})
+    source = {{"snapshot_path": snapshot_path}} if snapshot_path else {{"snapshot_path": None, "directory_url": {path!r}}}
+    provider = ProviderAgent(llm=llm, refresh_interval_s=0, **source)
+    return build_final_graph(CaregiverCompanionAgent(client=llm), provider, speculate_below=0)
+
+PreforkServer(factory, workers={workers}, port=0, snapshot_path={snap!r}, threads=4).serve_forever()
+"""
+
+
+def _prefork_run(path: str, snap: Optional[str], workers: int, requests: int, concurrency: int,
+                 latency: str) -> Dict[str, Any]:
+    """Start a pre-fork server, time `requests` provider lookups from `concurrency` clients, read its memory."""
+    import http.client
+    import re
+    import signal
+    from concurrent.futures import ThreadPoolExecutor
+
+    from orchestrators.prefork_server import child_pids, memory_report
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = _PREFORK_SERVER.format(root=root, path=path, snap=snap, workers=workers, latency=latency)
+    log = tempfile.NamedTemporaryFile("w+", suffix=".log", delete=False)
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=log, stderr=subprocess.STDOUT, cwd=root)
+    try:
+        port = None
+        for _ in range(600):
+            with open(log.name) as f:
+                m = re.search(r"Serving on http://[\d.]+:(\d+)", f.read())
+            if m:
+                port = int(m.group(1))
+                break
+            if proc.poll() is not None:
+                break
+            time.sleep(0.1)
+        if port is None:
+            with open(log.name) as f:
+                raise RuntimeError(f"pre-fork server did not start:\n{f.read()[-2000:]}")
+
+        def lookup(i: int) -> float:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)  # new connection: any worker
+            t0 = time.perf_counter()
+            conn.request("POST", "/invoke", json.dumps({"text": GRAPH_QUERIES[i % 3], "mode": "provider"}))
+            body = conn.getresponse().read()
+            conn.close()
+            if b"response_text" not in body:
+                raise RuntimeError(f"pre-fork request failed: {body[:200]!r}")
+            return (time.perf_counter() - t0) * 1000.0
+
+        with ThreadPoolExecutor(concurrency) as ex:
+            list(ex.map(lookup, range(max(4 * workers, concurrency))))  # every worker loads + warms
+            t0 = time.perf_counter()
+            latencies = list(ex.map(lookup, range(requests)))
+            elapsed = time.perf_counter() - t0
+        pids = child_pids(proc.pid)
+        memory = memory_report([proc.pid, *pids])
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=60)
+        os.unlink(log.name)
+    per_worker = [memory["processes"][p] for p in pids if p in memory["processes"]]
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "throughput_per_s": requests / elapsed,
+        "total_pss_mb": memory["total_pss_mb"],
+        "total_rss_mb": memory["total_rss_mb"],
+        "worker_private_mb": (sum(m["private_mb"] for m in per_worker) / len(per_worker)) if per_worker else None,
+    }
+
+
+def bench_prefork(path: str, rows: int, workers: int, requests: int, concurrency: int) -> List[Dict[str, Any]]:
+    """
+    Provider lookups (instant simulated LLM, so the work is CPU) through the pre-fork server:
+    1 vs `workers` processes over the shared snapshot, and `workers` processes that each parse
+    the JSON directory themselves. Throughput only scales with workers up to the free cores.
+    """
+    snap = os.path.splitext(path)[0] + ".snap"
+    if not os.path.exists(snap):
+        compile_snapshot(scrape_json_url(path), snap)
+    cases = [("prefork.snapshot", snap, 1), ("prefork.snapshot", snap, workers), ("prefork.json", None, workers)]
+    results = []
+    for name, source, n in cases:
+        stats = _prefork_run(path, source, n, requests, concurrency, "fixed:0.0")
+        row = {"benchmark": f"{name}.w{n}", "rows": rows, "runs": requests, "workers": n, **stats}
+        results.append(row)
+        print(f"  {row['benchmark']:<30} rows={rows:<9} {stats['throughput_per_s']:>8.1f} req/s  "
+              f"p50={stats['p50_ms']:>8.1f} ms  total PSS={stats['total_pss_mb']:.0f} MB  "
+              f"private/worker={stats['worker_private_mb'] or 0:.0f} MB")
+    return results
+
+
+# ----------------------------
+# Results
+# ----------------------------
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(RESULTS_DIR)).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: List[Dict[str, Any]], previous_path: str) -> None:
+    with open(previous_path, encoding="utf-8") as f:
+        prev = {(r["benchmark"], r["rows"]): r for r in json.load(f)["results"]}
+    print(f"\nComparison with {previous_path} (p50):")
+    for r in current:
+        old = prev.get((r["benchmark"], r["rows"]))
+        if not old:
+            continue
+        change = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100.0 if old["p50_ms"] else 0.0
+        print(f"  {r['benchmark']:<30} rows={r['rows']:<9} {old['p50_ms']:>10.2f} -> {r['p50_ms']:>10.2f} ms ({change:+.1f}%)")
+
+
+def parse_args() -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Offline benchmark suite")
+    p.add_argument("--rows", type=int, nargs="+", default=[10000, 100000],
+                   help="Synthetic directory sizes in address rows (e.g. 10000 1000000 5000000)")
+    p.add_argument("--repeat", type=int, default=5, help="Timed runs per micro-benchmark")
+    p.add_argument("--only", nargs="+",
+                   default=["scrape", "filter_zip", "filter_specialty", "columns", "stream", "retriever", "snapshot",
+                            "refresh", "caregiver_batch", "hedge", "embeddings", "scheduler", "prefork", "graph"],
+                   help="Subset of: scrape filter_zip filter_specialty columns stream retriever snapshot refresh "
+                        "caregiver_batch hedge embeddings scheduler prefork graph")
+    p.add_argument("--llm-latency", default="lognormal:0.6,0.4",
+                   help="Simulated LLM latency: fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA")
+    p.add_argument("--graph-requests", type=int, default=20, help="Requests for the full-graph benchmark")
+    p.add_argument("--batch-notes", type=int, default=40, help="Notes for the caregiver batch benchmark")
+    p.add_argument("--batch-concurrency", type=int, default=8, help="summarize_many max_concurrency")
+    p.add_argument("--hedge-calls", type=int, default=200, help="Sequential calls for the hedging benchmark")
+    p.add_argument("--hedge-latency", default="lognormal:0.05,0.8",
+                   help="Simulated latency of both models in the hedging benchmark (long-tailed)")
+    p.add_argument("--embed-texts", type=int, default=2000, help="Texts for the embedding benchmark")
+    p.add_argument("--embed-concurrency", type=int, default=16, help="Caller threads in the embedding benchmark")
+    p.add_argument("--embed-workers", type=int, default=min(4, os.cpu_count() or 1),
+                   help="Worker processes for the pooled embedding service (0 = skip)")
+    p.add_argument("--sched-workers", type=int, default=8, help="Workers for the scheduler benchmark")
+    p.add_argument("--sched-notes", type=int, default=24, help="Long caregiver notes queued first")
+    p.add_argument("--sched-lookups", type=int, default=40, help="Provider lookups arriving behind them")
+    p.add_argument("--prefork-workers", type=int, default=max(2, os.cpu_count() or 1),
+                   help="Worker processes for the pre-fork server benchmark")
+    p.add_argument("--prefork-requests", type=int, default=400, help="Timed requests for the pre-fork benchmark")
+    p.add_argument("--prefork-concurrency", type=int, default=16, help="Client threads in the pre-fork benchmark")
+    p.add_argument("--graph-rows", type=int, default=None,
+                   help="Directory size for the full-graph benchmark (default: smallest --rows)")
+    p.add_argument("--no-memory", action="store_true", help="Skip tracemalloc peak-memory passes")
+    p.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "healthlight-bench"))
+    p.add_argument("--out", default=None, help="Results JSON path (default benchmarks/results/bench-<ts>.json)")
+    p.add_argument("--compare", default=None, help="Previous results JSON to compare against")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.makedirs(args.data_dir, exist_ok=True)
+    memory = not args.no_memory
+
+    def directory(rows: int) -> str:
+        path = os.path.join(args.data_dir, f"providers_{rows}.json")
+        if not os.path.exists(path):
+            print(f"Generating synthetic directory with {rows} rows -> {path}")
+            write_directory(path, rows)
+        return path
+
+    results: List[Dict[str, Any]] = []
+    for rows in args.rows:
+        print(f"\n== {rows} address rows ==")
+        results.extend(bench_pipeline(directory(rows), rows, args.repeat, memory, args.only))
+        if "snapshot" in args.only:
+            results.extend(bench_snapshot(directory(rows), rows, args.repeat, memory))
+        if "refresh" in args.only:
+            results.extend(bench_delta(directory(rows), rows, args.repeat, memory))
+
+    if "caregiver_batch" in args.only:
+        print(f"\n== caregiver notes ({args.batch_notes} notes, LLM latency {args.llm_latency}) ==")
+        results.extend(bench_caregiver_batch(args.batch_notes, args.llm_latency, args.batch_concurrency))
+
+    if "hedge" in args.only:
+        print(f"\n== hedged caregiver calls ({args.hedge_calls} calls, LLM latency {args.hedge_latency}) ==")
+        results.extend(bench_hedge(args.hedge_calls, args.hedge_latency))
+
+    if "embeddings" in args.only:
+        print(f"\n== embeddings ({args.embed_texts} texts, {args.embed_concurrency} callers, "
+              f"{args.embed_workers} workers) ==")
+        results.extend(bench_embeddings(args.embed_texts, args.embed_concurrency, args.embed_workers))
+
+    if "scheduler" in args.only:
+        rows = args.graph_rows or min(args.rows)
+        print(f"\n== request scheduler ({rows} rows, {args.sched_workers} workers) ==")
+        results.extend(bench_scheduler(directory(rows), rows, args.sched_notes, args.sched_lookups,
+                                       args.sched_workers))
+
+    if "prefork" in args.only:
+        rows = args.graph_rows or min(args.rows)
+        print(f"\n== pre-fork server ({rows} rows, {args.prefork_workers} workers, {os.cpu_count()} CPUs) ==")
+        results.extend(bench_prefork(directory(rows), rows, args.prefork_workers, args.prefork_requests,
+                                     args.prefork_concurrency))
+
+    if "graph" in args.only:
+        rows = args.graph_rows or min(args.rows)
+        print(f"\n== build_final_graph ({rows} rows, LLM latency {args.llm_latency}) ==")
+        results.append(bench_graph(directory(rows), rows, args.graph_requests, args.llm_latency, memory))
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Synthetic Anthem-format (CMS QHP provider directory) JSON for benchmarks.
+
+Each provider has 1–3 addresses, so `rows` is the number of address rows that
+scrape_json_url() will produce. ZIPs are drawn from the `zipcodes` DB (California)
+when available, so radius filtering behaves like the real directory.
+
+Usage:
+  python -m benchmarks.synthetic_directory --rows 100000 --out /tmp/providers_100k.json
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, Iterator, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import zipcodes
+except Exception:
+    zipcodes = None
+
+SPECIALTIES = [
+    "Family Medicine", "Internal Medicine", "Pediatrics", "Obstetrics & Gynecology",
+    "Gastroenterology", "Colon and Rectal Surgery", "General Surgery", "Radiology",
+    "Diagnostic Radiology", "Cardiology", "Cardiovascular Disease", "Orthopedic Surgery",
+    "Physical Therapy", "Psychiatry", "Psychology", "Dermatology", "Urology",
+    "Ophthalmology", "Optometry", "Dentistry", "Nurse Practitioner", "Physician Assistant",
+]
+FIRST = ["Maria", "James", "Linda", "Wei", "Ana", "David", "Priya", "Jose", "Kim", "Sarah", "Omar", "Grace"]
+LAST = ["Garcia", "Nguyen", "Smith", "Chen", "Lopez", "Patel", "Kim", "Johnson", "Martinez", "Lee", "Wong", "Davis"]
+STREETS = ["Main St", "Valley Blvd", "Garvey Ave", "Huntington Dr", "Atlantic Blvd", "Rosemead Blvd", "Colorado Blvd"]
+
+# Query ZIP used by the benchmarks; always included in the ZIP pool
+BENCH_ZIP = "91770"
+
+
+def zip_pool(state: str = "CA") -> List[Dict[str, str]]:
+    """[{zip, city, state}] to draw addresses from."""
+    if zipcodes:
+        pool = [
+            {"zip": z["zip_code"], "city": z.get("city", ""), "state": z.get("state", state)}
+            for z in zipcodes.filter_by(state=state)
+            if z.get("zip_code_type", "STANDARD") == "STANDARD"
+        ]
+        if pool:
+            return pool
+    # No zipcodes DB: a plain numeric range around the benchmark ZIP
+    return [{"zip": str(z), "city": "CITY", "state": state} for z in range(91700, 91800)]
+
+
+def iter_providers(rows: int, seed: int = 7, state: str = "CA") -> Iterator[Dict[str, Any]]:
+    """Yield provider objects until `rows` address rows have been produced."""
+    rng = random.Random(seed)
+    pool = zip_pool(state)
+    local = [z for z in pool if z["zip"].startswith(BENCH_ZIP[:3])] or pool
+    produced = 0
+    npi = 1000000000
+    while produced < rows:
+        npi += 1
+        n_addr = min(rows - produced, rng.choice((1, 1, 1, 2, 2, 3)))
+        individual = rng.random() < 0.8
+        specs = rng.sample(SPECIALTIES, rng.choice((1, 1, 2)))
+        addresses = []
+        for _ in range(n_addr):
+            # ~10% of rows cluster near the benchmark ZIP so radius queries return something
+            z = rng.choice(local) if rng.random() < 0.1 else rng.choice(pool)
+            addresses.append({
+                "address": f"{rng.randint(1, 9999)} {rng.choice(STREETS)}",
+                "city": z["city"],
+                "state": z["state"],
+                "zip": z["zip"],
+                "phone": f"{rng.randint(200, 999)}{rng.randint(2000000, 9999999)}",
+            })
+        provider: Dict[str, Any] = {
+            "npi": str(npi),
+            "type": "INDIVIDUAL" if individual else "FACILITY",
+            "specialty": specs,
+            "accepting": rng.choice(["accepting", "not accepting"]),
+            "addresses": addresses,
+        }
+        if individual:
+            provider["name"] = {"first": rng.choice(FIRST), "last": rng.choice(LAST)}
+        else:
+            provider["facility_name"] = f"{rng.choice(LAST)} {rng.choice(['Medical Group', 'Imaging Center', 'Clinic'])}"
+        produced += n_addr
+        yield provider
+
+
+def write_directory(path: str, rows: int, seed: int = 7) -> str:
+    """Stream a synthetic directory with `rows` address rows to `path` (a JSON array)."""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for i, provider in enumerate(iter_providers(rows, seed=seed)):
+            if i:
+                f.write(",")
+            f.write(json.dumps(provider, separators=(",", ":")))
+        f.write("]")
+    return path
+
+
+def main():
+    p = argparse.ArgumentParser(description="Generate a synthetic Anthem-format provider directory")
+    p.add_argument("--rows", type=int, default=10000, help="Number of address rows (default 10000)")
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--out", required=True, help="Output JSON path")
+    args = p.parse_args()
+    write_directory(args.out, args.rows, seed=args.seed)
+    print(f"Wrote {args.rows} address rows to {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
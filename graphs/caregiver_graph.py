@@ -1,6 +1,7 @@
 from langgraph.graph import StateGraph, START, END
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+from utils.tracing import span
 
 
 class CaregiverState(BaseModel):
@@ -10,6 +11,13 @@ class CaregiverState(BaseModel):
     action_items: Optional[List[str]] = None
 
 
+class CaregiverBatchState(BaseModel):
+    notes: List[str]
+    results: Optional[List[Dict[str, Any]]] = None   # one per note, in input order
+    errors: Optional[int] = None
+    notes_per_minute: Optional[float] = None
+
+
 def build_caregiver_graph(agent):
     """
     Build a LangGraph pipeline for the Caregiver Companion agent.
@@ -17,7 +25,8 @@ def build_caregiver_graph(agent):
     """
 
     def summarize_and_explain_node(state: CaregiverState):
-        result = agent.summarize_and_explain(state.notes)
+        with span("graph.caregiver.summarize_and_explain", note_chars=len(state.notes)):
+            result = agent.summarize_and_explain(state.notes)
         return {
             "summary": result.get("summary"),
             "explanations": result.get("explanations"),
@@ -34,3 +43,26 @@ def build_caregiver_graph(agent):
 
     # Compile the graph to an executable app
     return graph.compile()
+
+
+def build_caregiver_batch_graph(agent, max_concurrency: Optional[int] = None):
+    """
+    Bulk variant of the caregiver graph: {"notes": [...]} in, one result per note out
+    (in input order; a failed note has an "error" key). Uses agent.summarize_many.
+    """
+
+    def summarize_many_node(state: CaregiverBatchState):
+        kwargs = {"max_concurrency": max_concurrency} if max_concurrency else {}
+        results: List[Optional[Dict[str, Any]]] = [None] * len(state.notes)
+        with span("graph.caregiver.summarize_many", notes=len(state.notes)) as s:
+            for i, result in agent.summarize_many(state.notes, **kwargs):
+                results[i] = result
+            stats = agent.last_batch
+            s.set(errors=stats.errors, notes_per_minute=round(stats.notes_per_minute, 1))
+        return {"results": results, "errors": stats.errors, "notes_per_minute": stats.notes_per_minute}
+
+    graph = StateGraph(CaregiverBatchState)
+    graph.add_node("summarize_many", summarize_many_node)
+    graph.add_edge(START, "summarize_many")
+    graph.add_edge("summarize_many", END)
+    return graph.compile()
@@ -11,17 +11,48 @@ Routing:
   - Else we auto-detect:
       * If text contains a 5-digit ZIP or provider-ish terms  -> 'provider'
       * Otherwise                                              -> 'caregiver'
+    together with a confidence score. Below `speculate_below`, both branches start in
+    parallel while a fast classifier decides; the graph keeps the confirmed branch and
+    cancels the other, so an ambiguous request costs one round trip instead of two.
+
+Sessions:
+  - Compiled with a checkpointer (graphs/session.py), the graph keeps each thread's state
+    between turns, including the provider session (last ZIP, procedure and candidate set).
+    A short follow-up with a provider cue (a radius or a specialty, e.g. "any within 40
+    miles?", "only cardiology") is then routed to the provider branch and answered by
+    re-ranking those candidates.
+
+Deadlines:
+  - Each request gets a deadline (`deadline_s`, default REQUEST_DEADLINE_S; none if unset).
+    Every node runs under it (utils.deadline), so each fetch and LLM call gets the remaining
+    budget as its timeout and is cancelled when it runs out. The node then returns the best
+    partial result: providers with a templated summary instead of the LLM one, or a notice
+    that the caregiver summary did not finish (`deadline_exceeded`).
 """
 
 from __future__ import annotations
-from typing import TypedDict, Optional, Dict, Any
+from typing import TypedDict, Optional, Dict, Any, Callable, Tuple, Union, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import os
 import re
+import threading
 
 from langgraph.graph import StateGraph, START, END
-from agents.caregiver_agent import CaregiverCompanionAgent
+from langchain_core.messages import SystemMessage, HumanMessage
 from graphs.caregiver_graph import build_caregiver_graph
-from agents.provider_agent import ProviderAgent
 from graphs.provider_graph import build_provider_graph
+from utils.cancel_utils import run_cancellable
+from utils.deadline import DEFAULT_REQUEST_DEADLINE_S, deadline_after, deadline_scope
+from utils.lazy import Lazy, resolve
+from utils.llm_utils import invoke_with_timeout
+from utils.tracing import traced
+
+if TYPE_CHECKING:
+    # Agent modules pull in the LLM client libraries; only import them for type hints.
+    from agents.caregiver_agent import CaregiverCompanionAgent
+    from agents.provider_agent import ProviderAgent
 
 # ----------------------------
 # Combined Graph State
@@ -32,13 +63,23 @@ class CombinedState(TypedDict, total=False):
     text: str                 # generic input; for caregiver: notes, for provider: query
     notes: str                # explicit caregiver input (optional)
     user_input: str           # explicit provider input (optional)
+    latency_budget_s: float   # provider latency budget in seconds (optional)
+    deadline_s: float         # whole-request deadline in seconds (optional; default REQUEST_DEADLINE_S)
 
     # Internals
     routed_mode: str          # final resolved mode
+    route_confidence: float   # 0..1 confidence of the heuristic router
+    speculative: bool         # True if both branches were started and one was cancelled
+    deadline_at: float        # this turn's deadline (time.monotonic()); None without one
 
     # Outputs
     response_text: str        # unified textual response
     raw_result: Dict[str, Any]  # full raw result from subgraph (for caregiver it may be a dict)
+    response_tier: str        # provider only: 'llm' | 'template'
+    deadline_exceeded: bool   # True if the deadline cut the work short (partial result)
+
+    # Session (persisted by the checkpointer, if any)
+    session: Dict[str, Any]   # provider follow-up state (agents.provider_agent.ProviderSession)
 
 # ----------------------------
 # Intent Router
@@ -49,32 +90,137 @@ PROVIDER_HINTS = [
     "gastro", "orthopedic", "therapy", "imaging",
 ]
 
+CAREGIVER_HINTS = [
+    "summarize", "summary", "explain", "notes", "patient", "diagnos", "prescribed",
+    "medication", "symptom", "follow-up", "vital", "history of", " mg",
+]
+
 ZIP_RE = re.compile(r"\b\d{5}\b")
 
-def _auto_route(text: str) -> str:
+# Below this router confidence, the graph runs both branches speculatively.
+SPECULATE_BELOW = 0.6
+
+# Shared pool for the two speculative branches (threads start on first use and are reused);
+# concurrent low-confidence requests queue for it.
+SPECULATE_WORKERS = 2
+_speculate_pool = ThreadPoolExecutor(max_workers=SPECULATE_WORKERS, thread_name_prefix="speculate")
+
+
+def _reset_speculate_pool() -> None:
+    """A forked worker inherits the pool but not its threads; give it a fresh one."""
+    global _speculate_pool
+    _speculate_pool = ThreadPoolExecutor(max_workers=SPECULATE_WORKERS, thread_name_prefix="speculate")
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_speculate_pool)
+
+# Longest text treated as a provider follow-up when a provider session is active
+FOLLOW_UP_MAX_CHARS = 80
+
+def _score_route(text: str) -> Tuple[str, float]:
+    """Keyword/ZIP heuristic. Returns (mode, confidence in 0..1)."""
     if not text:
-        return "caregiver"
+        return "caregiver", 1.0
     if ZIP_RE.search(text):
-        return "provider"
+        return "provider", 0.95
+    t = text.lower()
+    p_hits = sum(h in t for h in PROVIDER_HINTS)
+    c_hits = sum(h in t for h in CAREGIVER_HINTS)
+    if p_hits:
+        # Any provider hint wins (original behaviour); caregiver hints make it doubtful.
+        return "provider", min(0.9, max(0.3, 0.6 + 0.1 * p_hits - 0.15 * c_hits))
+    if c_hits:
+        return "caregiver", min(0.95, 0.7 + 0.05 * c_hits)
+    # No hints at all: a note to summarize, or a greeting / one-liner with no provider
+    # search in it; either way the caregiver branch (original behaviour), without speculation.
+    return "caregiver", 0.75
+
+def _auto_route(text: str) -> str:
+    return _score_route(text)[0]
+
+# Provider cues in a follow-up turn: a radius ("within 40 miles", "any closer?"), or a
+# specialty / procedure / provider word ("only cardiology", "pediatricians?", "a dentist")
+_RADIUS_CUE = re.compile(r"\b\d{1,3}\s*(?:mi|miles?)\b|\b(?:closer|nearer|farther|further away|radius)\b")
+_SPECIALTY_CUE = re.compile(
+    r"\b(?:\w+(?:ology|ologists?|iatry|iatrists?|iatrics?|surgery|surgeons?|therapy|therapists?|imaging)"
+    r"|ob/?gyn|ent|ct|ultrasound|mammogram|endoscopy|dentists?|dental|optometrists?|chiropractors?|"
+    r"doctors?|physicians?|clinics?|hospitals?|specialists?|providers?|urgent care|primary care)\b"
+)
+
+def _has_provider_cue(text: str) -> bool:
     t = text.lower()
-    if any(h in t for h in PROVIDER_HINTS):
-        return "provider"
-    return "caregiver"
+    return bool(_RADIUS_CUE.search(t) or _SPECIALTY_CUE.search(t) or any(h in t for h in PROVIDER_HINTS))
+
+def _is_follow_up(text: str, session: Optional[Dict[str, Any]]) -> bool:
+    """
+    A short turn with a provider cue and no caregiver hints while a provider session is
+    active ("any within 40 miles?", "only cardiology"). Anything else ("hello", "what does
+    hypertension mean?") is routed as usual.
+    """
+    if not (session and session.get("zip_code")) or not text or len(text) > FOLLOW_UP_MAX_CHARS:
+        return False
+    t = text.lower()
+    return not any(h in t for h in CAREGIVER_HINTS) and _has_provider_cue(t)
+
+ROUTE_CLASSIFIER_PROMPT = (
+    "Classify the user's request. Answer with exactly one word:\n"
+    "provider  - they want to find doctors, clinics, or facilities\n"
+    "caregiver - they want medical notes summarized or explained"
+)
+
+def make_llm_route_classifier(llm, timeout_s: float = 5.0) -> Callable[[str], str]:
+    """Fast one-word LLM classifier used to confirm a speculative route. `llm` may be a Lazy."""
+    def classify(text: str) -> str:
+        messages = [SystemMessage(content=ROUTE_CLASSIFIER_PROMPT), HumanMessage(content=text[:2000])]
+        answer = invoke_with_timeout(resolve(llm), messages, timeout_s, stage="route_classifier").content.strip().lower()
+        if "provider" in answer:
+            return "provider"
+        if "caregiver" in answer:
+            return "caregiver"
+        raise ValueError(f"Unexpected classifier answer: {answer!r}")
+    return classify
 
 # ----------------------------
 # Nodes
 # ----------------------------
+# Agents may be passed as Lazy factories; they are built the first time their route runs.
+AgentArg = Union["CaregiverCompanionAgent", "ProviderAgent", Lazy]
+
+# Compiled subgraphs are cached per agent instead of being rebuilt on every request.
+_caregiver_app = functools.lru_cache(maxsize=8)(build_caregiver_graph)
+_provider_app = functools.lru_cache(maxsize=8)(build_provider_graph)
+
+def _under_deadline(node: Callable[..., CombinedState]) -> Callable[..., CombinedState]:
+    """Run a node under the request deadline stored in the state by node_route."""
+    @functools.wraps(node)
+    def run(state: CombinedState, **kwargs: Any) -> CombinedState:
+        with deadline_scope(state.get("deadline_at")):
+            return node(state, **kwargs)
+    return run
+
+DEADLINE_NOTICE = "⚠️ The request ran out of time before {what} finished. Please try again."
+
+@traced("graph.final.route")
 def node_route(state: CombinedState) -> CombinedState:
     # Priority: explicit mode > auto-detect
     if state.get("mode") in ("caregiver", "provider"):
-        routed = state["mode"]
+        routed, confidence = state["mode"], 1.0
     else:
         # pick a text field to inspect
         txt = state.get("text") or state.get("user_input") or state.get("notes") or ""
-        routed = _auto_route(txt)
-    return {**state, "routed_mode": routed}
+        if _is_follow_up(txt, state.get("session")):
+            routed, confidence = "provider", 0.9
+        else:
+            routed, confidence = _score_route(txt)
+    # A new deadline every turn (a checkpointed thread keeps the state of earlier turns)
+    deadline_at = deadline_after(state.get("deadline_s") or DEFAULT_REQUEST_DEADLINE_S)
+    return {**state, "routed_mode": routed, "route_confidence": confidence, "speculative": False,
+            "deadline_at": deadline_at, "deadline_exceeded": False}
 
-def node_run_caregiver(state: CombinedState, *, caregiver_agent: CaregiverCompanionAgent) -> CombinedState:
+@traced("graph.final.caregiver")
+@_under_deadline
+def node_run_caregiver(state: CombinedState, *, caregiver_agent: AgentArg) -> CombinedState:
     """
     Delegates to the caregiver graph.
     Input precedence for notes:
@@ -82,8 +228,13 @@ def node_run_caregiver(state: CombinedState, *, caregiver_agent: CaregiverCompan
       - state.text
     """
     notes = (state.get("notes") or state.get("text") or "").strip()
-    app = build_caregiver_graph(caregiver_agent)
-    result = app.invoke({"notes": notes})  # caregiver graph convention
+    app = _caregiver_app(resolve(caregiver_agent))
+    try:
+        result = app.invoke({"notes": notes})  # caregiver graph convention
+    except TimeoutError:
+        # Nothing partial is worth showing from an unfinished summary
+        return {**state, "raw_result": {"error": "deadline_exceeded"}, "deadline_exceeded": True,
+                "response_text": DEADLINE_NOTICE.format(what="the summary")}
 
     # Many caregiver graphs return structured dict with keys like summary/explanations/action_items.
     # We'll generate a readable response_text here, but also return raw_result for callers.
@@ -105,52 +256,133 @@ def node_run_caregiver(state: CombinedState, *, caregiver_agent: CaregiverCompan
     return {**state, "raw_result": result, "response_text": response_text}
 
 
-def node_run_provider(state: CombinedState, *, provider_agent: ProviderAgent) -> CombinedState:
+@traced("graph.final.provider")
+@_under_deadline
+def node_run_provider(state: CombinedState, *, provider_agent: AgentArg, sessions: bool = False) -> CombinedState:
     """
     Delegates to the provider graph/agent.
     Input precedence for query:
       - state.user_input
       - state.text
+    With sessions (a checkpointer), the provider session is passed along and updated.
+    Under a deadline the agent answers with a templated summary when the LLM one would not
+    fit (response_tier 'template'), so only a search that ran out of time entirely fails.
     """
     query = (state.get("user_input") or state.get("text") or "").strip()
 
     # We can either go through the graph or call the agent directly.
     # For consistency with your provider_graph, we use the graph:
-    app = build_provider_graph(provider_agent)
-    result = app.invoke({"user_input": query})
-    # provider_graph returns {'response_text': "..."}
+    app = _provider_app(resolve(provider_agent))
+    session = (state.get("session") or {}) if sessions else None
+    try:
+        result = app.invoke({"user_input": query, "latency_budget_s": state.get("latency_budget_s"), "session": session})
+    except TimeoutError:
+        return {**state, "raw_result": {"error": "deadline_exceeded"}, "deadline_exceeded": True,
+                "response_text": DEADLINE_NOTICE.format(what="the provider search"), "response_tier": ""}
+    # provider_graph returns {'response_text': "...", 'response_tier': "..."}
     response_text = ""
+    tier = ""
     if isinstance(result, dict):
         response_text = str(result.get("response_text", "")) or str(result)
+        tier = result.get("response_tier", "")
     else:
         response_text = str(result)
 
-    return {**state, "raw_result": result, "response_text": response_text}
+    out = {**state, "raw_result": result, "response_text": response_text, "response_tier": tier}
+    if sessions and isinstance(result, dict) and result.get("session") is not None:
+        out["session"] = result["session"]
+        out["raw_result"] = {k: v for k, v in result.items() if k != "session"}
+    return out
+
+@traced("graph.final.speculate")
+@_under_deadline
+def node_speculate(
+    state: CombinedState,
+    *,
+    caregiver_agent: AgentArg,
+    provider_agent: AgentArg,
+    classifier: Callable[[str], str],
+    sessions: bool = False,
+) -> CombinedState:
+    """
+    Low-confidence route: start both branches and the classifier at once, keep the branch
+    the classifier confirms (heuristic guess if it fails) and cancel the other one.
+    """
+    txt = state.get("text") or state.get("user_input") or state.get("notes") or ""
+    branches = {
+        "caregiver": lambda: node_run_caregiver(state, caregiver_agent=caregiver_agent),
+        "provider": lambda: node_run_provider(state, provider_agent=provider_agent, sessions=sessions),
+    }
+    cancel = {mode: threading.Event() for mode in branches}
+
+    # Each branch runs in a copy of the caller's context, so its spans keep their parent
+    # (and it sees the caller's deadline and cancel signal)
+    futures = {mode: _speculate_pool.submit(contextvars.copy_context().run, run_cancellable, cancel[mode], fn)
+               for mode, fn in branches.items()}
+    try:
+        chosen = classifier(txt)
+    except Exception as e:
+        print(f"⚠️ Route classifier failed, keeping heuristic route ({type(e).__name__}: {e})")
+        chosen = state.get("routed_mode", "caregiver")
+    loser = "caregiver" if chosen == "provider" else "provider"
+    # Don't wait for the cancelled branch; it stops at its next cancellation check and frees
+    # its worker (or never starts, if still queued).
+    cancel[loser].set()
+    futures[loser].cancel()
+    result = futures[chosen].result()
+
+    return {**result, "routed_mode": chosen, "speculative": True}
 
 # ----------------------------
 # Builder
 # ----------------------------
 def build_final_graph(
-    caregiver_agent: CaregiverCompanionAgent,
-    provider_agent: ProviderAgent,
+    caregiver_agent: AgentArg,
+    provider_agent: AgentArg,
+    route_classifier: Optional[Callable[[str], str]] = None,
+    speculate_below: float = SPECULATE_BELOW,
+    checkpointer=None,
 ):
     """
-    START -> route -> (caregiver || provider) -> END
+    START -> route -> (caregiver || provider || speculate) -> END
+
+    Either agent may be a utils.lazy.Lazy factory, so a run that only uses one route never
+    builds (or imports the client library of) the other.
+
+    route_classifier: text -> 'caregiver' | 'provider', used to confirm speculative routes.
+    Defaults to a one-word prompt on the caregiver agent's (Groq) client.
+    Set speculate_below=0 to disable speculation.
+
+    checkpointer: a LangGraph checkpointer (graphs.session.open_checkpointer) to keep
+    conversational sessions; invoke with graphs.session.session_config(thread_id).
     """
+    sessions = checkpointer is not None
+    classifier = route_classifier or make_llm_route_classifier(
+        Lazy(lambda: resolve(caregiver_agent).client, name="route_classifier_llm")
+    )
     builder = StateGraph(CombinedState)
 
     builder.add_node("route", node_route)
     builder.add_node("caregiver", lambda s: node_run_caregiver(s, caregiver_agent=caregiver_agent))
-    builder.add_node("provider", lambda s: node_run_provider(s, provider_agent=provider_agent))
+    builder.add_node("provider", lambda s: node_run_provider(s, provider_agent=provider_agent, sessions=sessions))
+    builder.add_node("speculate", lambda s: node_speculate(
+        s, caregiver_agent=caregiver_agent, provider_agent=provider_agent, classifier=classifier,
+        sessions=sessions,
+    ))
 
     builder.add_edge(START, "route")
 
     def _next(state: CombinedState):
+        if state.get("route_confidence", 1.0) < speculate_below:
+            return "speculate"
         mode = state.get("routed_mode", "caregiver")
         return "provider" if mode == "provider" else "caregiver"
 
-    builder.add_conditional_edges("route", _next, {"caregiver": "caregiver", "provider": "provider"})
+    builder.add_conditional_edges(
+        "route", _next, {"caregiver": "caregiver", "provider": "provider", "speculate": "speculate"}
+    )
     builder.add_edge("caregiver", END)
     builder.add_edge("provider", END)
+    builder.add_edge("speculate", END)
 
-    return builder.compile()
\ No newline at end of file
+    return builder.compile(checkpointer=checkpointer)
\ No newline at end of file
@@ -5,26 +5,41 @@
 Minimal LangGraph wrapper around ProviderAgent.
 - Takes user_input in the graph state
 - Calls ProviderAgent.find_nearby_providers()
-- Returns response_text
+- Returns response_text (plus the response tier that was served)
+- Passes the conversation's provider session in and out, so follow-up turns can re-rank
+  its candidates (the caller's checkpointer persists it)
 """
 
 from __future__ import annotations
-from typing import TypedDict
+from typing import Any, Dict, TypedDict, Optional
 from langgraph.graph import StateGraph, START, END
 from agents.provider_agent import ProviderAgent
+from utils.tracing import traced
 
 
 # Graph State
 class ProviderState(TypedDict, total=False):
     user_input: str
+    latency_budget_s: Optional[float]  # per-request budget (seconds); None = agent default
     response_text: str
+    response_tier: str                 # 'llm' | 'template'
+    tier_reason: str                   # why that tier was served (ok/probe/budget/timeout/error/no_results)
+    elapsed_s: float
+    session: Optional[Dict[str, Any]]  # ProviderSession; None = stateless search
 
 
 # Node: run the agent
+@traced("graph.provider.run_agent")
 def node_run_agent(state: ProviderState, *, agent: ProviderAgent) -> ProviderState:
     user_input = state.get("user_input", "") or ""
-    output = agent.find_nearby_providers(user_input)
-    return {"response_text": output}
+    result = agent.search(user_input, latency_budget_s=state.get("latency_budget_s"), session=state.get("session"))
+    return {
+        "response_text": result["response_text"],
+        "response_tier": result["tier"],
+        "tier_reason": result["tier_reason"],
+        "elapsed_s": result["elapsed_s"],
+        "session": result.get("session"),
+    }
 
 # Builder
 def build_provider_graph(agent: ProviderAgent):
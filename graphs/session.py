@@ -0,0 +1,49 @@
+# graphs/session.py
+"""
+Checkpointers for conversational sessions of the combined graph.
+
+    from graphs.session import DURABILITY, new_thread_id, open_checkpointer, session_config
+
+    app = build_final_graph(caregiver_agent, provider_agent, checkpointer=open_checkpointer())
+    thread = new_thread_id()
+    app.invoke({"text": "MRI near 91770"}, session_config(thread), durability=DURABILITY)
+    app.invoke({"text": "any within 40 miles?"}, session_config(thread), durability=DURABILITY)
+
+The checkpointer keeps each thread's graph state between invocations: in memory by default,
+or in a SQLite file (HEALTHLIGHT_SESSION_DB / --session-db) so sessions survive restarts.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import uuid
+from typing import Any, Dict, Optional
+
+DEFAULT_SESSION_DB = os.getenv("HEALTHLIGHT_SESSION_DB") or None
+# Pass as app.invoke(..., durability=DURABILITY): a session only needs each turn's final state,
+# so write one checkpoint per turn instead of one per graph step
+DURABILITY = "exit"
+
+
+def open_checkpointer(path: Optional[str] = DEFAULT_SESSION_DB):
+    """SQLite checkpointer at `path`, or an in-memory one when no path is given."""
+    from langgraph.checkpoint.memory import InMemorySaver
+
+    if not path:
+        return InMemorySaver()
+    try:
+        from langgraph.checkpoint.sqlite import SqliteSaver
+    except ImportError:
+        print("⚠️ langgraph-checkpoint-sqlite is not installed; sessions are kept in memory only.")
+        return InMemorySaver()
+    # Graph nodes may run on worker threads (speculative routing), so share the connection
+    return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+
+
+def new_thread_id() -> str:
+    return uuid.uuid4().hex
+
+
+def session_config(thread_id: str) -> Dict[str, Any]:
+    """Invoke config selecting a session's thread."""
+    return {"configurable": {"thread_id": thread_id}}
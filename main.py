@@ -17,62 +17,110 @@ Examples:
   python main.py --mode caregiver "Patient has acute rhinitis..."
   python main.py --mode auto "MRI near 91770"
   python main.py    # interactive
+  python main.py --profile-startup --mode provider "MRI near 91770"
+  python main.py --session-db sessions.sqlite --session s1 "MRI near 91770"
+  python main.py --session-db sessions.sqlite --session s1 "any within 40 miles?"
+
+Startup is lazy: each agent (and its LLM client library) is only imported and built
+the first time a request is routed to it. In interactive mode the provider agent is built
+in the background right after the prompt appears, so its directory loads while you type.
+
+Sessions: each run is a conversation thread (checkpointed in memory, or in the SQLite file
+given by --session-db / HEALTHLIGHT_SESSION_DB). Follow-ups such as "any within 40 miles?" or
+"only cardiology" re-rank the previous search's candidates instead of starting over.
 """
 
 from __future__ import annotations
+import time
+_PROCESS_START = time.perf_counter()
+
 import argparse
 import os
 import sys
+import threading
 
 # Add repo root to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from dotenv import load_dotenv
-load_dotenv()
 
-# Agents & combined graph
-from agents.caregiver_agent import CaregiverCompanionAgent
-from agents.provider_agent import ProviderAgent
-from graphs.final_graph import build_final_graph
+def _make_caregiver_agent():
+    """Caregiver agent; needs GROQ_API_KEY (checked when caregiver mode is first used)."""
+    from agents.caregiver_agent import CaregiverCompanionAgent
+
+    groq = os.getenv("GROQ_API_KEY")
+    if not groq:
+        raise ValueError("GROQ_API_KEY not found. Please set it in .env for caregiver mode.")
+    return CaregiverCompanionAgent(groq)
+
+
+def _make_provider_agent():
+    """Provider agent; needs OPENAI_API_KEY (checked when provider mode is first used)."""
+    from agents.provider_agent import ProviderAgent
+
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY not found. Please set it in .env.")
+    return ProviderAgent()
+
 
+def _prewarm_provider(provider_agent) -> None:
+    """Build the provider agent in the background; its directory refresher starts loading at once."""
+    try:
+        provider_agent.get()
+    except ValueError:
+        pass  # missing key: reported when provider mode is first used
 
-def build_app():
+
+def build_app(profiler=None, session_db=None):
     """
-    Instantiate both agents and compile the combined graph.
+    Compile the combined graph with lazily-built agents and a session checkpointer
+    (SQLite at session_db, else in memory).
     Notes:
       - ProviderAgent expects OPENAI_API_KEY in the environment.
-      - CaregiverCompanionAgent may use GROQ_API_KEY depending on your implementation.
+      - CaregiverCompanionAgent expects GROQ_API_KEY.
+      Neither is required until a request is routed to that agent.
     """
-    # Provider requires OpenAI
-    if not os.getenv("OPENAI_API_KEY"):
-        raise ValueError("OPENAI_API_KEY not found. Please set it in .env.")
+    from contextlib import nullcontext
+    from dotenv import load_dotenv
+    load_dotenv()
 
-    # Caregiver (pass GROQ key if your class expects it; otherwise default construct)
-    groq = os.getenv("GROQ_API_KEY")
-    try:
-        caregiver_agent = CaregiverCompanionAgent(groq) if groq else CaregiverCompanionAgent()
-    except TypeError:
-        # If your constructor strictly requires a key
-        if not groq:
-            raise ValueError("GROQ_API_KEY not found. Please set it in .env for caregiver mode.")
-        caregiver_agent = CaregiverCompanionAgent(groq)
+    with (profiler.phase("import graphs.final_graph") if profiler else nullcontext()):
+        from graphs.final_graph import build_final_graph
+    from graphs.session import DEFAULT_SESSION_DB, open_checkpointer
+    from utils.lazy import Lazy
+
+    caregiver_agent = Lazy(_make_caregiver_agent, name="caregiver agent")
+    provider_agent = Lazy(_make_provider_agent, name="provider agent")
+    with (profiler.phase("compile final graph") if profiler else nullcontext()):
+        app = build_final_graph(caregiver_agent, provider_agent,
+                                checkpointer=open_checkpointer(session_db or DEFAULT_SESSION_DB))
+    return app, (caregiver_agent, provider_agent)
 
-    provider_agent = ProviderAgent()
-    app = build_final_graph(caregiver_agent, provider_agent)
-    return app
 
+def _print_profile(profiler, agents, label: str) -> None:
+    for agent in agents:
+        if agent.built:
+            profiler.add_phase(f"build {agent.name} (lazy)", agent.build_seconds or 0.0)
+    print("\n" + profiler.report(label) + "\n", file=sys.stderr)
 
-def run_once(app, mode: str | None, text: str) -> str:
+
+def run_once(app, mode: str | None, text: str, thread_id: str | None = None,
+             deadline_s: float | None = None) -> str:
     """
     Invoke the combined graph once.
     Inputs:
       - mode: 'provider' | 'caregiver' | None (None = auto routing inside the graph)
       - text: user text (notes or provider query)
+      - thread_id: session thread (required when the graph has a checkpointer)
+      - deadline_s: overall deadline in seconds (None = REQUEST_DEADLINE_S, if set)
     Output:
       - response_text (str)
     """
+    from graphs.session import DURABILITY, session_config
+
     state = {"mode": mode, "text": text}
-    result = app.invoke(state)
+    if deadline_s:
+        state["deadline_s"] = deadline_s
+    result = app.invoke(state, session_config(thread_id) if thread_id else None, durability=DURABILITY)
     if isinstance(result, dict):
         return str(result.get("response_text", result))
     return str(result)
@@ -82,20 +130,42 @@ def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Unified runner (combined graph)")
     p.add_argument("--mode", choices=["provider", "caregiver", "auto"], default="auto",
                    help="Pipeline mode. Default: auto (graph routes by itself).")
+    p.add_argument("--profile-startup", action="store_true",
+                   help="Report import and initialization time per module/phase (to stderr).")
+    p.add_argument("--session", help="Session (thread) id to continue; default: a new session.")
+    p.add_argument("--session-db", help="SQLite file for sessions (default: HEALTHLIGHT_SESSION_DB, else in memory).")
+    p.add_argument("--deadline", type=float, default=None,
+                   help="Seconds per request before a partial answer is returned (default: REQUEST_DEADLINE_S).")
     p.add_argument("text", nargs="*", help="Input text (provider query or caregiver notes).")
     return p.parse_args()
 
 
 def main():
-    app = build_app()
     args = parse_args()
 
+    profiler = None
+    if args.profile_startup:
+        from utils.startup_profile import StartupProfiler
+        profiler = StartupProfiler(_PROCESS_START)
+        profiler.install()
+
+    # Load tiktoken's encoding while the graph compiles, not inside the first LLM call
+    from utils.token_utils import warm_encodings
+    threading.Thread(target=warm_encodings, name="warm-tokens", daemon=True).start()
+
+    app, agents = build_app(profiler, args.session_db)
+    from graphs.session import new_thread_id
+    thread_id = args.session or new_thread_id()
+
     # One-shot CLI
     if args.text:
         text = " ".join(args.text).strip()
         mode = None if args.mode == "auto" else args.mode
-        out = run_once(app, mode, text)
+        out = run_once(app, mode, text, thread_id, args.deadline)
         print(out)
+        if profiler:
+            profiler.uninstall()
+            _print_profile(profiler, agents, "time to answer")
         return
 
     # Interactive
@@ -106,14 +176,22 @@ Type your request (Ctrl+C to quit). Examples:
   - MRI near 94102
   - Please summarize these notes: ...
 """
+    if profiler:
+        profiler.uninstall()
+        _print_profile(profiler, agents, "time to prompt")
+    # Prewarm the provider directory while the user types the first request
+    threading.Thread(target=_prewarm_provider, args=(agents[1],), name="prewarm", daemon=True).start()
     print(banner)
     while True:
         try:
             s = input("> ").strip()
             if not s:
                 continue
-            out = run_once(app, None, s)  # None => auto routing inside graph
+            out = run_once(app, None, s, thread_id, args.deadline)  # None => auto routing inside graph
             print("\n" + out + "\n")
+        except ValueError as e:
+            # e.g. a missing API key for the agent this request was routed to
+            print(f"\n⚠️ {e}\n")
         except (KeyboardInterrupt, EOFError):
             print("\n👋 Goodbye!\n")
             break
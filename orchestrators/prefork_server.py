@@ -0,0 +1,437 @@
+# orchestrators/prefork_server.py
+"""
+Pre-fork multi-process HTTP server for the combined graph.
+
+One Python process serves graph requests on one core (the GIL). To use more cores without
+N copies of the provider indexes, the parent builds everything read-only once and forks:
+
+  parent   ZIP database + materialized ZIP neighbour table (pipelines/zip_neighbors.py, npy
+           files mapped read-only), the compiled provider snapshot (pipelines/provider_snapshot.py:
+           rows, ZIP index and specialty index in one mmap'ed file; compiled first if missing),
+           its pages read into the page cache; then gc.freeze() and the listening socket
+  workers  forked from the parent: the ZIP table and database are inherited pages, and every
+           worker maps the same snapshot file, so all of them share one copy in the page cache.
+           Each worker builds its graph (app_factory), puts a RequestScheduler in front of it and
+           accepts connections on the inherited socket.
+
+What a worker adds is its interpreter, graph and LLM clients, caches and in-flight requests.
+No threads are started in the parent before forking (workers start their own).
+
+The parent supervises: a worker that dies is replaced, SIGTERM / SIGINT stop every worker, and
+SIGHUP re-opens the snapshot (recompiling it first when it was built from --url / --rebuild)
+and replaces the workers one at a time, so the server keeps serving during a reload. Workers
+are stateless (no sessions); a conversation's follow-ups need a shared checkpointer
+(graphs/session.py).
+
+Needs os.fork (Linux / macOS). Per-process memory (memory_report) reads /proc (Linux).
+
+Endpoints (per worker):
+  POST /invoke   {"text": ..., "mode": "provider" | "caregiver" (optional), "deadline_s": ... (optional)}
+                 -> {"response_text", "routed_mode", "response_tier", "deadline_exceeded", "pid"};
+                 503 when the request's queue is full, 504 when its deadline passed while queued
+  GET  /health   {"pid", "snapshot_version"}
+  GET  /stats    {"pid", "scheduler": per-queue summary, "memory": this worker's RSS / PSS / private}
+
+Usage:
+  python -m orchestrators.prefork_server --workers 4 --port 8080 --snapshot data/providers.snap [--url URL]
+  curl -s localhost:8080/invoke -d '{"text": "MRI near 91770"}'
+  kill -HUP <parent pid>    # re-open (or recompile) the snapshot and roll the workers
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from orchestrators.request_scheduler import DEFAULT_WORKERS as SCHED_WORKERS, QueueFull, RequestScheduler
+from utils.deadline import DeadlineExceeded
+from utils.tracing import span
+
+DEFAULT_WORKERS = int(os.getenv("PREFORK_WORKERS", str(os.cpu_count() or 1)))
+DEFAULT_PORT = int(os.getenv("PREFORK_PORT", "8080"))
+DEFAULT_SNAPSHOT = os.getenv("PROVIDER_SNAPSHOT") or os.path.join(
+    os.path.expanduser("~"), ".cache", "healthlight", "providers.snap")
+# A worker that dies sooner than this after starting is restarted only after this delay (crash loops)
+RESTART_BACKOFF_S = 1.0
+
+AppFactory = Callable[[Optional[str]], Any]
+
+
+# ----------------------------
+# Shared read-only indexes (built in the parent)
+# ----------------------------
+def _read_through(path: str, chunk: int = 1 << 20) -> None:
+    """Read a file once so its pages are in the page cache before workers map it."""
+    with open(path, "rb") as f:
+        while f.read(chunk):
+            pass
+
+
+def prepare_shared_indexes(snapshot_path: Optional[str], directory_url: Optional[str] = None,
+                           rebuild: bool = False) -> str:
+    """
+    Load the ZIP database, neighbour table and token encodings, and compile (when missing, or rebuild=True) and
+    page in the provider snapshot. Returns the snapshot's directory version ("" without one).
+    """
+    from pipelines.provider_json_retrieval import warm_zip_database
+    from pipelines.provider_refresh import ensure_neighbor_table
+    from utils.token_utils import warm_encodings
+
+    with span("prefork.prepare", snapshot=snapshot_path or "", rebuild=rebuild) as s:
+        warm_zip_database()
+        ensure_neighbor_table()
+        warm_encodings()  # tiktoken's encoding, inherited by every worker
+        if not snapshot_path:
+            return ""
+        from pipelines.provider_snapshot import compile_snapshot, load_directory_rows, open_snapshot
+
+        if rebuild or not os.path.exists(snapshot_path):
+            os.makedirs(os.path.dirname(os.path.abspath(snapshot_path)), exist_ok=True)
+            rows, version = load_directory_rows(directory_url)
+            compile_snapshot(rows, snapshot_path, version=version or str(int(time.time())))
+        _read_through(snapshot_path)
+        with open_snapshot(snapshot_path) as snap:
+            s.set(rows=len(snap), version=snap.version)
+            return snap.version
+
+
+def default_app_factory(snapshot_path: Optional[str]) -> Any:
+    """The combined graph over the shared snapshot, loaded once per worker (no refresh thread)."""
+    from agents.provider_agent import ProviderAgent
+    from graphs.final_graph import build_final_graph
+    from orchestrators.run_final_graph import _caregiver_agent
+    from utils.lazy import Lazy
+
+    if not os.getenv("OPENAI_API_KEY"):
+        raise ValueError("OPENAI_API_KEY not found. Please set it in .env.")
+    provider = ProviderAgent(snapshot_path=snapshot_path, refresh_interval_s=0)
+    return build_final_graph(Lazy(_caregiver_agent, name="caregiver agent"), provider)
+
+
+# ----------------------------
+# Memory accounting (Linux)
+# ----------------------------
+def process_memory(pid: int) -> Optional[Dict[str, float]]:
+    """RSS, PSS (shared pages split between their users) and private memory of a process, in MB."""
+    fields: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    except OSError:
+        return None
+    private = fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    return {"rss_mb": round(fields.get("Rss", 0.0), 1), "pss_mb": round(fields.get("Pss", 0.0), 1),
+            "private_mb": round(private, 1), "shared_mb": round(fields.get("Rss", 0.0) - private, 1)}
+
+
+def memory_report(pids: Iterable[int]) -> Dict[str, Any]:
+    """Per-process memory plus totals; total PSS is what the processes cost the machine together."""
+    procs = {pid: m for pid in pids if (m := process_memory(pid)) is not None}
+    return {
+        "processes": procs,
+        "total_rss_mb": round(sum(m["rss_mb"] for m in procs.values()), 1),
+        "total_pss_mb": round(sum(m["pss_mb"] for m in procs.values()), 1),
+    }
+
+
+def child_pids(parent: int) -> List[int]:
+    """Live child processes of `parent` (from /proc/<pid>/stat)."""
+    out = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # pid (comm) state ppid ...; comm may contain spaces, so split after the closing paren
+        if int(stat.rsplit(")", 1)[1].split()[1]) == parent:
+            out.append(int(name))
+    return sorted(out)
+
+
+# ----------------------------
+# Worker
+# ----------------------------
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "HealthLight"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass  # one line per request is too much at this rate; errors are in the JSON bodies
+
+    def _reply(self, code: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == "/health":
+            self._reply(200, {"pid": os.getpid(), "snapshot_version": self.server.snapshot_version})
+        elif self.path == "/stats":
+            self._reply(200, {"pid": os.getpid(), "scheduler": self.server.scheduler.summary(),
+                              "memory": process_memory(os.getpid())})
+        else:
+            self._reply(404, {"error": f"no route {self.path}"})
+
+    def do_POST(self) -> None:
+        if self.path != "/invoke":
+            self._reply(404, {"error": f"no route {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        except ValueError as e:
+            self._reply(400, {"error": f"invalid JSON: {e}"})
+            return
+        text = (body.get("text") or "").strip()
+        if not text:
+            self._reply(400, {"error": "'text' is required"})
+            return
+        state: Dict[str, Any] = {"mode": body.get("mode"), "text": text}
+        if body.get("deadline_s"):
+            state["deadline_s"] = float(body["deadline_s"])
+        try:
+            out = self.server.scheduler.invoke(state)
+        except QueueFull as e:
+            self._reply(503, {"error": str(e)})
+            return
+        except DeadlineExceeded as e:
+            self._reply(504, {"error": str(e)})
+            return
+        except Exception as e:
+            self._reply(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        self._reply(200, {
+            "response_text": out.get("response_text", ""),
+            "routed_mode": out.get("routed_mode", ""),
+            "response_tier": out.get("response_tier", ""),
+            "deadline_exceeded": bool(out.get("deadline_exceeded")),
+            "pid": os.getpid(),
+        })
+
+
+def _serve_worker(listener: socket.socket, app_factory: AppFactory, snapshot_path: Optional[str],
+                  snapshot_version: str, threads: int) -> None:
+    """Body of a forked worker: build the graph, then serve the inherited socket until SIGTERM."""
+    app = app_factory(snapshot_path)
+    scheduler = RequestScheduler(app, workers=threads)
+    server = ThreadingHTTPServer(listener.getsockname()[:2], _Handler, bind_and_activate=False)
+    server.socket = listener
+    server.daemon_threads = True
+    server.scheduler = scheduler
+    server.snapshot_version = snapshot_version
+    # shutdown() waits for serve_forever, which runs on this (the signal handler's) thread
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown, daemon=True).start())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the whole group; the parent stops us
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        server.serve_forever()
+    finally:
+        scheduler.close()
+
+
+# ----------------------------
+# Parent
+# ----------------------------
+class PreforkServer:
+    def __init__(self, app_factory: AppFactory = default_app_factory, workers: int = DEFAULT_WORKERS,
+                 host: str = "127.0.0.1", port: int = DEFAULT_PORT, snapshot_path: Optional[str] = DEFAULT_SNAPSHOT,
+                 directory_url: Optional[str] = None, threads: int = SCHED_WORKERS, rebuild: bool = False):
+        """
+        app_factory: snapshot_path -> compiled graph, called in each worker after the fork.
+        snapshot_path: provider snapshot shared by the workers (None: each worker loads its own
+        directory, e.g. for comparison). directory_url: what to compile it from (see
+        pipelines.provider_snapshot.load_directory_rows). threads: RequestScheduler workers per process.
+        """
+        if not hasattr(os, "fork"):
+            raise RuntimeError("The pre-fork server needs os.fork (Linux / macOS).")
+        self.app_factory = app_factory
+        self.workers = max(1, workers)
+        self.host = host
+        self.port = port
+        self.snapshot_path = snapshot_path
+        self.directory_url = directory_url
+        self.threads = threads
+        self.rebuild = rebuild
+        self.snapshot_version = ""
+        self._listener: Optional[socket.socket] = None
+        self._children: Dict[int, float] = {}  # pid -> start time
+        self._stopping = False
+        self._reload_requested = False
+        self.restarts = 0
+
+    @property
+    def address(self) -> tuple:
+        return self._listener.getsockname()[:2] if self._listener else (self.host, self.port)
+
+    def worker_pids(self) -> List[int]:
+        return sorted(self._children)
+
+    def memory(self) -> Dict[str, Any]:
+        return memory_report([os.getpid(), *self.worker_pids()])
+
+    # --- workers ---
+    def _spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _serve_worker(self._listener, self.app_factory, self.snapshot_path, self.snapshot_version,
+                              self.threads)
+            except BaseException as e:
+                print(f"⚠️ Worker {os.getpid()} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)  # never return into the parent's code (or run its atexit hooks)
+        self._children[pid] = time.monotonic()
+        return pid
+
+    def _reap(self) -> List[tuple]:
+        """(pid, exit code (-N: killed by signal N), seconds it ran) for each worker that exited."""
+        gone = []
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self._children.pop(pid, None)
+            if started is not None:
+                gone.append((pid, os.waitstatus_to_exitcode(status), time.monotonic() - started))
+        return gone
+
+    def _terminate(self, pids: Iterable[int], timeout: float) -> None:
+        pids = [p for p in pids if p in self._children]
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        end = time.monotonic() + timeout
+        while any(p in self._children for p in pids) and time.monotonic() < end:
+            self._reap()
+            time.sleep(0.05)
+        for pid in pids:
+            if pid in self._children:
+                print(f"⚠️ Worker {pid} did not stop in {timeout:.0f}s; killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+        while any(p in self._children for p in pids):
+            self._reap()
+            time.sleep(0.01)
+
+    # --- lifecycle ---
+    def start(self) -> "PreforkServer":
+        """Build the shared indexes, bind, and fork the workers (returns once they are forked)."""
+        self.snapshot_version = prepare_shared_indexes(self.snapshot_path, self.directory_url, self.rebuild)
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((self.host, self.port))
+        self._listener.listen(128)
+        # The trace writer (utils.tracing) is fork-safe: it flushes before and restarts after a fork
+        others = [t for t in threading.enumerate() if t is not threading.current_thread() and t.name != "trace-writer"]
+        if others:
+            print(f"⚠️ Forking with {len(others)} other thread(s) running; their locks may be held in the workers")
+        # Keep the indexes built so far out of the collector: a GC pass in a worker would touch
+        # (and so copy) every inherited object page
+        gc.collect()
+        gc.freeze()
+        for _ in range(self.workers):
+            self._spawn()
+        return self
+
+    def reload(self) -> None:
+        """Recompile the snapshot (when built from a directory URL) and replace workers one by one."""
+        with span("prefork.reload", workers=len(self._children)):
+            rebuild = self.snapshot_path is not None and (self.directory_url is not None or self.rebuild)
+            gc.unfreeze()
+            self.snapshot_version = prepare_shared_indexes(self.snapshot_path, self.directory_url, rebuild)
+            gc.collect()
+            gc.freeze()
+            for old in self.worker_pids():
+                self._spawn()
+                self._terminate([old], timeout=30.0)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stopping = True
+        self._terminate(self.worker_pids(), timeout)
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def _on_signal(self, signum: int, frame: Any) -> None:
+        if signum == signal.SIGHUP:
+            self._reload_requested = True
+        else:
+            self._stopping = True
+
+    def serve_forever(self, poll_s: float = 0.2) -> None:
+        """Start (if needed) and supervise the workers until SIGTERM / SIGINT."""
+        if self._listener is None:
+            self.start()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._on_signal)
+        host, port = self.address
+        print(f"Serving on http://{host}:{port} with {self.workers} worker(s) "
+              f"(snapshot {self.snapshot_path or 'none'}, version {self.snapshot_version or '-'})", flush=True)
+        try:
+            while not self._stopping:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                for pid, code, ran_s in self._reap():
+                    if self._stopping:
+                        break
+                    print(f"⚠️ Worker {pid} exited (code {code}) after {ran_s:.1f}s; restarting it")
+                    if ran_s < RESTART_BACKOFF_S:
+                        time.sleep(RESTART_BACKOFF_S)
+                    self.restarts += 1
+                    self._spawn()
+                time.sleep(poll_s)
+        finally:
+            self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the combined graph from pre-forked worker processes")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Worker processes (default: CPU count)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT, help="Provider snapshot shared by the workers")
+    parser.add_argument("--url", default=None,
+                        help="Directory to compile the snapshot from (default: PROVIDER_SOURCES, else Anthem)")
+    parser.add_argument("--rebuild", action="store_true", help="Recompile the snapshot even if it exists")
+    parser.add_argument("--threads", type=int, default=SCHED_WORKERS, help="Scheduler workers per process")
+    args = parser.parse_args()
+
+    PreforkServer(workers=args.workers, host=args.host, port=args.port, snapshot_path=args.snapshot,
+                  directory_url=args.url, threads=args.threads, rebuild=args.rebuild).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+# orchestrators/request_scheduler.py
+"""
+Priority-aware request scheduler in front of the combined graph.
+
+A provider lookup is data work plus one short LLM call; a caregiver summary of a long note
+can hold a worker (and an LLM slot) for many seconds. With one FIFO worker pool, a backlog of
+long summaries makes every quick lookup wait behind it. Here requests are classified before
+they run and queued per route and size class:
+
+  provider          provider lookups (and follow-ups routed there by the heuristic)
+  caregiver.short   notes up to SCHED_LONG_NOTE_TOKENS tokens
+  caregiver.long    longer notes; at most half the workers while other requests are waiting
+
+Idle workers take the next request by weighted fair dispatch (stride scheduling): each queue
+advances a virtual clock by 1/weight per dispatched request, and the non-empty queue with
+the earliest clock (and a free in-flight slot) goes next. In-flight caps only hold back a
+queue while another queue has a request it could run, so dispatch stays work-conserving: a
+backlog of long notes uses every idle worker when nothing else is waiting, and capped
+queues are held back again at their next dispatch. Requests arriving while those workers
+are busy wait for one to finish; SCHED_RESERVE_WORKERS keeps that many workers out of such
+over-cap dispatches, trading some drain rate for their latency. A queue that was idle restarts at
+the current clock, so it can't bank credit while empty. A full queue rejects a new request
+at once (QueueFull) instead of letting it wait for a deadline it will miss.
+
+Time spent queued counts against the request deadline (CombinedState.deadline_s, see
+utils/deadline.py): the graph gets what is left, and a request whose deadline passed while
+queued fails with DeadlineExceeded without running.
+
+Usage:
+    scheduler = RequestScheduler(app, workers=8)
+    result = scheduler.invoke({"text": "MRI near 91770"})
+    future = scheduler.submit({"text": long_note})
+    scheduler.summary()   # per-queue depth, in-flight, wait / service / total latency
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Optional
+
+from graphs.final_graph import _score_route
+from utils.deadline import DEFAULT_REQUEST_DEADLINE_S, DeadlineExceeded
+from utils.metrics import LatencyWindow
+from utils.token_utils import count_tokens
+from utils.tracing import span
+
+DEFAULT_WORKERS = int(os.getenv("SCHED_WORKERS", "8"))
+# Caregiver notes longer than this (tokens) go to the caregiver.long queue
+LONG_NOTE_TOKENS = int(os.getenv("SCHED_LONG_NOTE_TOKENS", "1500"))
+# Workers a queue over its in-flight cap may not take even when nothing else is waiting
+RESERVE_WORKERS = int(os.getenv("SCHED_RESERVE_WORKERS", "0"))
+
+PROVIDER = "provider"
+CAREGIVER_SHORT = "caregiver.short"
+CAREGIVER_LONG = "caregiver.long"
+
+
+class QueueFull(RuntimeError):
+    """The request's queue is at max_depth; retry later (HTTP 429 / 503 for a server)."""
+
+
+@dataclass
+class QueueSpec:
+    weight: float = 1.0                   # share of dispatches while several queues are backlogged
+    max_depth: int = 100                  # queued (not yet running) requests before rejecting
+    max_in_flight: Optional[int] = None   # running at once while other queues wait (None = any worker)
+
+
+def default_queues(workers: int) -> Dict[str, QueueSpec]:
+    return {
+        PROVIDER: QueueSpec(weight=4.0, max_depth=256),
+        CAREGIVER_SHORT: QueueSpec(weight=2.0, max_depth=128),
+        CAREGIVER_LONG: QueueSpec(weight=1.0, max_depth=64, max_in_flight=max(1, workers // 2)),
+    }
+
+
+def classify_request(state: Dict[str, Any]) -> str:
+    """Queue for a CombinedState input: route (explicit mode, else the router heuristic) and note size."""
+    text = state.get("text") or state.get("user_input") or state.get("notes") or ""
+    mode = state.get("mode") if state.get("mode") in ("caregiver", "provider") else _score_route(text)[0]
+    if mode == "provider":
+        return PROVIDER
+    return CAREGIVER_LONG if count_tokens(text) > LONG_NOTE_TOKENS else CAREGIVER_SHORT
+
+
+class _Job:
+    __slots__ = ("state", "config", "kwargs", "future", "enqueued", "deadline")
+
+    def __init__(self, state: Dict[str, Any], config: Any, kwargs: Dict[str, Any], deadline_s: Optional[float]):
+        self.state = state
+        self.config = config
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+        self.deadline = None if deadline_s is None else self.enqueued + deadline_s
+
+
+class _Queue:
+    def __init__(self, name: str, spec: QueueSpec):
+        self.name = name
+        self.spec = spec
+        self.jobs: Deque[_Job] = deque()
+        self.clock = 0.0          # virtual time of the next dispatch (stride scheduling)
+        self.in_flight = 0
+        self.wait = LatencyWindow()
+        self.service = LatencyWindow()
+        self.total = LatencyWindow()
+        self.stats = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "expired": 0}
+
+    def ready(self) -> bool:
+        """Has a job and a free in-flight slot."""
+        return bool(self.jobs) and (self.spec.max_in_flight is None or self.in_flight < self.spec.max_in_flight)
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, "depth": len(self.jobs), "in_flight": self.in_flight, "weight": self.spec.weight,
+                "wait_s": self.wait.summary(), "service_s": self.service.summary(), "total_s": self.total.summary()}
+
+
+class RequestScheduler:
+    def __init__(self, app: Any, workers: int = DEFAULT_WORKERS, queues: Optional[Dict[str, QueueSpec]] = None,
+                 classify: Callable[[Dict[str, Any]], str] = classify_request, reserve_workers: int = RESERVE_WORKERS):
+        self.app = app
+        self.classify = classify
+        self.workers = max(1, workers)
+        self.reserve_workers = reserve_workers
+        self._queues = {name: _Queue(name, spec) for name, spec in (queues or default_queues(workers)).items()}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True) for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # --- callers ---
+    def submit(self, state: Dict[str, Any], config: Any = None, queue: Optional[str] = None, **invoke_kwargs: Any) -> Future:
+        """
+        Queue one app.invoke(state, config, **invoke_kwargs); returns a Future of its result.
+        Raises QueueFull (without queueing) when the request's queue is at max_depth.
+        """
+        name = queue or self.classify(state)
+        deadline_s = state.get("deadline_s") or DEFAULT_REQUEST_DEADLINE_S
+        job = _Job(state, config, invoke_kwargs, deadline_s)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("scheduler is closed")
+            q = self._queues[name]
+            q.stats["submitted"] += 1
+            if len(q.jobs) >= q.spec.max_depth:
+                q.stats["rejected"] += 1
+                raise QueueFull(f"{name} queue is full ({q.spec.max_depth} waiting)")
+            if not q.jobs and not q.in_flight:
+                # Rejoining: start at the current virtual time, no credit for the idle period
+                busy = [o.clock for o in self._queues.values() if o.jobs or o.in_flight]
+                q.clock = max(q.clock, min(busy)) if busy else q.clock
+            q.jobs.append(job)
+            self._cond.notify()
+        return job.future
+
+    def invoke(self, state: Dict[str, Any], config: Any = None, timeout: Optional[float] = None,
+               **invoke_kwargs: Any) -> Any:
+        return self.submit(state, config, **invoke_kwargs).result(timeout)
+
+    # --- workers ---
+    def _next(self) -> Optional[tuple]:
+        """(queue, job) by weighted fair dispatch; called with the condition held."""
+        ready = [q for q in self._queues.values() if q.ready()]
+        if not ready:
+            # Caps apply only while some queue within its cap has work (else the worker would idle)
+            idle = self.workers - sum(q.in_flight for q in self._queues.values())
+            if idle <= self.reserve_workers:
+                return None
+            ready = [q for q in self._queues.values() if q.jobs]
+        if not ready:
+            return None
+        q = min(ready, key=lambda q: q.clock)
+        q.clock += 1.0 / q.spec.weight
+        q.in_flight += 1
+        return q, q.jobs.popleft()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                picked = self._next()
+                while picked is None:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                    picked = self._next()
+            q, job = picked
+            outcome = "failed"
+            try:
+                outcome = self._run(q, job)
+            finally:
+                with self._cond:
+                    q.in_flight -= 1
+                    if outcome:
+                        q.stats[outcome] += 1
+                    self._cond.notify_all()  # a slot of a capped queue may have opened
+
+    def _run(self, q: _Queue, job: _Job) -> Optional[str]:
+        """Run one job; returns the stat to count ('completed' | 'failed' | 'expired'), None if cancelled."""
+        if not job.future.set_running_or_notify_cancel():
+            return None
+        started = time.monotonic()
+        waited = started - job.enqueued
+        q.wait.record(waited)
+        state = job.state
+        if job.deadline is not None:
+            left = job.deadline - started
+            if left <= 0:
+                job.future.set_exception(DeadlineExceeded(f"Deadline passed after {waited:.2f}s in the {q.name} queue."))
+                return "expired"
+            state = {**state, "deadline_s": left}
+        with span("scheduler.run", queue=q.name, wait_s=round(waited, 4)):
+            try:
+                result = self.app.invoke(state, job.config, **job.kwargs)
+            except BaseException as e:
+                job.future.set_exception(e)
+                return "failed"
+            finally:
+                done = time.monotonic()
+                q.service.record(done - started)
+                q.total.record(done - job.enqueued)
+        job.future.set_result(result)
+        return "completed"
+
+    # --- lifecycle / metrics ---
+    def close(self, wait: bool = True) -> None:
+        """Stop taking requests; workers finish what is queued, then exit."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        with self._cond:
+            return {name: q.summary() for name, q in self._queues.items()}
@@ -1,8 +1,16 @@
+from typing import List, Optional
+
 from agents.caregiver_agent import CaregiverCompanionAgent
-from graphs.caregiver_graph import build_caregiver_graph
+from graphs.caregiver_graph import build_caregiver_batch_graph, build_caregiver_graph
 from utils.config import GROQ_API_KEY
 
 def run_caregiver_pipeline(notes: str):
     agent = CaregiverCompanionAgent(GROQ_API_KEY)
     app = build_caregiver_graph(agent)
     return app.invoke({"notes": notes})
+
+def run_caregiver_batch(notes: List[str], max_concurrency: Optional[int] = None):
+    """Summarize many notes at once; returns {"results": [...], "errors", "notes_per_minute"}."""
+    agent = CaregiverCompanionAgent(GROQ_API_KEY)
+    app = build_caregiver_batch_graph(agent, max_concurrency)
+    return app.invoke({"notes": notes})
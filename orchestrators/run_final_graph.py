@@ -15,7 +15,7 @@ Usage:
   python examples/run_final_graph.py --mode provider "MRI near 91770"
   python examples/run_final_graph.py --mode caregiver "Patient has acute rhinitis..."
 
-  # Interactive
+  # Interactive (one session: follow-ups like "any within 40 miles?" reuse the last search)
   python examples/run_final_graph.py
 """
 
@@ -23,32 +23,37 @@ from __future__ import annotations
 import argparse
 import os
 import sys
+import threading
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from agents.caregiver_agent import CaregiverCompanionAgent
-from agents.provider_agent import ProviderAgent
 from graphs.final_graph import build_final_graph
+from graphs.session import DURABILITY, new_thread_id, open_checkpointer, session_config
+from utils.lazy import Lazy
+from utils.token_utils import warm_encodings
 
 
-def build_agents():
-    # Caregiver can depend on GROQ or OPENAI depending on your implementation.
-    # In your repo, CaregiverCompanionAgent takes GROQ_API_KEY; ProviderAgent uses OPENAI_API_KEY.
+def _caregiver_agent():
+    # CaregiverCompanionAgent takes GROQ_API_KEY (raises if missing)
+    from agents.caregiver_agent import CaregiverCompanionAgent
     groq_key = os.getenv("GROQ_API_KEY")
-    openai_key = os.getenv("OPENAI_API_KEY")
+    return CaregiverCompanionAgent(groq_key) if groq_key else CaregiverCompanionAgent()
+
 
+def _provider_agent():
     # Provider Agent requires OPENAI_API_KEY
-    if not openai_key:
+    from agents.provider_agent import ProviderAgent
+    if not os.getenv("OPENAI_API_KEY"):
         raise ValueError("OPENAI_API_KEY not found. Please set it in .env.")
+    return ProviderAgent()
 
-    # Caregiver agent (match your current constructor; if it needs a key, pass it)
-    caregiver_agent = CaregiverCompanionAgent(groq_key) if groq_key else CaregiverCompanionAgent()
 
-    provider_agent = ProviderAgent()
-    return caregiver_agent, provider_agent
+def build_agents():
+    """Lazy agents: each is built (and its LLM client imported) on first use by its route."""
+    return Lazy(_caregiver_agent, name="caregiver agent"), Lazy(_provider_agent, name="provider agent")
 
 
 def main():
@@ -57,12 +62,15 @@ def main():
     parser.add_argument("text", nargs="*", help="Input text (notes or provider query)")
     args = parser.parse_args()
 
+    # Load tiktoken's encoding while the graph compiles, not inside the first LLM call
+    threading.Thread(target=warm_encodings, name="warm-tokens", daemon=True).start()
     caregiver_agent, provider_agent = build_agents()
-    app = build_final_graph(caregiver_agent, provider_agent)
+    app = build_final_graph(caregiver_agent, provider_agent, checkpointer=open_checkpointer())
+    config = session_config(new_thread_id())
 
     if args.text:
         text = " ".join(args.text).strip()
-        out = app.invoke({"mode": args.mode, "text": text})
+        out = app.invoke({"mode": args.mode, "text": text}, config, durability=DURABILITY)
         print(out.get("response_text", str(out)))
         return
 
@@ -80,7 +88,7 @@ Type a request (Ctrl+C to quit). Examples:
             s = input("> ").strip()
             if not s:
                 continue
-            out = app.invoke({"mode": None, "text": s})
+            out = app.invoke({"mode": None, "text": s}, config, durability=DURABILITY)
             print("\n" + out.get("response_text", str(out)) + "\n")
         except (KeyboardInterrupt, EOFError):
             print("\n👋 Goodbye!\n")
@@ -1,19 +1,105 @@
-from langchain_community.document_loaders import WebBaseLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_core.documents import Document
 from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain_groq import ChatGroq
+import hashlib
 import os
 
-def build_cdc_qa(groq_api_key: str):
+from pipelines.http_fetch import fetch_text
+from utils.embedding_service import get_embedding_service
+from utils.llm_utils import TracingCallbackHandler
+from utils.rate_limit import attach_rate_limiter
+from utils.semantic_cache import SemanticCache
+from utils.tracing import span
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Semantic answer cache: near-identical questions ("flu symptoms" / "what are the symptoms of flu?")
+# reuse an earlier answer and its sources. Shared by every chain built in this process; answers are
+# kept per corpus version, so a chain rebuilt over changed pages starts its own entries while the old
+# chain keeps hitting its own, and the least recently used version is dropped past CDC_CACHE_VERSIONS.
+CACHE_THRESHOLD = float(os.getenv("CDC_CACHE_THRESHOLD", "0.9"))
+CACHE_SIZE = int(os.getenv("CDC_CACHE_SIZE", "512"))
+CACHE_TTL_S = float(os.getenv("CDC_CACHE_TTL_S", "86400"))
+CACHE_VERSIONS = int(os.getenv("CDC_CACHE_VERSIONS", "4"))
+cdc_answer_cache = SemanticCache(CACHE_THRESHOLD, CACHE_SIZE, CACHE_TTL_S, name="cdc_qa",
+                                 max_versions=CACHE_VERSIONS)
+
+def load_pages(urls):
+    """
+    Fetch pages through the shared HTTP layer and parse them the way WebBaseLoader does
+    (text content + source/title/description/language metadata).
+    """
+    from bs4 import BeautifulSoup
+
+    docs = []
+    for url in urls:
+        soup = BeautifulSoup(fetch_text(url), "html.parser")
+        metadata = {"source": url}
+        if soup.find("title"):
+            metadata["title"] = soup.find("title").get_text()
+        if soup.find("meta", attrs={"name": "description"}):
+            metadata["description"] = soup.find("meta", attrs={"name": "description"}).get("content", "No description found.")
+        if soup.find("html"):
+            metadata["language"] = soup.find("html").get("lang", "No language found.")
+        docs.append(Document(page_content=soup.get_text(), metadata=metadata))
+    return docs
+
+def corpus_version(docs, embedding_model=EMBEDDING_MODEL):
+    """Embedding model + hash of the page sources and contents; cached answers are only valid for one."""
+    h = hashlib.sha256()
+    for d in docs:
+        h.update(str(d.metadata.get("source", "")).encode())
+        h.update(d.page_content.encode())
+    return f"{embedding_model}:{h.hexdigest()[:16]}"
+
+
+class CachedRetrievalQA:
+    """
+    A RetrievalQA chain (return_source_documents=True) behind a SemanticCache.
+
+    invoke({"query": q}) returns the chain's {"query", "result", "source_documents"} plus
+    "cache" ('exact' | 'hit' | 'miss') and "similarity"; run(q) returns just the answer text.
+    """
+
+    def __init__(self, chain, embeddings, version, cache=None):
+        self.chain = chain
+        self.embeddings = embeddings
+        self.version = version
+        self.cache = cache if cache is not None else cdc_answer_cache
+
+    def _answer(self, query, config=None):
+        out = self.chain.invoke({"query": query}, config=config)
+        return {"result": out["result"], "source_documents": out.get("source_documents", [])}
+
+    def invoke(self, inputs, config=None):
+        query = inputs if isinstance(inputs, str) else inputs["query"]
+        with span("cdc.qa") as s:
+            answer, outcome, similarity = self.cache.get_or_compute(
+                query, self.embeddings.embed_query, lambda: self._answer(query, config), self.version
+            )
+            s.set(cache=outcome, similarity=similarity, sources=len(answer["source_documents"]))
+        return {"query": query, **answer, "cache": outcome, "similarity": similarity}
+
+    def run(self, query):
+        return self.invoke(query)["result"]
+
+
+def build_cdc_qa(groq_api_key: str, cache=None):
     urls = [
         "https://www.cdc.gov/flu/symptoms/index.html",
         "https://www.cdc.gov/cancer/breast/basic_info/index.htm",
     ]
-    docs = WebBaseLoader(urls).load()
-    embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    vectorstore = FAISS.from_documents(docs, embeddings)
-    retriever = vectorstore.as_retriever()
+    with span("cdc.load_pages", urls=len(urls)) as s:
+        docs = load_pages(urls)
+        s.set(docs=len(docs), bytes=sum(len(d.page_content) for d in docs))
+    with span("cdc.build_index", docs=len(docs)):
+        embeddings = get_embedding_service(EMBEDDING_MODEL).as_langchain()
+        vectorstore = FAISS.from_documents(docs, embeddings)
+    tracing = TracingCallbackHandler("cdc_qa")
+    retriever = vectorstore.as_retriever(callbacks=[tracing])
 
-    llm = ChatGroq(model="openai/gpt-oss-20b", groq_api_key=groq_api_key, temperature=0)
-    return RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
+    llm = ChatGroq(model="openai/gpt-oss-20b", groq_api_key=groq_api_key, temperature=0, callbacks=[tracing])
+    attach_rate_limiter(llm, "groq")  # shares the limiter with CaregiverCompanionAgent (same model)
+    chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever, return_source_documents=True)
+    return CachedRetrievalQA(chain, embeddings, corpus_version(docs), cache)
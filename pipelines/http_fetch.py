@@ -0,0 +1,254 @@
+# pipelines/http_fetch.py
+"""
+Shared HTTP fetch layer for every network source in pipelines/.
+
+- One pooled keep-alive `requests.Session` per process (connection reuse across calls)
+- Compression negotiation: gzip/deflate, plus br / zstd when the decoders are installed
+- Retry with jittered exponential backoff on connection errors and 429/5xx (honors Retry-After)
+- Resumable, gzip-compressed HTTP Range downloads for large directory files, revalidated
+  with If-None-Match / If-Modified-Since so an unchanged file is not fetched again (download_to_file)
+- Counters for bytes on the wire vs decoded bytes, retries and connection reuse (fetch_stats)
+- The request deadline in context (utils.deadline) caps every timeout, and a body still
+  streaming when it passes is abandoned
+"""
+from __future__ import annotations
+
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.deadline import check_deadline, timeout_for
+from utils.tracing import span
+
+DEFAULT_TIMEOUT = 25
+RETRY_TOTAL = 4
+RETRY_BACKOFF_S = 0.5     # base of the exponential backoff
+RETRY_JITTER_S = 0.5      # uniform random jitter added to each backoff
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POOL_MAXSIZE = 32
+CHUNK_SIZE = 1 << 20
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"requests": 0, "retries": 0, "bytes_wire": 0, "bytes_decoded": 0}
+_pools: Dict[int, Any] = {}  # urllib3 connection pools seen, for connection-reuse counts
+_download_locks: Dict[str, threading.Lock] = {}  # one download per target path at a time
+
+
+def _accept_encoding() -> str:
+    encodings = ["gzip", "deflate"]
+    if importlib.util.find_spec("brotli") or importlib.util.find_spec("brotlicffi"):
+        encodings.append("br")
+    if importlib.util.find_spec("zstandard"):
+        encodings.append("zstd")
+    return ", ".join(encodings)
+
+
+def _retry() -> Retry:
+    kwargs = dict(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=RETRY_TOTAL,
+        status=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_S,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    try:
+        return Retry(backoff_jitter=RETRY_JITTER_S, **kwargs)
+    except TypeError:  # urllib3 < 2 has no jitter option
+        return Retry(**kwargs)
+
+
+def get_session() -> requests.Session:
+    """The process-wide pooled session; every pipelines/ network source goes through it."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=POOL_MAXSIZE, max_retries=_retry())
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Accept-Encoding": _accept_encoding(),
+                "User-Agent": os.getenv("USER_AGENT", "HealthLight/1.0 (+https://github.com/ashloong/langchain-for-good)"),
+            })
+            _session = session
+        return _session
+
+
+def _record(resp: requests.Response, bytes_wire: int, bytes_decoded: int) -> int:
+    raw = resp.raw
+    retries = len(getattr(getattr(raw, "retries", None), "history", ()) or ())
+    pool = getattr(raw, "_pool", None)
+    with _stats_lock:
+        _stats["requests"] += 1
+        _stats["retries"] += retries
+        _stats["bytes_wire"] += bytes_wire
+        _stats["bytes_decoded"] += bytes_decoded
+        if pool is not None:
+            _pools[id(pool)] = pool
+    return retries
+
+
+def _get(url: str, timeout: float):
+    """GET through the shared session; returns (response, decoded body). Raises on HTTP error."""
+    check_deadline(f"fetching {url}")
+    timeout = timeout_for(timeout)
+    with span("http.fetch", url=url, timeout_s=timeout) as s:
+        resp = get_session().get(url, timeout=timeout, stream=True)
+        try:
+            resp.raise_for_status()
+            chunks = []
+            for chunk in resp.raw.stream(CHUNK_SIZE, decode_content=True):
+                check_deadline(f"the body of {url} finished")
+                chunks.append(chunk)
+            body = b"".join(chunks)
+            wire = resp.raw.tell() or len(body)
+        finally:
+            resp.close()  # returns the connection to the pool
+        retries = _record(resp, wire, len(body))
+        s.set(bytes=wire, bytes_decoded=len(body), retries=retries,
+              encoding=resp.headers.get("Content-Encoding", "identity"))
+        return resp, body
+
+
+def fetch_text(url: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+    """GET url and return the body as text (response charset, UTF-8 when unspecified)."""
+    resp, body = _get(url, timeout)
+    charset = requests.utils.get_encoding_from_headers(resp.headers)
+    # requests reports ISO-8859-1 for any text/* without a charset; JSON and HTML here are UTF-8
+    if not charset or charset.lower() == "iso-8859-1":
+        charset = "utf-8"
+    return body.decode(charset, errors="replace")
+
+
+def download_to_file(url: str, path: str, timeout: float = DEFAULT_TIMEOUT) -> str:
+    """
+    Download url to path (decompressed), resuming a previous partial download when possible.
+
+    A fresh download asks for gzip and keeps the encoded bytes in `<path>.part`, with the
+    response's encoding and validators (ETag / Last-Modified) in `<path>.part.json`; the file
+    is decompressed once complete. A resumed request repeats that encoding and sends `Range`
+    + `If-Range`, so the ranges line up byte for byte and a changed file restarts from zero
+    instead of being spliced. The finished file's validators are kept in `<path>.meta.json`
+    and sent as `If-None-Match` / `If-Modified-Since`: an unchanged file (304) is not
+    downloaded again.
+    """
+    with _session_lock:
+        lock = _download_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        return _download(url, path, timeout)
+
+
+def download_validators(path: str) -> Dict[str, str]:
+    """ETag / Last-Modified of a file finished by download_to_file ({} when unknown)."""
+    return _read_meta(path + ".meta.json")
+
+
+def _read_meta(meta_path: str) -> Dict[str, str]:
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path: str, meta: Dict[str, str]) -> None:
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def _download(url: str, path: str, timeout: float) -> str:
+    part, part_meta, done_meta = path + ".part", path + ".part.json", path + ".meta.json"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    meta = _read_meta(part_meta) if offset else {}
+
+    etag, modified = meta.get("etag", ""), meta.get("last_modified", "")
+    validator = (etag if etag and not etag.startswith("W/") else "") or modified  # If-Range needs a strong one
+    if offset and validator:
+        headers = {"Accept-Encoding": meta.get("encoding") or "identity",
+                   "Range": f"bytes={offset}-", "If-Range": validator}
+    else:
+        offset = 0
+        headers = {"Accept-Encoding": "gzip"}
+        done = download_validators(path) if os.path.exists(path) else {}
+        if done.get("etag"):
+            headers["If-None-Match"] = done["etag"]
+        if done.get("last_modified"):
+            headers["If-Modified-Since"] = done["last_modified"]
+
+    check_deadline(f"downloading {url}")
+    timeout = timeout_for(timeout)
+    with span("http.download", url=url, resume_from=offset) as s:
+        resp = get_session().get(url, timeout=timeout, headers=headers, stream=True)
+        try:
+            if resp.status_code == 416 and offset:  # the range is past the end: start over
+                for stale in (part, part_meta):
+                    if os.path.exists(stale):
+                        os.remove(stale)
+                return _download(url, path, timeout)
+            resp.raise_for_status()
+            if resp.status_code == 304:
+                _record(resp, 0, 0)
+                s.set(bytes=0, not_modified=True)
+                return path
+            resumed = resp.status_code == 206
+            if not resumed:
+                offset = 0
+                encoding = resp.headers.get("Content-Encoding", "identity").strip().lower() or "identity"
+                if encoding not in ("identity", "gzip", "x-gzip"):
+                    raise ValueError(f"Unsupported Content-Encoding {encoding!r} from {url}")
+                meta = {"etag": resp.headers.get("ETag", ""),
+                        "last_modified": resp.headers.get("Last-Modified", ""), "encoding": encoding}
+                _write_meta(part_meta, meta)
+            written = 0
+            with open(part, "ab" if resumed else "wb") as f:
+                # Encoded bytes as sent, so a resumed Range continues the same byte stream
+                for chunk in resp.raw.stream(CHUNK_SIZE, decode_content=False):
+                    check_deadline(f"{url} finished downloading")  # the .part file is kept for a resume
+                    f.write(chunk)
+                    written += len(chunk)
+        finally:
+            resp.close()
+
+        if meta.get("encoding", "identity") == "identity":
+            os.replace(part, path)
+        else:
+            with gzip.open(part, "rb") as src, open(part + ".out", "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            os.replace(part + ".out", path)
+            os.remove(part)
+        decoded = os.path.getsize(path)
+        # A resumed request's share of the decoded file, pro rata
+        _record(resp, written, decoded * written // (offset + written) if offset + written else 0)
+        s.set(bytes=written, bytes_decoded=decoded, resumed=resumed, total_bytes=offset + written)
+
+    _write_meta(done_meta, {"etag": meta.get("etag", ""), "last_modified": meta.get("last_modified", "")})
+    if os.path.exists(part_meta):
+        os.remove(part_meta)
+    return path
+
+
+def fetch_stats() -> Dict[str, Any]:
+    """Bytes on the wire vs decoded, retries, and how often pooled connections were reused."""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+        pools = list(_pools.values())
+    new_conns = sum(getattr(p, "num_connections", 0) for p in pools)
+    pool_requests = sum(getattr(p, "num_requests", 0) for p in pools)
+    stats["connections_opened"] = new_conns
+    stats["connection_reuse_ratio"] = round(1 - new_conns / pool_requests, 4) if pool_requests else 0.0
+    stats["compression_ratio"] = round(stats["bytes_decoded"] / stats["bytes_wire"], 3) if stats["bytes_wire"] else 0.0
+    return stats
@@ -0,0 +1,190 @@
+# pipelines/provider_columns.py
+"""
+Columnar (NumPy) filter engine over normalized provider rows.
+
+The row filters in provider_json_retrieval loop over dicts and re-parse every row's ZIP on
+every query. Here each row is parsed once into columns:
+
+  zip        int32[n]   5-digit ZIP as an integer (-1 when the row has none)
+  spec_id    int32[n]   index into `specialties`, the distinct specialty strings
+
+and a query is a few boolean masks over those arrays:
+
+  - ZIP radius:  np.isin(zip, neighbouring ZIPs as integers)
+  - specialty:   the fuzzy match is evaluated once per *distinct* specialty string (a flag per
+                 value, cached per token set) and gathered to a per-row flag column by spec_id
+  - combined:    zip_mask & specialty_mask, with the same fallback as
+                 filter_providers_by_specialty (no specialty match -> every nearby row)
+
+Results are the original row dicts, in directory order, exactly as
+filter_providers_by_zip + filter_providers_by_specialty would return them. Row ids are also
+kept sorted by ZIP, so iter_rows() streams one ZIP's rows without a scan (for the nearest-first
+top-k search in pipelines/provider_stream.py).
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from pipelines.provider_json_retrieval import (
+    _normalize_zip,
+    expand_specialty_tokens,
+    get_zip_codes_within_distance,
+    specialty_matches,
+)
+from utils.tracing import span
+
+
+def _zip_int(value: Any) -> int:
+    value = str(value or "")
+    if len(value) == 5 and value.isdigit():
+        return int(value)  # already normalized (every scrape_json_url row): skip the regex
+    zp = _normalize_zip(value)
+    return int(zp) if zp else -1
+
+
+# ZIPs whose match counts first_k() looks up at once: a handful of vectorized lookups per radius,
+# while a search that matches in the nearest ZIPs does not pay for the rest of the radius
+_FIRST_K_CHUNK = 64
+
+
+@lru_cache(maxsize=1024)
+def _neighbor_zip_ints(target_zip: str, radius_miles: float) -> np.ndarray:
+    return np.array([int(z) for z in get_zip_codes_within_distance(target_zip, radius_miles)], dtype=np.int32)
+
+
+class ProviderColumns:
+    """Same search() interface as ProviderRows / ProviderSnapshot, answered with vectorized masks."""
+
+    def __init__(self, rows: List[Dict[str, Any]], version: str = ""):
+        self.rows = rows
+        self.version = version
+        with span("directory.columns", rows=len(rows)) as s:
+            self.zip = np.fromiter((_zip_int(r.get("zip", "")) for r in rows), dtype=np.int32, count=len(rows))
+            ids: Dict[str, int] = {}
+            self.spec_id = np.fromiter(
+                (ids.setdefault(str(r.get("specialty") or ""), len(ids)) for r in rows), dtype=np.int32, count=len(rows)
+            )
+            self.specialties: List[str] = list(ids)
+            # Row ids grouped by ZIP (directory order within a ZIP), for iter_rows()
+            self._zip_order = np.argsort(self.zip, kind="stable")
+            keys, starts, counts = np.unique(self.zip[self._zip_order], return_index=True, return_counts=True)
+            self._zip_range: Dict[int, tuple[int, int]] = {
+                k: (lo, lo + n) for k, lo, n in zip(keys.tolist(), starts.tolist(), counts.tolist())
+            }
+            s.set(specialties=len(self.specialties))
+        self._spec_flags: Dict[frozenset, np.ndarray] = {}
+        self._match_counts: Dict[frozenset, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # --- masks ---
+    def zip_mask(self, zip_code: str, radius_miles: float) -> np.ndarray:
+        """Rows whose ZIP is within the radius of zip_code (all False for an invalid ZIP)."""
+        target = _normalize_zip(zip_code)
+        if not target:
+            return np.zeros(len(self.rows), dtype=bool)
+        return np.isin(self.zip, _neighbor_zip_ints(target, float(radius_miles)), kind="table")
+
+    def specialty_flags(self, specialties: List[str]) -> np.ndarray:
+        """One flag per distinct specialty string: does it match the fuzzy specialty filter."""
+        tokens = frozenset(expand_specialty_tokens(specialties))
+        flags = self._spec_flags.get(tokens)
+        if flags is None:
+            flags = np.fromiter((specialty_matches(spec, tokens) for spec in self.specialties),
+                                dtype=bool, count=len(self.specialties))
+            self._spec_flags[tokens] = flags
+        return flags
+
+    def match_counts(self, specialties: List[str]) -> np.ndarray:
+        """
+        Running count of matching rows in ZIP order (the k-th entry counts the first k rows of
+        the ZIP-sorted ids), so a ZIP's matches are two lookups; cached per token set.
+        """
+        tokens = frozenset(expand_specialty_tokens(specialties))
+        cum = self._match_counts.get(tokens)
+        if cum is None:
+            cum = np.zeros(len(self.rows) + 1, dtype=np.int32)
+            np.cumsum(self.specialty_flags(specialties)[self.spec_id[self._zip_order]], out=cum[1:])
+            self._match_counts[tokens] = cum
+        return cum
+
+    def specialty_mask(self, specialties: List[str]) -> np.ndarray:
+        """Rows whose specialty matches (no fallback applied)."""
+        return self.specialty_flags(specialties)[self.spec_id]
+
+    def select(self, mask: np.ndarray) -> List[Dict[str, Any]]:
+        rows = self.rows
+        return [rows[i] for i in np.flatnonzero(mask).tolist()]
+
+    def iter_rows(self, zips: Iterable[str], specialties: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Rows ZIP by ZIP in the order of `zips` (directory order within a ZIP), lazily; only rows
+        matching `specialties` when given (no fallback).
+        """
+        flags = self.specialty_flags(specialties) if specialties else None
+        rows = self.rows
+        for z in zips:
+            bounds = self._zip_range.get(_zip_int(z))
+            if bounds is None:
+                continue
+            ids = self._zip_order[bounds[0]:bounds[1]]
+            if flags is not None:
+                ids = ids[flags[self.spec_id[ids]]]
+            for i in ids.tolist():
+                yield rows[i]
+
+    def first_k(self, zips: Iterable[str], specialties: List[str], k: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        (first k iter_rows(zips, specialties) rows, first k iter_rows(zips) rows) in one pass over
+        the ZIPs, stopping at the k-th match; the second list is search_top_k's fallback. Matches
+        are counted per ZIP from match_counts() a chunk of ZIPs at a time, so only the ZIPs that
+        hold one are filtered row by row.
+        """
+        flags = self.specialty_flags(specialties)
+        cum = self.match_counts(specialties)
+        rows = self.rows
+        out: List[Dict[str, Any]] = []
+        head: List[Dict[str, Any]] = []
+        zips = iter(zips)
+        while len(out) < k:
+            chunk = list(islice(zips, _FIRST_K_CHUNK))
+            if not chunk:
+                break
+            ranges = [b for b in map(self._zip_range.get, map(_zip_int, chunk)) if b is not None]
+            for lo, hi in ranges:
+                if len(head) >= k:
+                    break
+                head.extend(rows[i] for i in self._zip_order[lo:hi][:k - len(head)].tolist())
+            if not ranges:
+                continue
+            bounds = np.array(ranges, dtype=np.int64)
+            found = cum[bounds[:, 1]] - cum[bounds[:, 0]]
+            for j in np.flatnonzero(found).tolist():
+                ids = self._zip_order[ranges[j][0]:ranges[j][1]]
+                ids = ids[flags[self.spec_id[ids]]]
+                out.extend(rows[i] for i in ids[:k - len(out)].tolist())
+                if len(out) >= k:
+                    break
+        return out, head
+
+    # --- queries ---
+    def filter_by_zip(self, zip_code: str, radius_miles: float) -> List[Dict[str, Any]]:
+        """filter_providers_by_zip over these rows."""
+        return self.select(self.zip_mask(zip_code, radius_miles))
+
+    def search(self, zip_code: str, radius_miles: float, specialties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """ZIP-radius filter, then (optionally) the fuzzy specialty filter; search_rows() semantics."""
+        with span("columns.search", rows_in=len(self.rows), radius_miles=radius_miles) as s:
+            mask = self.zip_mask(zip_code, radius_miles)
+            if specialties:
+                matched = mask & self.specialty_mask(specialties)
+                if matched.any():
+                    mask = matched  # else: nothing matched -> every nearby row
+            out = self.select(mask)
+            s.set(rows_out=len(out))
+            return out
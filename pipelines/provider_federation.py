@@ -0,0 +1,145 @@
+# pipelines/provider_federation.py
+"""
+Federated provider directory loading.
+
+Fetches N payer directories concurrently, normalizes each with its source's normalizer
+(same row shape as scrape_json_url), and merges them into one deduplicated ProviderStore
+with a per-source attribution column. Network time overlaps, so total load time is close
+to that of the slowest source.
+
+Configure sources in code (DirectorySource) or via PROVIDER_SOURCES, a JSON list:
+  [{"name": "anthem_ca", "url": "https://www22.anthem.com/CMS/PROVIDERS_CAM.json"},
+   {"name": "cms", "url": "/data/DAC_NationalDownloadableFile.csv", "format": "cms_dac"}]
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from pipelines.provider_json_retrieval import (
+    content_version,
+    fetch_text_from_url,
+    normalize_provider_json,
+    _normalize_zip,
+)
+from pipelines.provider_store import ProviderStore
+from utils.tracing import span
+
+
+# ----------------------------
+# Normalizers: raw text -> normalized rows
+# ----------------------------
+def normalize_qhp_json(raw: str) -> List[Dict[str, Any]]:
+    """Anthem / CMS QHP machine-readable provider JSON (what scrape_json_url parses)."""
+    return normalize_provider_json(json.loads(raw))
+
+
+def normalize_cms_dac_csv(raw: str) -> List[Dict[str, Any]]:
+    """CMS 'Doctors and Clinicians' national downloadable file (CSV, one row per address)."""
+    def col(r: Dict[str, str], *names: str) -> str:
+        for n in names:
+            if r.get(n):
+                return r[n].strip()
+        return ""
+
+    rows = []
+    for r in csv.DictReader(io.StringIO(raw)):
+        zip5 = _normalize_zip(col(r, "ZIP Code", "zip")[:5])
+        if not zip5:
+            continue
+        name = " ".join(x for x in [col(r, "Provider First Name", "frst_nm"), col(r, "Provider Last Name", "lst_nm")] if x)
+        specs = [col(r, "pri_spec")] + [s.strip() for s in col(r, "sec_spec_all").split("|")]
+        street = " ".join(x for x in [col(r, "adr_ln_1"), col(r, "adr_ln_2")] if x)
+        rows.append({
+            "name": (name or col(r, "Facility Name", "org_nm") or "Unknown Provider").title(),
+            "phone": col(r, "Telephone Number", "phn_numbr"),
+            "address": street.title(),
+            "city": col(r, "City/Town", "cty").title(),
+            "state": col(r, "State", "st"),
+            "zip": zip5,
+            "specialty": ", ".join(dict.fromkeys(s.title() for s in specs if s)),
+            "website": "",
+            "npi": col(r, "NPI"),
+            "_raw": r,
+        })
+    return rows
+
+
+NORMALIZERS: Dict[str, Callable[[str], List[Dict[str, Any]]]] = {
+    "qhp_json": normalize_qhp_json,
+    "anthem": normalize_qhp_json,
+    "cms_dac": normalize_cms_dac_csv,
+}
+
+
+@dataclass
+class DirectorySource:
+    name: str                 # attribution label, e.g. "anthem_ca"
+    url: str                  # http(s) URL, file:// URL or local path
+    format: str = "qhp_json"  # key into NORMALIZERS
+    timeout: int = 25
+
+
+def sources_from_env(var: str = "PROVIDER_SOURCES") -> List[DirectorySource]:
+    raw = os.getenv(var)
+    return [DirectorySource(**s) for s in json.loads(raw)] if raw else []
+
+
+# ----------------------------
+# Loader
+# ----------------------------
+def _load_source(source: DirectorySource) -> Tuple[List[Dict[str, Any]], str]:
+    """(normalized rows, content_version of the payload)."""
+    normalizer = NORMALIZERS[source.format]
+    with span("directory.source", source=source.name) as s:
+        raw = fetch_text_from_url(source.url, timeout=source.timeout)
+        rows = normalizer(raw)
+        s.set(bytes=len(raw), rows=len(rows))
+        return rows, content_version(raw)
+
+
+def load_federated_directory(
+    sources: List[DirectorySource],
+    max_workers: Optional[int] = None,
+) -> ProviderStore:
+    """
+    Fetch + normalize all sources concurrently and merge them into one ProviderStore.
+    A failing source is reported and skipped; raises only if every source fails.
+    Rows are merged in the order the sources are listed, so earlier sources win conflicts.
+    """
+    if not sources:
+        raise ValueError("No provider directory sources configured.")
+
+    started = time.monotonic()
+    results: Dict[str, Tuple[List[Dict[str, Any]], str]] = {}
+    errors: Dict[str, str] = {}
+    with span("directory.federated_load", sources=len(sources)) as s:
+        with ThreadPoolExecutor(max_workers=max_workers or len(sources), thread_name_prefix="directory") as pool:
+            futures = {pool.submit(_load_source, src): src for src in sources}
+            for fut in as_completed(futures):
+                src = futures[fut]
+                try:
+                    results[src.name] = fut.result()
+                except Exception as e:
+                    errors[src.name] = f"{type(e).__name__}: {e}"
+                    print(f"⚠️ Provider source '{src.name}' failed to load: {errors[src.name]}")
+
+        if not results:
+            raise RuntimeError(f"All provider sources failed: {errors}")
+
+        # Versioned by content: the same sources with the same payloads give the same version
+        loaded = [src for src in sources if src.name in results]
+        store = ProviderStore(version=content_version(
+            "|".join(f"{src.name}:{src.format}:{results[src.name][1]}" for src in loaded)))
+        for src in loaded:
+            store.add_rows(src.name, results[src.name][0])
+        store.load_seconds = time.monotonic() - started
+        store.errors = errors
+        s.set(rows=len(store), rows_in=sum(len(r) for r, _ in results.values()), failed=len(errors))
+    return store
@@ -1,12 +1,17 @@
 # pipelines/provider_json_retrieval.py
 from __future__ import annotations
 
+import hashlib
+import importlib.util
 import json
 import math
+import os
 import re
-from typing import Any, Dict, List
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
 
-import requests
+from pipelines.http_fetch import download_to_file
+from utils.tracing import span
 
 # Optional zipcode DB (for geo filtering)
 try:
@@ -15,19 +20,32 @@ except Exception:
     zipcodes = None
 
 # Optional vector search (nice-to-have). We fall back if unavailable or rate-limited.
-try:
-    from langchain_openai import OpenAIEmbeddings
-    from langchain_community.vectorstores import FAISS
-    _HAS_FAISS = True
-except Exception:
-    _HAS_FAISS = False
+# Only probe for the packages here; they are imported on first use (they are slow to import).
+_HAS_FAISS = all(
+    importlib.util.find_spec(m) is not None for m in ("langchain_openai", "langchain_community", "faiss")
+)
+
+# Remote directories are downloaded here first; an interrupted download resumes on the next load
+DIRECTORY_CACHE_DIR = os.getenv(
+    "PROVIDER_DIRECTORY_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "healthlight", "directories")
+)
+
 
 # Network fetch
 def fetch_text_from_url(url: str, timeout: int = 25) -> str:
-    """Fetch raw text content from a URL (raises on error)."""
-    resp = requests.get(url, timeout=timeout)
-    resp.raise_for_status()
-    return resp.text
+    """Fetch raw text content from a URL or local file (file:// or a plain path); raises on error."""
+    with span("directory.fetch", url=url) as s:
+        local = url[len("file://"):] if url.startswith("file://") else url
+        remote = not url.startswith("file://") and not os.path.exists(url)
+        if remote:
+            # Pooled session, retry with backoff, resumable Range download (pipelines/http_fetch.py)
+            os.makedirs(DIRECTORY_CACHE_DIR, exist_ok=True)
+            name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+            local = download_to_file(url, os.path.join(DIRECTORY_CACHE_DIR, f"{name}.json"), timeout=timeout)
+        with open(local, encoding="utf-8") as f:
+            text = f.read()
+        s.set(bytes=len(text), local=not remote)
+        return text
 
 # Normalization helpers
 def _normalize_zip(value: str) -> str:
@@ -48,6 +66,11 @@ def _join_specialty(spec: Any) -> str:
         return spec.strip()
     return ""
 
+def content_version(raw: str) -> str:
+    """Directory version derived from the payload: unchanged data keeps its version (and caches)."""
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
 # JSON normalization (address-aware)
 def scrape_json_url(url: str, timeout: int = 25) -> List[Dict[str, Any]]:
     """
@@ -56,9 +79,20 @@ def scrape_json_url(url: str, timeout: int = 25) -> List[Dict[str, Any]]:
     Normalized keys per record:
       name, phone, address, city, state, zip, specialty, website, _raw
     """
+    return load_provider_json(url, timeout=timeout)[0]
+
+
+def load_provider_json(url: str, timeout: int = 25) -> Tuple[List[Dict[str, Any]], str]:
+    """scrape_json_url plus the content_version() of the fetched payload."""
     raw = fetch_text_from_url(url, timeout=timeout)
-    data = json.loads(raw)
+    with span("directory.parse", bytes=len(raw)) as s:
+        normalized = normalize_provider_json(json.loads(raw))
+        s.set(rows=len(normalized))
+    return normalized, content_version(raw)
+
 
+def normalize_provider_json(data: Any) -> List[Dict[str, Any]]:
+    """Flatten parsed Anthem/CMS QHP provider JSON to one normalized record per address."""
     # If top-level is a dict, try to find the first list-like value
     if isinstance(data, dict):
         for v in data.values():
@@ -123,23 +157,57 @@ def scrape_json_url(url: str, timeout: int = 25) -> List[Dict[str, Any]]:
                 }
             )
 
-    # Basic telemetry
-    # print(f"Parsed {len(normalized)} provider-address rows.")
     return normalized
 
 # Geo filtering by ZIP radius
+def warm_zip_database() -> None:
+    """Load the zipcodes database now (its first query otherwise pays ~1s for the load)."""
+    if zipcodes:
+        zipcodes.list_all()
+
+
 def get_zip_codes_within_distance(target_zip: str, radius_miles: float) -> List[str]:
     """
     Returns zip codes within X miles from a target zip code using a bounding-box optimization.
     If `zipcodes` is unavailable or target_zip invalid, returns [target_zip] as a safe fallback.
+    ZIPs are ordered nearest first (box distance, then ZIP). Served from the materialized
+    neighbour table (pipelines/zip_neighbors.py) when it is available and covers the radius;
+    computed on the fly otherwise.
     """
-    tz = _normalize_zip(target_zip)
+    with span("filter.zip_radius", radius_miles=radius_miles) as s:
+        nearby = _zip_codes_within_distance(_normalize_zip(target_zip), float(radius_miles))
+        s.set(zips=len(nearby))
+        return list(nearby)
+
+
+def _neighbor_table():
+    try:
+        from pipelines.zip_neighbors import current_table  # numpy; imported on first lookup
+    except ImportError:
+        return None
+    return current_table()
+
+
+# Memoized: the neighbour set of a ZIP never changes, and the scan over every US ZIP is the
+# expensive part of a search (the first call also loads the zipcodes database).
+@lru_cache(maxsize=4096)
+def _zip_codes_within_distance(tz: str, radius_miles: float) -> Tuple[str, ...]:
     if not tz or not zipcodes:
-        return [tz] if tz else []
+        return (tz,) if tz else ()
 
+    table = _neighbor_table()
+    if table is not None:
+        nearby = table.neighbors_within(tz, radius_miles)
+        if nearby is not None:
+            return tuple(nearby)
+    return _bbox_scan(tz, radius_miles)
+
+
+def _bbox_scan(tz: str, radius_miles: float) -> Tuple[str, ...]:
+    """On-the-fly bounding-box test against every ZIP in the database, nearest first."""
     info = zipcodes.matching(tz)
     if not info:
-        return [tz]
+        return (tz,)
 
     lat = float(info[0]["lat"])
     lon = float(info[0]["long"])
@@ -148,8 +216,9 @@ def get_zip_codes_within_distance(target_zip: str, radius_miles: float) -> List[
 
     min_lat, max_lat = lat - lat_offset, lat + lat_offset
     min_lon, max_lon = lon - lon_offset, lon + lon_offset
+    lon_miles = 69.0 * math.cos(math.radians(lat))
 
-    nearby = []
+    nearby: Dict[str, int] = {}
     for z in zipcodes.list_all():
         try:
             zl = float(z["lat"])
@@ -157,11 +226,13 @@ def get_zip_codes_within_distance(target_zip: str, radius_miles: float) -> List[
             if min_lat <= zl <= max_lat and min_lon <= zlon <= max_lon:
                 z5 = _normalize_zip(z.get("zip_code", ""))
                 if z5:
-                    nearby.append(z5)
+                    # Box distance in ceil hundredths of a mile, as stored in the neighbour table
+                    d = max(abs(zl - lat) * 69.0, abs(zlon - lon) * lon_miles)
+                    nearby[z5] = min(nearby.get(z5, 1 << 30), math.ceil(round(d * 100, 6)))
         except Exception:
             continue
 
-    return sorted(set(nearby))
+    return tuple(sorted(nearby, key=lambda z5: (nearby[z5], z5)))
 
 
 def filter_providers_by_zip(
@@ -174,26 +245,68 @@ def filter_providers_by_zip(
     if not target_zip:
         return []
 
-    allowed = set(get_zip_codes_within_distance(target_zip, radius_miles))
-    out = []
-    for p in providers:
-        zp = _normalize_zip(p.get("zip", ""))
-        if zp and zp in allowed:
-            out.append(p)
-    return out
+    with span("filter.zip", rows_in=len(providers), radius_miles=radius_miles) as s:
+        allowed = set(get_zip_codes_within_distance(target_zip, radius_miles))
+        out = []
+        for p in providers:
+            zp = p.get("zip", "")
+            if not (isinstance(zp, str) and len(zp) == 5 and zp.isdigit()):
+                zp = _normalize_zip(zp)  # rows from scrape_json_url are already normalized
+            if zp and zp in allowed:
+                out.append(p)
+        s.set(rows_out=len(out))
+        return out
 
 # Fuzzy specialty filtering with broad synonyms
-def filter_providers_by_specialty(providers: List[Dict[str, Any]], specialties: List[str]) -> List[Dict[str, Any]]:
-    """
-    Fuzzy specialty filter for provider lists.
-    - Case-insensitive, partial-word matching
-    - Splits comma-/slash-separated input
-    - Adds synonyms for common procedures / domains
-    """
-    if not specialties:
-        return providers
-
-    # Normalize desired specialties → tokens
+SPECIALTY_SYNONYMS: Dict[str, List[str]] = {
+    # GI & colon procedures
+    "gastro": ["digestive", "colon", "rectal", "bowel", "endoscopy", "colorectal"],
+    "colorectal": ["colon", "rectal", "proctology", "colon and rectal"],
+    "digestive": ["gastro", "colon", "bowel"],
+
+    # Imaging & diagnostics
+    "radiology": ["imaging", "diagnostic", "mri", "ct", "scan", "x-ray", "ultrasound", "nuclear medicine", "mammogram", "breast imaging"],
+    "mri": ["radiology", "imaging", "diagnostic", "magnetic resonance"],
+    "x-ray": ["radiology", "imaging", "diagnostic"],
+    "ultrasound": ["radiology", "imaging", "sonography"],
+    "mammogram": ["radiology", "breast imaging"],
+
+    # Cardiology & heart
+    "cardiology": ["cardiac", "heart", "vascular", "echocardiography", "cardiovascular", "angiogram"],
+    "cardiac": ["cardiology", "heart", "cardiothoracic"],
+
+    # Women's health
+    "obstetric": ["obstetrics", "gynecology", "women", "pregnancy", "ob/gyn", "obgyn"],
+    "gynecology": ["obstetrics", "women", "ob/gyn", "obgyn", "female"],
+
+    # Primary care
+    "family": ["primary care", "general practice", "internal medicine", "pediatrics"],
+    "internal": ["internal medicine", "primary care", "general practice"],
+    "pediatric": ["child", "children", "pediatrics", "family"],
+
+    # Orthopedics & physical therapy
+    "orthopedic": ["sports medicine", "physical therapy", "rehabilitation", "joint", "musculoskeletal"],
+    "rehabilitation": ["physical therapy", "occupational therapy", "sports medicine"],
+    "therapy": ["physical therapy", "occupational therapy", "rehab", "speech therapy"],
+
+    # Surgery
+    "surgery": ["surgical", "general surgery", "orthopedic surgery", "colorectal surgery", "cardiac surgery", "plastic surgery"],
+    "plastic": ["cosmetic", "reconstructive", "aesthetic surgery"],
+    "urology": ["urinary", "kidney", "bladder", "prostate"],
+
+    # Dentistry & vision
+    "dental": ["dentistry", "oral", "teeth"],
+    "optometry": ["eye", "vision", "ophthalmology"],
+    "ophthalmology": ["optometry", "eye", "vision"],
+
+    # Mental health
+    "psychiatry": ["mental health", "psychology", "behavioral health", "therapy"],
+    "psychology": ["counseling", "mental health", "behavioral health"],
+}
+
+
+def expand_specialty_tokens(specialties: List[str]) -> set[str]:
+    """Lower-cased match tokens for the requested specialties, split on , and / and expanded with synonyms."""
     tokens: set[str] = set()
     for s in specialties:
         for part in re.split(r"[,/]", s.lower()):
@@ -201,67 +314,38 @@ def filter_providers_by_specialty(providers: List[Dict[str, Any]], specialties:
             if part:
                 tokens.add(part)
 
-    # Synonyms / category expansion
-    synonyms = {
-        # GI & colon procedures
-        "gastro": ["digestive", "colon", "rectal", "bowel", "endoscopy", "colorectal"],
-        "colorectal": ["colon", "rectal", "proctology", "colon and rectal"],
-        "digestive": ["gastro", "colon", "bowel"],
-
-        # Imaging & diagnostics
-        "radiology": ["imaging", "diagnostic", "mri", "ct", "scan", "x-ray", "ultrasound", "nuclear medicine", "mammogram", "breast imaging"],
-        "mri": ["radiology", "imaging", "diagnostic", "magnetic resonance"],
-        "x-ray": ["radiology", "imaging", "diagnostic"],
-        "ultrasound": ["radiology", "imaging", "sonography"],
-        "mammogram": ["radiology", "breast imaging"],
-
-        # Cardiology & heart
-        "cardiology": ["cardiac", "heart", "vascular", "echocardiography", "cardiovascular", "angiogram"],
-        "cardiac": ["cardiology", "heart", "cardiothoracic"],
-
-        # Women's health
-        "obstetric": ["obstetrics", "gynecology", "women", "pregnancy", "ob/gyn", "obgyn"],
-        "gynecology": ["obstetrics", "women", "ob/gyn", "obgyn", "female"],
-
-        # Primary care
-        "family": ["primary care", "general practice", "internal medicine", "pediatrics"],
-        "internal": ["internal medicine", "primary care", "general practice"],
-        "pediatric": ["child", "children", "pediatrics", "family"],
-
-        # Orthopedics & physical therapy
-        "orthopedic": ["sports medicine", "physical therapy", "rehabilitation", "joint", "musculoskeletal"],
-        "rehabilitation": ["physical therapy", "occupational therapy", "sports medicine"],
-        "therapy": ["physical therapy", "occupational therapy", "rehab", "speech therapy"],
-
-        # Surgery
-        "surgery": ["surgical", "general surgery", "orthopedic surgery", "colorectal surgery", "cardiac surgery", "plastic surgery"],
-        "plastic": ["cosmetic", "reconstructive", "aesthetic surgery"],
-        "urology": ["urinary", "kidney", "bladder", "prostate"],
-
-        # Dentistry & vision
-        "dental": ["dentistry", "oral", "teeth"],
-        "optometry": ["eye", "vision", "ophthalmology"],
-        "ophthalmology": ["optometry", "eye", "vision"],
-
-        # Mental health
-        "psychiatry": ["mental health", "psychology", "behavioral health", "therapy"],
-        "psychology": ["counseling", "mental health", "behavioral health"],
-    }
-
     for t in list(tokens):
-        for base, syns in synonyms.items():
+        for base, syns in SPECIALTY_SYNONYMS.items():
             if base in t:
                 tokens.update(syns)
+    return tokens
 
-    out = []
-    for p in providers:
-        spec = str(p.get("specialty", "")).lower()
-        # normalize punctuation to spaces so "OB/GYN" matches "obgyn"
-        spec = re.sub(r"[^a-z0-9 ]", " ", spec)
-        if not spec:
-            continue
-        if any(tok in spec for tok in tokens):
-            out.append(p)
+
+def specialty_matches(specialty: str, tokens: set[str]) -> bool:
+    """True if any token occurs in the provider's specialty string."""
+    spec = str(specialty or "").lower()
+    # normalize punctuation to spaces so "OB/GYN" matches "obgyn"
+    spec = re.sub(r"[^a-z0-9 ]", " ", spec)
+    if not spec:
+        return False
+    return any(tok in spec for tok in tokens)
+
+
+def filter_providers_by_specialty(providers: List[Dict[str, Any]], specialties: List[str]) -> List[Dict[str, Any]]:
+    """
+    Fuzzy specialty filter for provider lists.
+    - Case-insensitive, partial-word matching
+    - Splits comma-/slash-separated input
+    - Adds synonyms for common procedures / domains
+    """
+    if not specialties:
+        return providers
+
+    tokens = expand_specialty_tokens(specialties)
+
+    with span("filter.specialty", rows_in=len(providers), tokens=len(tokens)) as s:
+        out = [p for p in providers if specialty_matches(p.get("specialty", ""), tokens)]
+        s.set(rows_out=len(out))
 
     # If nothing matched, return original list so caller can still show nearby options
     return out or providers
@@ -277,22 +361,27 @@ def _keyword_score(text: str, query: str) -> float:
     return hits / max(1, len(q_terms))
 
 
-def simple_retriever(docs: List[str], query: str, k: int = 4) -> List[str]:
+def simple_retriever(docs: List[str], query: str, k: int = 4, use_vectors: bool = True) -> List[str]:
     """
     Retrieve top-k strings from a list of texts.
 
-    1) If FAISS + OpenAI embeddings are available, use vector search.
+    1) If FAISS + OpenAI embeddings are available (and use_vectors), use vector search.
     2) On any embedding API/rate/other error, fall back to keyword scoring.
     3) Otherwise always use keyword scoring.
     """
-    if _HAS_FAISS:
-        try:
-            embeddings = OpenAIEmbeddings()  # uses OPENAI_API_KEY from env
-            vs = FAISS.from_texts(docs, embedding=embeddings)
-            return [d.page_content for d in vs.similarity_search(query, k=k)]
-        except Exception as e:
-            # Graceful fallback
-            print(f"⚠️ Embedding retrieval unavailable, falling back to keyword scoring ({type(e).__name__}: {e})")
-
-    scored = sorted(docs, key=lambda d: _keyword_score(d, query), reverse=True)
-    return scored[:k]
+    with span("retriever.simple", docs=len(docs), k=k) as s:
+        if _HAS_FAISS and use_vectors:
+            try:
+                from langchain_openai import OpenAIEmbeddings
+                from langchain_community.vectorstores import FAISS
+                embeddings = OpenAIEmbeddings()  # uses OPENAI_API_KEY from env
+                vs = FAISS.from_texts(docs, embedding=embeddings)
+                s.set(mode="vector")
+                return [d.page_content for d in vs.similarity_search(query, k=k)]
+            except Exception as e:
+                # Graceful fallback
+                print(f"⚠️ Embedding retrieval unavailable, falling back to keyword scoring ({type(e).__name__}: {e})")
+
+        s.set(mode="keyword")
+        scored = sorted(docs, key=lambda d: _keyword_score(d, query), reverse=True)
+        return scored[:k]
@@ -0,0 +1,175 @@
+# pipelines/provider_refresh.py
+"""
+Background refresh of the provider directory.
+
+DirectoryRefresher loads the directory and its derived indexes (the ZIP database, the
+materialized ZIP neighbour table, neighbour sets for PROVIDER_PREWARM_ZIPS, the in-memory
+ZIP / specialty index, or the NumPy column engine when NumPy is available) on a background
+thread at startup, reloads it every `interval_s`, and swaps the new version in with a single
+reference assignment. Without NumPy, when the new version can rebase_on() the live one, its
+row index is derived by applying only the added / removed / changed rows (copy-on-write)
+rather than rebuilt from scratch; the column engine is always rebuilt (cheaper than the
+diff). A query takes `current()` once and keeps using that object, so in-flight queries
+see one consistent version, and no query waits on a reload; only a query arriving before
+the very first load completes waits for it.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from pipelines.provider_json_retrieval import get_zip_codes_within_distance, warm_zip_database
+from utils.token_utils import warm_encodings
+from utils.tracing import span
+
+def ensure_neighbor_table() -> None:
+    """Load (building and persisting on first run) the materialized ZIP neighbour table."""
+    try:
+        from pipelines.zip_neighbors import ensure_table
+        ensure_table()
+    except Exception as e:
+        print(f"⚠️ ZIP neighbour table unavailable, using on-the-fly radius lookups ({type(e).__name__}: {e})")
+
+
+DEFAULT_REFRESH_S = float(os.getenv("PROVIDER_REFRESH_S", "3600"))
+# Retry delay while no version has loaded yet (the regular interval applies afterwards)
+INITIAL_RETRY_S = 30.0
+PREWARM_RADII = (15.0, 30.0)
+
+
+def prewarm_zips_from_env(var: str = "PROVIDER_PREWARM_ZIPS") -> list[str]:
+    return [z.strip() for z in os.getenv(var, "").split(",") if z.strip()]
+
+
+class DirectoryRefresher:
+    def __init__(
+        self,
+        loader: Callable[[], Any],
+        interval_s: float = DEFAULT_REFRESH_S,
+        prewarm_zips: Optional[Iterable[str]] = None,
+        name: str = "provider-directory",
+    ):
+        """
+        loader: returns a freshly loaded directory (anything with search(); columns(), else
+                index(), is called too when present). interval_s <= 0 loads once and
+                never refreshes.
+        """
+        self._loader = loader
+        self.interval_s = interval_s
+        self.prewarm_zips = list(prewarm_zips if prewarm_zips is not None else prewarm_zips_from_env())
+        self.name = name
+
+        self._current: Any = None
+        self._attempted = threading.Event()   # set after the first load attempt (success or not)
+        self._stop = threading.Event()
+        self._load_lock = threading.Lock()    # one load at a time
+        self._thread: Optional[threading.Thread] = None
+
+        self.version: Optional[str] = None
+        self.loaded_at: Optional[float] = None
+        self.last_load_s: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_delta: Optional[Dict[str, int]] = None  # added / removed / changed of the last refresh
+        self.loads = 0
+        self.failures = 0
+
+    # --- lifecycle ---
+    def start(self) -> "DirectoryRefresher":
+        """Start the background loader (idempotent); returns immediately."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        self.refresh()
+        while True:
+            if self._current is None:
+                delay = min(INITIAL_RETRY_S, self.interval_s) if self.interval_s > 0 else INITIAL_RETRY_S
+            elif self.interval_s > 0:
+                delay = self.interval_s
+            else:
+                return
+            if self._stop.wait(delay):
+                return
+            self.refresh()
+
+    # --- loading ---
+    def refresh(self) -> bool:
+        """Load + prewarm a new version and swap it in; on failure keep serving the previous one."""
+        with self._load_lock, span("directory.refresh", directory=self.name) as s:
+            t0 = time.monotonic()
+            try:
+                directory = self._loader()
+                rebase = getattr(directory, "rebase_on", None)
+                delta = rebase(self._current) if callable(rebase) and self._current is not None else None
+                self._prewarm(directory)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                kept = "keeping the previous version" if self._current is not None else "no version loaded yet"
+                print(f"⚠️ Provider directory refresh failed ({self.last_error}); {kept}.")
+                s.set(ok=False)
+                return False
+            finally:
+                self._attempted.set()
+
+            self._current = directory  # atomic swap: queries holding the old object are unaffected
+            self.version = str(getattr(directory, "version", "") or "")
+            self.loaded_at = time.time()
+            self.last_load_s = time.monotonic() - t0
+            self.last_error = None
+            self.last_delta = delta.summary() if delta is not None else None
+            self.loads += 1
+            s.set(ok=True, rows=len(directory), version=self.version, delta=delta is not None)
+            return True
+
+    def _prewarm(self, directory: Any) -> None:
+        with span("directory.prewarm", zips=len(self.prewarm_zips)):
+            # search() prefers the column engine; the row index is only built without it
+            columns = getattr(directory, "columns", None)
+            if not (callable(columns) and columns() is not None):
+                index = getattr(directory, "index", None)
+                if callable(index):
+                    index()
+            warm_zip_database()
+            ensure_neighbor_table()
+            warm_encodings()
+            for z in self.prewarm_zips:
+                for radius in PREWARM_RADII:
+                    get_zip_codes_within_distance(z, radius)
+
+    # --- serving ---
+    def current(self, timeout: Optional[float] = None) -> Any:
+        """
+        The live directory. Never waits on a refresh; waits only if nothing has loaded yet
+        (starting the loader if needed), and raises RuntimeError if that first load failed.
+        """
+        directory = self._current
+        if directory is not None:
+            return directory
+        self.start()
+        if not self._attempted.wait(timeout):
+            raise TimeoutError("Provider directory is still loading.")
+        directory = self._current
+        if directory is None:
+            raise RuntimeError(f"Provider directory unavailable: {self.last_error}")
+        return directory
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "age_s": time.time() - self.loaded_at if self.loaded_at else None,
+            "last_load_s": self.last_load_s,
+            "loads": self.loads,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_delta": self.last_delta,
+            "interval_s": self.interval_s,
+        }
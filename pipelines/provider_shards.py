@@ -0,0 +1,197 @@
+# pipelines/provider_shards.py
+"""
+ZIP3-sharded provider storage.
+
+A search only touches providers within ~30 miles of one ZIP, so the directory is split on
+disk into one snapshot (pipelines/provider_snapshot.py) per 3-digit ZIP prefix, plus a
+manifest. A radius query resolves the ZIPs inside the search radius, opens only the shards
+those ZIPs fall in, and keeps the hot shards mapped in a small LRU. Workers can then serve a
+national directory while touching a few MB of it.
+
+Layout of a shard directory:
+  manifest.json      {"version", "rows", "shards": {"917": {"file": "zip3_917.snap", "rows": N, "states": [...]}}}
+  zip3_<NNN>.snap    one snapshot per ZIP3 prefix
+
+Usage:
+  python -m pipelines.provider_shards build --out data/shards [--url URL] [--download]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pipelines.provider_json_retrieval import _normalize_zip, get_zip_codes_within_distance
+from pipelines.provider_snapshot import ProviderSnapshot, compile_snapshot, load_directory_rows, open_snapshot
+from utils.tracing import span
+
+MANIFEST = "manifest.json"
+# Shards kept mapped at once (each open shard holds a file descriptor and an mmap)
+DEFAULT_MAX_OPEN_SHARDS = int(os.getenv("PROVIDER_MAX_OPEN_SHARDS", "64"))
+
+
+def shard_of(zip_code: str) -> str:
+    return _normalize_zip(zip_code)[:3]
+
+
+# ----------------------------
+# Build
+# ----------------------------
+def build_shards(rows: Iterable[Dict[str, Any]], out_dir: str, version: str = "") -> Dict[str, Any]:
+    """Partition normalized rows by ZIP3 into per-shard snapshots; the manifest is written last."""
+    version = version or str(int(time.time()))
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        prefix = shard_of(row.get("zip", ""))
+        if prefix:
+            groups.setdefault(prefix, []).append(row)
+
+    os.makedirs(out_dir, exist_ok=True)
+    shards: Dict[str, Dict[str, Any]] = {}
+    with span("shards.build", shards=len(groups)) as s:
+        for prefix in sorted(groups):
+            name = f"zip3_{prefix}.snap"
+            compile_snapshot(groups[prefix], os.path.join(out_dir, name), version=version)
+            shards[prefix] = {
+                "file": name,
+                "rows": len(groups[prefix]),
+                "states": sorted({r.get("state", "") for r in groups[prefix] if r.get("state")}),
+            }
+        manifest = {"version": version, "rows": sum(v["rows"] for v in shards.values()), "shards": shards}
+        tmp = os.path.join(out_dir, MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, os.path.join(out_dir, MANIFEST))
+        s.set(rows=manifest["rows"])
+    return manifest
+
+
+# ----------------------------
+# Lazy sharded store
+# ----------------------------
+class ShardedProviderStore:
+    """
+    Same search() interface as ProviderStore / ProviderSnapshot, over a shard directory.
+    Shards are opened on first use and the least recently used one is dropped once more
+    than max_open are mapped. Results are ordered by shard, then directory order.
+    """
+
+    def __init__(self, shard_dir: str, max_open: int = DEFAULT_MAX_OPEN_SHARDS):
+        self.shard_dir = shard_dir
+        self.max_open = max(1, max_open)
+        with open(os.path.join(shard_dir, MANIFEST), encoding="utf-8") as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+        self.version: str = self.manifest["version"]
+        self._open: "OrderedDict[str, ProviderSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __len__(self) -> int:
+        return self.manifest["rows"]
+
+    def close(self) -> None:
+        with self._lock:
+            while self._open:
+                self._open.popitem()[1].close()
+
+    def shard(self, prefix: str) -> Optional[ProviderSnapshot]:
+        """The open snapshot for a ZIP3 prefix (opening it, and evicting the LRU shard, if needed)."""
+        info = self.manifest["shards"].get(prefix)
+        if info is None:
+            return None
+        with self._lock:
+            snap = self._open.get(prefix)
+            if snap is not None:
+                self._open.move_to_end(prefix)
+                self.stats["hits"] += 1
+                return snap
+            self.stats["misses"] += 1
+            snap = open_snapshot(os.path.join(self.shard_dir, info["file"]))
+            self._open[prefix] = snap
+            while len(self._open) > self.max_open:
+                # Dropped, not closed: a search still reading it keeps it alive, and the
+                # mapping is unmapped when the last reference goes away.
+                self._open.popitem(last=False)
+                self.stats["evictions"] += 1
+            return snap
+
+    def shards_for(self, zips: Iterable[str]) -> Dict[str, List[str]]:
+        """ZIPs grouped by the shards (present in the manifest) they fall in."""
+        grouped: Dict[str, List[str]] = {}
+        for z in zips:
+            prefix = shard_of(z)
+            if prefix in self.manifest["shards"]:
+                grouped.setdefault(prefix, []).append(z)
+        return grouped
+
+    def iter_rows(self, zips: Iterable[str], specialties: Optional[List[str]] = None) -> Iterator[Dict[str, str]]:
+        """ProviderSnapshot.iter_rows across shards; a shard is opened when its first ZIP comes up."""
+        shards = self.manifest["shards"]
+        for z in zips:
+            prefix = shard_of(z)
+            if prefix in shards:
+                yield from self.shard(prefix).iter_rows((z,), specialties)
+
+    def first_k(self, zips: Iterable[str], specialties: List[str], k: int) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """ProviderSnapshot.first_k across shards, ZIP by ZIP like iter_rows."""
+        shards = self.manifest["shards"]
+        out: List[Dict[str, str]] = []
+        head: List[Dict[str, str]] = []
+        for z in zips:
+            prefix = shard_of(z)
+            if prefix not in shards:
+                continue
+            snap = self.shard(prefix)
+            if len(head) < k:
+                matches, rows = snap.first_k((z,), specialties, k - len(out))
+                head.extend(rows[:k - len(head)])
+            else:
+                matches = list(islice(snap.iter_rows((z,), specialties), k - len(out)))
+            out.extend(matches)
+            if len(out) >= k:
+                break
+        return out, head
+
+    def search(self, zip_code: str, radius_miles: float, specialties: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """ZIP-radius filter over the intersecting shards, then (optionally) the fuzzy specialty filter."""
+        target = _normalize_zip(zip_code)
+        if not target:
+            return []
+        with span("shards.search", radius_miles=radius_miles) as s:
+            per_shard = self.shards_for(get_zip_codes_within_distance(target, radius_miles))
+            nearby: List[tuple[ProviderSnapshot, List[int]]] = []
+            matched: List[tuple[ProviderSnapshot, List[int]]] = []
+            for prefix in sorted(per_shard):
+                snap = self.shard(prefix)
+                ids = snap.row_ids_for_zips(per_shard[prefix])
+                nearby.append((snap, ids))
+                if specialties and ids:
+                    matched.append((snap, snap.filter_specialty(ids, specialties)))
+
+            # Same fallback as filter_providers_by_specialty: nothing matched -> all nearby rows
+            chosen = matched if any(ids for _, ids in matched) else nearby
+            out = [row for snap, ids in chosen for row in snap.rows(ids)]
+            s.set(shards=len(per_shard), open_shards=len(self._open), rows_out=len(out))
+            return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a ZIP3-sharded provider directory")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="Normalize a directory (or PROVIDER_SOURCES) into ZIP3 shards")
+    p.add_argument("--out", required=True, help="Shard directory to write")
+    p.add_argument("--url", default=None, help="Directory URL or local path (default: PROVIDER_SOURCES, else Anthem)")
+    p.add_argument("--download", action="store_true", help="Download to a local file first (resumable)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    os.makedirs(args.out, exist_ok=True)
+    rows, version = load_directory_rows(args.url, os.path.join(args.out, "source.json") if args.download else None)
+    manifest = build_shards(rows, args.out, version=version)
+    print(f"Wrote {manifest['rows']} rows in {len(manifest['shards'])} shards -> {args.out} "
+          f"in {time.perf_counter() - t0:.1f}s")
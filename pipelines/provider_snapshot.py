@@ -0,0 +1,370 @@
+# pipelines/provider_snapshot.py
+"""
+Memory-mapped binary snapshot of normalized provider rows.
+
+An offline "compile" step turns normalized rows (scrape_json_url / ProviderStore) into one
+versioned file; processes open it with mmap, so there is no JSON parse and no per-row Python
+objects at startup, and the OS page cache shares the pages between every process on the box.
+Rows are only materialized (as the usual dicts) when a search returns them.
+
+Layout (native byte order, every section 8-byte aligned):
+
+  header     magic "HLPS", format version, section count
+  sections   table of (name, offset, length)
+  meta       JSON: directory version, row count, columns, byte order, created
+  str_off    uint64[n_strings + 1]  offsets into str_blob (string 0 is "")
+  str_blob   UTF-8 bytes of every distinct string
+  col<i>     uint32[n_rows]  string id per row for column i (see meta["columns"])
+  zip_keys   uint32[n_zips]  distinct ZIPs as integers, sorted
+  zip_off    uint32[n_zips + 1]  ranges into zip_rows
+  zip_rows   uint32[n_rows]  row ids grouped by ZIP (ascending within a ZIP)
+  spec_ids   uint32[n_specs] distinct specialty string ids
+  spec_off   uint32[n_specs + 1]
+  spec_rows  uint32[n_rows]  row ids grouped by specialty string
+
+Usage:
+  python -m pipelines.provider_snapshot compile --out data/providers.snap [--url URL] [--download]
+  python -m pipelines.provider_snapshot info data/providers.snap
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pipelines.provider_json_retrieval import (
+    _normalize_zip,
+    expand_specialty_tokens,
+    get_zip_codes_within_distance,
+    specialty_matches,
+)
+from pipelines.provider_store import ROW_FIELDS
+from utils.tracing import span
+
+MAGIC = b"HLPS"
+FORMAT_VERSION = 1
+SNAPSHOT_COLUMNS = ROW_FIELDS + ("source", "key")
+
+_HEADER = struct.Struct("<4sII")
+_SECTION = struct.Struct("<16sQQ")
+_ALIGN = 8
+
+assert array("I").itemsize == 4 and array("Q").itemsize == 8
+
+
+# ----------------------------
+# Compile
+# ----------------------------
+def _grouped(ids: array, n_rows: int) -> tuple[array, array, array]:
+    """(sorted distinct values, offsets, row ids grouped by value) for a per-row id column."""
+    groups: Dict[int, List[int]] = {}
+    for row_id in range(n_rows):
+        groups.setdefault(ids[row_id], []).append(row_id)
+    keys = array("I", sorted(groups))
+    offsets, rows = array("I", [0]), array("I")
+    for k in keys:
+        rows.extend(groups[k])
+        offsets.append(len(rows))
+    return keys, offsets, rows
+
+
+def compile_snapshot(rows: Iterable[Dict[str, Any]], path: str, version: str = "") -> Dict[str, Any]:
+    """
+    Write normalized provider rows to a snapshot at `path` (atomically: tmp file + rename).
+    `_raw` and other non-column fields are dropped. Returns the snapshot's meta dict.
+    """
+    with span("snapshot.compile", path=path) as s:
+        strings: Dict[str, int] = {"": 0}
+        columns = {c: array("I") for c in SNAPSHOT_COLUMNS}
+        zip_ints = array("I")
+        n_rows = 0
+        for row in rows:
+            for c in SNAPSHOT_COLUMNS:
+                value = str(row.get(c) or "")
+                sid = strings.get(value)
+                if sid is None:
+                    sid = strings[value] = len(strings)
+                columns[c].append(sid)
+            zip_ints.append(int(_normalize_zip(row.get("zip", "")) or 0))
+            n_rows += 1
+
+        blob = bytearray()
+        str_off = array("Q", [0])
+        for value in strings:  # dicts keep insertion order == string id order
+            blob += value.encode("utf-8")
+            str_off.append(len(blob))
+
+        zip_keys, zip_off, zip_rows = _grouped(zip_ints, n_rows)
+        spec_ids, spec_off, spec_rows = _grouped(columns["specialty"], n_rows)
+
+        meta = {
+            "format": FORMAT_VERSION,
+            "version": version or str(int(time.time())),
+            "rows": n_rows,
+            "strings": len(strings),
+            "zips": len(zip_keys),
+            "specialties": len(spec_ids),
+            "columns": list(SNAPSHOT_COLUMNS),
+            "byteorder": sys.byteorder,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        sections: List[tuple[str, bytes]] = [("meta", json.dumps(meta).encode("utf-8")),
+                                             ("str_off", str_off.tobytes()), ("str_blob", bytes(blob))]
+        sections += [(f"col{i}", columns[c].tobytes()) for i, c in enumerate(SNAPSHOT_COLUMNS)]
+        sections += [("zip_keys", zip_keys.tobytes()), ("zip_off", zip_off.tobytes()), ("zip_rows", zip_rows.tobytes()),
+                     ("spec_ids", spec_ids.tobytes()), ("spec_off", spec_off.tobytes()), ("spec_rows", spec_rows.tobytes())]
+
+        def aligned(n: int) -> int:
+            return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+        offset = aligned(_HEADER.size + _SECTION.size * len(sections))
+        table = []
+        for name, data in sections:
+            table.append(_SECTION.pack(name.encode("ascii"), offset, len(data)))
+            offset = aligned(offset + len(data))
+
+        tmp = f"{path}.tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections)))
+            f.write(b"".join(table))
+            for _, data in sections:
+                f.write(b"\0" * (aligned(f.tell()) - f.tell()))
+                f.write(data)
+        os.replace(tmp, path)
+        s.set(rows=n_rows, strings=len(strings), bytes=offset)
+    return meta
+
+
+# ----------------------------
+# Load
+# ----------------------------
+class ProviderSnapshot:
+    """
+    Read-only view of a compiled snapshot. Same search() interface as ProviderStore:
+    ZIP-radius filter, then (optionally) the fuzzy specialty filter with its
+    "nothing matched -> return nearby" fallback. Results keep directory order.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:  # the mapping keeps its own handle on the file
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._mm)
+        self._views: List[memoryview] = [self._buf]
+
+        magic, fmt, n_sections = _HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a provider snapshot.")
+        if fmt != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Snapshot format {fmt} is not supported (expected {FORMAT_VERSION}); recompile it.")
+
+        self._sections: Dict[str, memoryview] = {}
+        for i in range(n_sections):
+            name, off, length = _SECTION.unpack_from(self._buf, _HEADER.size + i * _SECTION.size)
+            self._sections[name.rstrip(b"\0").decode("ascii")] = self._view(self._buf[off:off + length])
+
+        self.meta: Dict[str, Any] = json.loads(bytes(self._sections["meta"]))
+        if self.meta["byteorder"] != sys.byteorder:
+            self.close()
+            raise ValueError(f"Snapshot was compiled on a {self.meta['byteorder']}-endian machine; recompile it here.")
+
+        self.version: str = self.meta["version"]
+        self.columns: List[str] = self.meta["columns"]
+        self._str_off = self._column("str_off", "Q")
+        self._str_blob = self._sections["str_blob"]
+        self._cols = [self._column(f"col{i}") for i in range(len(self.columns))]
+        self._spec_col = self._cols[self.columns.index("specialty")]
+        self._zip_keys = self._column("zip_keys")
+        self._zip_off = self._column("zip_off")
+        self._zip_rows = self._column("zip_rows")
+        self._spec_ids = self._column("spec_ids")
+        self._spec_off = self._column("spec_off")
+        self._spec_rows = self._column("spec_rows")
+        self._spec_match_cache: Dict[frozenset, frozenset] = {}
+
+    def _view(self, view: memoryview) -> memoryview:
+        self._views.append(view)
+        return view
+
+    def _column(self, name: str, fmt: str = "I") -> memoryview:
+        return self._view(self._sections[name].cast(fmt))
+
+    def __len__(self) -> int:
+        return self.meta["rows"]
+
+    def __enter__(self) -> "ProviderSnapshot":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        # Every view into the mapping must be released before the mmap can close
+        for view in reversed(self._views):
+            view.release()
+        self._views.clear()
+        self._mm.close()
+
+    # --- rows ---
+    def string(self, sid: int) -> str:
+        return str(self._str_blob[self._str_off[sid]:self._str_off[sid + 1]], "utf-8")
+
+    def row(self, row_id: int) -> Dict[str, str]:
+        return {c: self.string(col[row_id]) for c, col in zip(self.columns, self._cols)}
+
+    def rows(self, row_ids: Optional[Iterable[int]] = None) -> List[Dict[str, str]]:
+        """Materialize rows (all of them when row_ids is None)."""
+        return [self.row(i) for i in (range(len(self)) if row_ids is None else row_ids)]
+
+    # --- indexes ---
+    def row_ids_for_zips(self, zips: Iterable[str]) -> List[int]:
+        """Row ids whose ZIP is in `zips`, in directory order."""
+        out: List[int] = []
+        n = len(self._zip_keys)
+        for z in zips:
+            z5 = _normalize_zip(z)
+            if not z5:
+                continue
+            key = int(z5)
+            i = bisect_left(self._zip_keys, key)
+            if i < n and self._zip_keys[i] == key:
+                out.extend(self._zip_rows[self._zip_off[i]:self._zip_off[i + 1]])
+        out.sort()
+        return out
+
+    def iter_rows(self, zips: Iterable[str], specialties: Optional[List[str]] = None) -> Iterator[Dict[str, str]]:
+        """
+        Rows ZIP by ZIP in the order of `zips` (directory order within a ZIP), lazily; only rows
+        matching `specialties` when given (no fallback). Rows are materialized as they are pulled.
+        """
+        wanted = self.matching_specialty_ids(specialties) if specialties else None
+        for z in zips:
+            for i in self.row_ids_for_zips((z,)):
+                if wanted is None or self._spec_col[i] in wanted:
+                    yield self.row(i)
+
+    def first_k(self, zips: Iterable[str], specialties: List[str], k: int) -> Tuple[List[Dict[str, str]], List[Dict[str, str]]]:
+        """
+        (first k iter_rows(zips, specialties) rows, first k iter_rows(zips) rows) in one pass over
+        the ZIPs, stopping at the k-th match; only those rows are materialized.
+        """
+        wanted = self.matching_specialty_ids(specialties)
+        out: List[Dict[str, str]] = []
+        head: List[Dict[str, str]] = []
+        for z in zips:
+            for i in self.row_ids_for_zips((z,)):
+                matched = self._spec_col[i] in wanted
+                if not matched and len(head) >= k:
+                    continue
+                row = self.row(i)
+                if len(head) < k:
+                    head.append(row)
+                if matched:
+                    out.append(row)
+                    if len(out) >= k:
+                        return out, head
+        return out, head
+
+    def matching_specialty_ids(self, specialties: List[str]) -> frozenset:
+        """String ids of the distinct specialty values matching the fuzzy specialty filter."""
+        tokens = frozenset(expand_specialty_tokens(specialties))
+        hit = self._spec_match_cache.get(tokens)
+        if hit is None:
+            hit = frozenset(sid for sid in self._spec_ids if specialty_matches(self.string(sid), tokens))
+            self._spec_match_cache[tokens] = hit
+        return hit
+
+    def filter_specialty(self, row_ids: List[int], specialties: List[str]) -> List[int]:
+        """The subset of row_ids whose specialty matches (no fallback)."""
+        wanted = self.matching_specialty_ids(specialties)
+        return [i for i in row_ids if self._spec_col[i] in wanted]
+
+    def row_ids_for_specialties(self, specialties: List[str]) -> List[int]:
+        """Row ids whose specialty matches (no ZIP filter), in directory order."""
+        out: List[int] = []
+        wanted = self.matching_specialty_ids(specialties)
+        for i, sid in enumerate(self._spec_ids):
+            if sid in wanted:
+                out.extend(self._spec_rows[self._spec_off[i]:self._spec_off[i + 1]])
+        out.sort()
+        return out
+
+    def search(self, zip_code: str, radius_miles: float, specialties: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """ZIP-radius filter, then (optionally) the fuzzy specialty filter."""
+        target = _normalize_zip(zip_code)
+        if not target:
+            return []
+        with span("snapshot.search", radius_miles=radius_miles) as s:
+            nearby = self.row_ids_for_zips(get_zip_codes_within_distance(target, radius_miles))
+            ids = nearby
+            if specialties and nearby:
+                ids = self.filter_specialty(nearby, specialties) or nearby
+            s.set(rows_nearby=len(nearby), rows_out=len(ids))
+            return self.rows(ids)
+
+
+def open_snapshot(path: str) -> ProviderSnapshot:
+    with span("snapshot.open", path=path) as s:
+        snap = ProviderSnapshot(path)
+        s.set(rows=len(snap), version=snap.version)
+        return snap
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+def load_directory_rows(url: Optional[str] = None, download_to: Optional[str] = None) -> tuple[List[Dict[str, Any]], str]:
+    """
+    Normalized rows + version to compile: `url` if given, else PROVIDER_SOURCES (federated),
+    else the Anthem directory. With download_to, remote files are downloaded there first (resumable).
+    """
+    from pipelines.provider_federation import load_federated_directory, sources_from_env
+    from pipelines.provider_json_retrieval import load_provider_json
+
+    sources = [] if url else sources_from_env()
+    if sources:
+        store = load_federated_directory(sources)
+        return store.rows, store.version
+    url = url or "https://www22.anthem.com/CMS/PROVIDERS_CAM.json"
+    if download_to and url.startswith(("http://", "https://")):
+        from pipelines.http_fetch import download_to_file
+        url = download_to_file(url, download_to)
+    return load_provider_json(url)
+
+
+def _cli_compile(args: argparse.Namespace) -> None:
+    t0 = time.perf_counter()
+    rows, version = load_directory_rows(args.url, args.out + ".source.json" if args.download else None)
+    meta = compile_snapshot(rows, args.out, version=version)
+    print(f"Compiled {meta['rows']} rows ({meta['strings']} strings, {meta['zips']} ZIPs) "
+          f"-> {args.out} ({os.path.getsize(args.out) / 1e6:.1f} MB) in {time.perf_counter() - t0:.1f}s")
+
+
+def _cli_info(args: argparse.Namespace) -> None:
+    with open_snapshot(args.path) as snap:
+        print(json.dumps(snap.meta, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile / inspect provider directory snapshots")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("compile", help="Normalize a directory (or PROVIDER_SOURCES) into a snapshot")
+    p.add_argument("--out", required=True, help="Snapshot path to write")
+    p.add_argument("--url", default=None, help="Directory URL or local path (default: PROVIDER_SOURCES, else Anthem)")
+    p.add_argument("--download", action="store_true", help="Download to a local file first (resumable)")
+    p.set_defaults(fn=_cli_compile)
+    p = sub.add_parser("info", help="Print a snapshot's metadata")
+    p.add_argument("path")
+    p.set_defaults(fn=_cli_info)
+    args = parser.parse_args()
+    args.fn(args)
@@ -0,0 +1,431 @@
+# pipelines/provider_store.py
+from __future__ import annotations
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from operator import itemgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pipelines.provider_json_retrieval import (
+    _normalize_zip,
+    expand_specialty_tokens,
+    filter_providers_by_zip,
+    filter_providers_by_specialty,
+    get_zip_codes_within_distance,
+    specialty_matches,
+)
+from utils.tracing import span
+
+# Fields every normalized provider-address row carries (see scrape_json_url)
+ROW_FIELDS = ("name", "phone", "address", "city", "state", "zip", "specialty", "website")
+_row_fields = itemgetter(*ROW_FIELDS)
+
+_STREET_ABBREV = {
+    "street": "st", "avenue": "ave", "boulevard": "blvd", "drive": "dr", "road": "rd",
+    "suite": "ste", "highway": "hwy", "parkway": "pkwy", "lane": "ln", "court": "ct",
+    "place": "pl", "north": "n", "south": "s", "east": "e", "west": "w",
+}
+_NAME_NOISE = {"dr", "md", "do", "np", "pa", "phd", "dds", "od", "inc", "llc", "the"}
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+
+def normalize_street(street: str) -> str:
+    return " ".join(_STREET_ABBREV.get(t, t) for t in _tokens(street))
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(t for t in _tokens(name) if t not in _NAME_NOISE)
+
+
+def provider_key(row: Dict[str, Any]) -> str:
+    """
+    Hash key identifying the same provider at the same address across sources:
+    NPI when known (else normalized name) + normalized street + ZIP.
+    """
+    npi = str(row.get("npi") or (row.get("_raw") or {}).get("npi") or "").strip()
+    who = f"npi:{npi}" if npi else f"name:{normalize_name(row.get('name', ''))}"
+    where = f"{normalize_street(row.get('address', ''))}|{row.get('zip', '')}"
+    return hashlib.sha1(f"{who}|{where}".encode("utf-8")).hexdigest()[:16]
+
+
+def row_key(row: Dict[str, Any]) -> str:
+    """
+    Provider+address identity of a row across directory versions: the merged-store key when
+    present, else NPI (or name) + street + ZIP as published (cheap; no normalization).
+    """
+    return row.get("key") or f"{row.get('npi') or row.get('name', '')}|{row.get('address', '')}|{row.get('zip', '')}"
+
+
+class ProviderStore:
+    """
+    Deduplicated provider-address rows merged from one or more directory sources.
+
+    Each row keeps the normalized fields plus:
+      source  comma-separated names of every source that listed it (attribution column)
+      key     provider_key() of the row
+    """
+
+    def __init__(self, version: str = ""):
+        self.version = version
+        self.by_key: Dict[str, Dict[str, Any]] = {}
+        self.source_counts: Dict[str, int] = {}  # unique rows contributed per source
+        self.errors: Dict[str, str] = {}         # sources that failed to load
+        self.load_seconds = 0.0
+        self._index: Optional[RowIndex] = None
+        self._columns: Any = None
+
+    def __len__(self) -> int:
+        return len(self.by_key)
+
+    def index(self) -> "RowIndex":
+        """Build (once) the ZIP / specialty indexes that search() then uses."""
+        if self._index is None:
+            self._index = RowIndex(self.rows)
+        return self._index
+
+    def columns(self) -> Any:
+        """See ProviderRows.columns."""
+        if self._columns is None:
+            self._columns = _columns_for(self.rows, self.version)
+        return self._columns
+
+    def rebase_on(self, previous: Any) -> Optional["DirectoryDelta"]:
+        """See ProviderRows.rebase_on."""
+        return _rebase(self, self.rows, previous)
+
+    @property
+    def rows(self) -> List[Dict[str, Any]]:
+        return list(self.by_key.values())
+
+    def add_rows(self, source: str, rows: Iterable[Dict[str, Any]]) -> int:
+        """Merge a source's normalized rows; returns how many were new (not duplicates)."""
+        added = 0
+        for row in rows:
+            key = provider_key(row)
+            existing = self.by_key.get(key)
+            if existing is None:
+                merged = dict(row)
+                merged["source"] = source
+                merged["key"] = key
+                self.by_key[key] = merged
+                added += 1
+                continue
+            # Same provider + address from another source: fill gaps, record attribution
+            for field in ROW_FIELDS:
+                if not existing.get(field) and row.get(field):
+                    existing[field] = row[field]
+            if row.get("specialty") and row["specialty"].lower() not in existing["specialty"].lower():
+                existing["specialty"] = f"{existing['specialty']}, {row['specialty']}"
+            if source not in existing["source"].split(","):
+                existing["source"] = f"{existing['source']},{source}"
+        self.source_counts[source] = self.source_counts.get(source, 0) + added
+        self._index = None
+        self._columns = None
+        return added
+
+    def iter_rows(self, zips: Iterable[str], specialties: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """See ProviderRows.iter_rows."""
+        return _engine(self).iter_rows(zips, specialties)
+
+    def first_k(self, zips: Iterable[str], specialties: List[str], k: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """See ProviderColumns.first_k."""
+        return _engine(self).first_k(zips, specialties, k)
+
+    def search(self, zip_code: str, radius_miles: float, specialties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """ZIP-radius filter, then (optionally) the fuzzy specialty filter."""
+        engine = self._columns if self._columns is not None else self._index
+        if engine is not None:
+            return engine.search(zip_code, radius_miles, specialties)
+        return search_rows(self.rows, zip_code, radius_miles, specialties)
+
+
+class ProviderRows:
+    """A plain list of normalized rows (single directory, no dedup) behind the same search() interface."""
+
+    def __init__(self, rows: List[Dict[str, Any]], version: str = ""):
+        self.rows = rows
+        self.version = version
+        self._index: Optional[RowIndex] = None
+        self._columns: Any = None
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def index(self) -> "RowIndex":
+        if self._index is None:
+            self._index = RowIndex(self.rows)
+        return self._index
+
+    def columns(self) -> Any:
+        """
+        Build (once) the NumPy column engine (pipelines/provider_columns.py) that search() then
+        prefers over the row index; returns None when NumPy is unavailable.
+        """
+        if self._columns is None:
+            self._columns = _columns_for(self.rows, self.version)
+        return self._columns
+
+    def rebase_on(self, previous: Any) -> Optional["DirectoryDelta"]:
+        """
+        Index this (newly loaded) version by diffing it against `previous` and applying only the
+        added / removed / changed rows to previous's index, copy-on-write, instead of rebuilding.
+        Returns the delta, or None when previous has no index to start from. A directory served
+        by the column engine has none: hashing every row's content for the diff alone costs
+        about as much as building the columns, so those are rebuilt instead.
+        """
+        return _rebase(self, self.rows, previous)
+
+    def iter_rows(self, zips: Iterable[str], specialties: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Rows ZIP by ZIP in the order of `zips`, optionally only specialty matches
+        (pipelines/provider_stream.py). Needs per-ZIP access, so the column engine (else the
+        row index) is built first if neither is.
+        """
+        return _engine(self).iter_rows(zips, specialties)
+
+    def first_k(self, zips: Iterable[str], specialties: List[str], k: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """See ProviderColumns.first_k."""
+        return _engine(self).first_k(zips, specialties, k)
+
+    def search(self, zip_code: str, radius_miles: float, specialties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        engine = self._columns if self._columns is not None else self._index
+        if engine is not None:
+            return engine.search(zip_code, radius_miles, specialties)
+        return search_rows(self.rows, zip_code, radius_miles, specialties)
+
+
+def _engine(directory: Any) -> Any:
+    """The built column engine or row index of a ProviderRows / ProviderStore, building one if needed."""
+    if directory._columns is not None:
+        return directory._columns
+    if directory._index is not None:
+        return directory._index
+    return directory.columns() or directory.index()
+
+
+def _columns_for(rows: List[Dict[str, Any]], version: str) -> Any:
+    try:
+        from pipelines.provider_columns import ProviderColumns  # numpy
+    except ImportError:
+        return None
+    return ProviderColumns(rows, version=version)
+
+
+def search_rows(rows: List[Dict[str, Any]], zip_code: str, radius_miles: float,
+                specialties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    nearby = filter_providers_by_zip(rows, zip_code, radius_miles)
+    return filter_providers_by_specialty(nearby, specialties) if specialties else nearby
+
+
+@dataclass
+class DirectoryDelta:
+    """Rows added, removed and changed between two directory versions, keyed by row_key()."""
+    added: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    removed: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # old rows
+    changed: Dict[str, Dict[str, Any]] = field(default_factory=dict)  # new rows
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def summary(self) -> Dict[str, int]:
+        return {"added": len(self.added), "removed": len(self.removed), "changed": len(self.changed)}
+
+
+def _content(row: Dict[str, Any]) -> Tuple[Any, ...]:
+    """The fields compared when diffing two versions of a row (hot path: one C call per row)."""
+    try:
+        return _row_fields(row) + (row.get("source"),)
+    except KeyError:
+        return tuple(map(row.get, ROW_FIELDS)) + (row.get("source"),)
+
+
+def diff_rows(old: "RowIndex", new_rows: List[Dict[str, Any]]) -> DirectoryDelta:
+    """
+    Diff a new version's rows against an indexed old version by row_key().
+
+    Rows whose full content already exists in the old version are skipped with one tuple
+    lookup each; only the few remaining rows are keyed and classified.
+    """
+    sigs = [_content(row) for row in new_rows]
+    fresh = [row for row, sig in zip(new_rows, sigs) if sig not in old.key_by_sig]
+    gone = old.key_by_sig.keys() - set(sigs)
+
+    delta = DirectoryDelta()
+    candidates: Dict[str, Dict[str, Any]] = {}
+    for row in fresh:
+        candidates.setdefault(row_key(row), row)  # first row wins on duplicate keys
+    for sig in gone:
+        key = old.key_by_sig[sig]
+        if key in candidates:
+            delta.changed[key] = candidates.pop(key)
+        else:
+            delta.removed[key] = old.rows[key]
+    delta.added = {k: row for k, row in candidates.items() if k not in old.rows}
+    return delta
+
+
+def _rebase(directory: Any, rows: List[Dict[str, Any]], previous: Any) -> Optional[DirectoryDelta]:
+    prev_index = getattr(previous, "_index", None)
+    if prev_index is None or getattr(previous, "_columns", None) is not None:
+        return None
+    with span("directory.delta", rows=len(rows)) as s:
+        delta = diff_rows(prev_index, rows)
+        directory._index = prev_index.apply(delta)
+        s.set(**delta.summary())
+    return delta
+
+
+class RowIndex:
+    """
+    In-memory ZIP and specialty indexes over a set of rows keyed by row_key() (the in-memory
+    counterpart of the snapshot indexes). search() has search_rows() semantics and returns
+    rows in directory order (rows added by apply() go last).
+
+    An index is never mutated once built: apply() returns a new index that shares every
+    untouched bucket with this one, so readers of the old index are unaffected.
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, Any]] = ()):
+        self.rows: Dict[str, Dict[str, Any]] = {}
+        self.order: Dict[str, int] = {}
+        self.key_by_sig: Dict[Tuple[Any, ...], str] = {}  # row content -> key (for diff_rows)
+        # Buckets are insertion-ordered dicts used as sets (O(1) removal when applying deltas)
+        self.by_zip: Dict[str, Dict[str, None]] = {}        # ZIP -> keys
+        self.by_specialty: Dict[str, Dict[str, None]] = {}  # distinct specialty string -> keys
+        self._spec_match_cache: Dict[frozenset, frozenset] = {}
+        with span("directory.index") as s:
+            for row in rows:
+                key = row_key(row)
+                if key not in self.rows:
+                    self._insert(key, row, len(self.order))
+            s.set(rows=len(self.rows), zips=len(self.by_zip), specialties=len(self.by_specialty))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    # --- maintenance ---
+    def _insert(self, key: str, row: Dict[str, Any], seq: int) -> None:
+        self.rows[key] = row
+        self.order[key] = seq
+        self.key_by_sig[_content(row)] = key
+        zp = _normalize_zip(row.get("zip", ""))
+        if zp:
+            self.by_zip.setdefault(zp, {})[key] = None
+        self.by_specialty.setdefault(str(row.get("specialty", "")), {})[key] = None
+
+    def apply(self, delta: DirectoryDelta) -> "RowIndex":
+        """A new index with the delta applied; only buckets the delta touches are copied."""
+        new = RowIndex.__new__(RowIndex)
+        new.rows = dict(self.rows)
+        new.order = dict(self.order)
+        new.key_by_sig = dict(self.key_by_sig)
+        new.by_zip = dict(self.by_zip)
+        new.by_specialty = dict(self.by_specialty)
+        # Cached matches stay valid unless the set of distinct specialty strings changes
+        new._spec_match_cache = dict(self._spec_match_cache)
+        copied: set = set()
+
+        def bucket(index: Dict[str, Dict[str, None]], name: str) -> Dict[str, None]:
+            if (id(index), name) not in copied or name not in index:
+                index[name] = dict(index.get(name, {}))
+                copied.add((id(index), name))
+            return index[name]
+
+        def unlink(key: str, row: Dict[str, Any]) -> None:
+            new.key_by_sig.pop(_content(row), None)
+            zp = _normalize_zip(row.get("zip", ""))
+            if zp:
+                del bucket(new.by_zip, zp)[key]
+                if not new.by_zip[zp]:
+                    del new.by_zip[zp]
+            spec = str(row.get("specialty", ""))
+            del bucket(new.by_specialty, spec)[key]
+            if not new.by_specialty[spec]:
+                del new.by_specialty[spec]
+                new._spec_match_cache = {}
+
+        def link(key: str, row: Dict[str, Any]) -> None:
+            zp = _normalize_zip(row.get("zip", ""))
+            if zp:
+                bucket(new.by_zip, zp)[key] = None
+            spec = str(row.get("specialty", ""))
+            if spec not in new.by_specialty:
+                new._spec_match_cache = {}
+            bucket(new.by_specialty, spec)[key] = None
+            new.rows[key] = row
+            new.key_by_sig[_content(row)] = key
+
+        for key, row in delta.removed.items():
+            unlink(key, self.rows[key])
+            del new.rows[key]
+            del new.order[key]
+        for key, row in delta.changed.items():
+            unlink(key, self.rows[key])
+            link(key, row)
+        seq = max(self.order.values(), default=-1) + 1
+        for key, row in delta.added.items():
+            link(key, row)
+            new.order[key] = seq
+            seq += 1
+        return new
+
+    # --- queries ---
+    def matching_specialties(self, specialties: List[str]) -> frozenset:
+        """Distinct specialty strings matching the fuzzy specialty filter."""
+        tokens = frozenset(expand_specialty_tokens(specialties))
+        hit = self._spec_match_cache.get(tokens)
+        if hit is None:
+            hit = frozenset(spec for spec in self.by_specialty if specialty_matches(spec, tokens))
+            self._spec_match_cache[tokens] = hit
+        return hit
+
+    def iter_rows(self, zips: Iterable[str], specialties: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Rows ZIP by ZIP in the order of `zips` (directory order within a ZIP), lazily; only rows
+        matching `specialties` when given (no fallback).
+        """
+        wanted = self.matching_specialties(specialties) if specialties else None
+        order = self.order.__getitem__
+        for z in zips:
+            bucket = self.by_zip.get(z)
+            if not bucket:
+                continue
+            for k in sorted(bucket, key=order):
+                row = self.rows[k]
+                if wanted is None or str(row.get("specialty", "")) in wanted:
+                    yield row
+
+    def first_k(self, zips: Iterable[str], specialties: List[str], k: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """See ProviderColumns.first_k."""
+        wanted = self.matching_specialties(specialties)
+        order = self.order.__getitem__
+        out: List[Dict[str, Any]] = []
+        head: List[Dict[str, Any]] = []
+        for z in zips:
+            bucket = self.by_zip.get(z)
+            if not bucket:
+                continue
+            for key in sorted(bucket, key=order):
+                row = self.rows[key]
+                if len(head) < k:
+                    head.append(row)
+                if str(row.get("specialty", "")) in wanted:
+                    out.append(row)
+                    if len(out) >= k:
+                        return out, head
+        return out, head
+
+    def search(self, zip_code: str, radius_miles: float, specialties: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        target = _normalize_zip(zip_code)
+        if not target:
+            return []
+        keys = [k for z in get_zip_codes_within_distance(target, radius_miles) for k in self.by_zip.get(z, ())]
+        keys.sort(key=self.order.__getitem__)
+        if specialties and keys:
+            wanted = self.matching_specialties(specialties)
+            keys = [k for k in keys if str(self.rows[k].get("specialty", "")) in wanted] or keys
+        return [self.rows[k] for k in keys]
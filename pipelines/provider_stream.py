@@ -0,0 +1,148 @@
+# pipelines/provider_stream.py
+"""
+Lazy, composable provider filter stages with early-exit top-k.
+
+  stream_nearby(directory, zip, radius[, specs])  rows within the radius, nearest ZIP first
+  iter_filter_by_zip(rows, zip, radius)           lazy filter_providers_by_zip over any row iterable
+  iter_filter_by_specialty(rows, specs)           lazy fuzzy specialty filter (no fallback)
+  top_k(rows, specialties, k)                     first k matches, with filter_providers_by_specialty's
+                                                  "nothing matched -> nearby rows" fallback
+  search_top_k(directory, zip, radius, specs, k)  the k nearest matches (or nearby rows, unless fallback=False)
+
+Each stage pulls one row at a time, so no intermediate list is built and a search stops
+reading as soon as its result is decided. Directories with iter_rows() (ProviderRows,
+ProviderStore, ProviderSnapshot, ShardedProviderStore) stream rows ZIP by ZIP in the
+nearest-first order of get_zip_codes_within_distance and apply the specialty filter inside
+each ZIP bucket, so the first k rows of the stream are the k nearest matches and the scan
+ends there. Their first_k() also collects the k nearest rows in that same pass, which
+search_top_k returns when nothing matches instead of streaming the radius a second time.
+"""
+from __future__ import annotations
+
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pipelines.provider_json_retrieval import (
+    _normalize_zip,
+    expand_specialty_tokens,
+    get_zip_codes_within_distance,
+    specialty_matches,
+)
+from utils.tracing import span
+
+Row = Dict[str, Any]
+
+
+def _specialty_matcher(specialties: List[str]) -> Callable[[Row], bool]:
+    """Row predicate for the fuzzy specialty filter, memoized per distinct specialty string."""
+    tokens = expand_specialty_tokens(specialties)
+    memo: Dict[Any, bool] = {}
+
+    def match(row: Row) -> bool:
+        spec = row.get("specialty", "")
+        hit = memo.get(spec)
+        if hit is None:
+            hit = memo[spec] = specialty_matches(spec, tokens)
+        return hit
+
+    return match
+
+
+# ----------------------------
+# Stages
+# ----------------------------
+def iter_filter_by_zip(rows: Iterable[Row], target_zip: str, radius_miles: float) -> Iterator[Row]:
+    """Rows (in input order) whose ZIP is within the radius of target_zip."""
+    target = _normalize_zip(target_zip)
+    if not target:
+        return
+    allowed = set(get_zip_codes_within_distance(target, radius_miles))
+    for row in rows:
+        zp = row.get("zip", "")
+        if not (isinstance(zp, str) and len(zp) == 5 and zp.isdigit()):
+            zp = _normalize_zip(zp)
+        if zp and zp in allowed:
+            yield row
+
+
+def iter_filter_by_specialty(rows: Iterable[Row], specialties: List[str]) -> Iterator[Row]:
+    """Rows whose specialty matches (no fallback: an empty stream when nothing does)."""
+    match = _specialty_matcher(specialties)
+    return (row for row in rows if match(row))
+
+
+def stream_nearby(directory: Any, target_zip: str, radius_miles: float,
+                  specialties: Optional[List[str]] = None) -> Iterator[Row]:
+    """
+    Rows within the radius, nearest ZIP first (directory order within a ZIP); only rows matching
+    `specialties` when given (no fallback). A plain row list is filtered lazily in list order,
+    and a directory without iter_rows() falls back to its search() order.
+    """
+    if isinstance(directory, list):
+        rows = iter_filter_by_zip(directory, target_zip, radius_miles)
+        return iter_filter_by_specialty(rows, specialties) if specialties else rows
+    target = _normalize_zip(target_zip)
+    if not target:
+        return iter(())
+    iter_rows = getattr(directory, "iter_rows", None)
+    if iter_rows is None:
+        rows = iter(directory.search(target, radius_miles))
+        return iter_filter_by_specialty(rows, specialties) if specialties else rows
+    return iter_rows(get_zip_codes_within_distance(target, radius_miles), specialties)
+
+
+def _first_k(rows: Iterable[Row], specialties: List[str], k: int) -> Tuple[List[Row], List[Row]]:
+    """(first k rows matching the specialties, first k rows) in one pass, ending at the k-th match."""
+    match = _specialty_matcher(specialties)
+    head: List[Row] = []
+    out: List[Row] = []
+    for row in rows:
+        if len(head) < k:
+            head.append(row)
+        if match(row):
+            out.append(row)
+            if len(out) == k:
+                break
+    return out, head
+
+
+def top_k(rows: Iterable[Row], specialties: Optional[List[str]], k: int) -> List[Row]:
+    """
+    The first k rows matching the specialties, reading no further than the k-th match; if
+    none match, the first k rows. Equal to filter_providers_by_specialty(list(rows), ...)[:k].
+    """
+    if k <= 0:
+        return []
+    if not specialties:
+        return list(islice(rows, k))
+    out, head = _first_k(rows, specialties, k)
+    return out or head
+
+
+def search_top_k(directory: Any, target_zip: str, radius_miles: float,
+                 specialties: Optional[List[str]] = None, k: int = 5, fallback: bool = True) -> List[Row]:
+    """
+    The k nearest providers within the radius matching the specialties; if none match, the k
+    nearest providers (search()'s fallback), or [] with fallback=False. With the fallback the
+    k nearest rows are collected in the same pass as the matches (the directory's first_k(),
+    else top_k over the unfiltered stream), so a search that matches nothing scans the radius
+    once.
+    """
+    with span("stream.top_k", k=k, radius_miles=radius_miles) as s:
+        fell_back = False
+        if k <= 0:
+            out: List[Row] = []
+        elif not specialties or not fallback:
+            out = list(islice(stream_nearby(directory, target_zip, radius_miles, specialties), k))
+        else:
+            first_k = getattr(directory, "first_k", None)
+            if first_k is None:
+                out, head = _first_k(stream_nearby(directory, target_zip, radius_miles), specialties, k)
+            else:
+                target = _normalize_zip(target_zip)
+                zips = get_zip_codes_within_distance(target, radius_miles) if target else []
+                out, head = first_k(zips, specialties, k)
+            fell_back = not out
+            out = out or head
+        s.set(rows_out=len(out), fallback=fell_back)
+        return out
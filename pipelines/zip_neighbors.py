@@ -0,0 +1,227 @@
+# pipelines/zip_neighbors.py
+"""
+Materialized ZIP -> neighbouring ZIPs table.
+
+For every ZIP in the zipcodes database, the ZIPs within MAX_RADIUS miles are stored sorted
+by "box distance": max(|dlat| * 69, |dlon| * 69 * cos(lat)), the metric behind the
+bounding-box test in get_zip_codes_within_distance. A ZIP lies inside the box for radius r
+exactly when its box distance is <= r, so the neighbours for any r <= MAX_RADIUS are a
+prefix of the row and a lookup is a slice (O(1) for the configured RADII, whose prefix
+lengths are stored; a binary search for other radii).
+
+Compact encoding (a national table at 30 miles is a few tens of MB, mmap'ed read-only):
+  zips        uint32[n]        ZIPs as integers, sorted
+  offsets     uint32[n + 1]    row ranges into neighbors / dist
+  neighbors   uint16[m]        neighbour ZIP as an index into zips
+  dist        uint16[m]        box distance in hundredths of a mile, rounded up
+  cuts        uint32[n, k]     prefix length for each of RADII
+  meta.json   max radius, radii, source
+
+Usage:
+  python -m pipelines.zip_neighbors build [--out DIR] [--max-radius 30] [--radii 15 25 30]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from utils.tracing import span
+
+try:
+    import zipcodes
+except Exception:
+    zipcodes = None
+
+DEFAULT_PATH = os.getenv("ZIP_NEIGHBORS_PATH", os.path.join(os.path.expanduser("~"), ".cache", "healthlight", "zip_neighbors"))
+MAX_RADIUS = 30.0
+RADII = (15.0, 25.0, 30.0)
+MILES_PER_DEGREE = 69.0
+_ARRAYS = ("zips", "offsets", "neighbors", "dist", "cuts")
+
+
+def _units(radius_miles: float) -> int:
+    """Radius in the stored hundredths of a mile."""
+    return int(round(radius_miles * 100))
+
+
+# ----------------------------
+# Build
+# ----------------------------
+def build_table(path: str = DEFAULT_PATH, max_radius: float = MAX_RADIUS, radii: Sequence[float] = RADII) -> str:
+    """Compute the table from the zipcodes database and write it to directory `path` (atomically)."""
+    if zipcodes is None:
+        raise RuntimeError("The zipcodes package is required to build the ZIP neighbour table.")
+    radii = sorted(r for r in radii if r <= max_radius)
+
+    with span("zip_neighbors.build", max_radius=max_radius) as s:
+        points = {}
+        for z in zipcodes.list_all():
+            try:
+                points[int(z["zip_code"])] = (float(z["lat"]), float(z["long"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+        zips = np.array(sorted(points), dtype=np.uint32)
+        if len(zips) > np.iinfo(np.uint16).max:
+            raise ValueError("Too many ZIPs for uint16 neighbour indices.")
+        lat = np.array([points[z][0] for z in zips.tolist()])
+        lon = np.array([points[z][1] for z in zips.tolist()])
+
+        # Scan only the latitude band of each ZIP (lat-sorted), then apply the box metric
+        by_lat = np.argsort(lat, kind="stable")
+        lat_sorted = lat[by_lat]
+        band = max_radius / MILES_PER_DEGREE
+        limit = _units(max_radius)
+
+        offsets = np.zeros(len(zips) + 1, dtype=np.uint32)
+        cuts = np.zeros((len(zips), len(radii)), dtype=np.uint32)
+        neighbor_parts: List[np.ndarray] = []
+        dist_parts: List[np.ndarray] = []
+        for i in range(len(zips)):
+            lo = np.searchsorted(lat_sorted, lat[i] - band, side="left")
+            hi = np.searchsorted(lat_sorted, lat[i] + band, side="right")
+            cand = by_lat[lo:hi]
+            d = np.maximum(np.abs(lat[cand] - lat[i]) * MILES_PER_DEGREE,
+                           np.abs(lon[cand] - lon[i]) * MILES_PER_DEGREE * math.cos(math.radians(lat[i])))
+            units = np.ceil(np.round(d * 100, 6)).astype(np.int64)  # round first: float noise must not push d up a unit
+            keep = units <= limit
+            cand, units = cand[keep], units[keep]
+            order = np.lexsort((cand, units))
+            neighbor_parts.append(cand[order].astype(np.uint16))
+            dist_parts.append(units[order].astype(np.uint16))
+            offsets[i + 1] = offsets[i] + len(order)
+            cuts[i] = np.searchsorted(dist_parts[-1], [_units(r) for r in radii], side="right")
+
+        arrays = {
+            "zips": zips,
+            "offsets": offsets,
+            "neighbors": np.concatenate(neighbor_parts) if neighbor_parts else np.zeros(0, np.uint16),
+            "dist": np.concatenate(dist_parts) if dist_parts else np.zeros(0, np.uint16),
+            "cuts": cuts,
+        }
+        meta = {"max_radius": max_radius, "radii": radii, "zips": int(len(zips)),
+                "entries": int(offsets[-1]), "created": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+        tmp = f"{path}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for name, arr in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), arr)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        if os.path.isdir(path):
+            old = f"{path}.old"
+            os.replace(path, old)
+            os.replace(tmp, path)
+            for name in os.listdir(old):
+                os.remove(os.path.join(old, name))
+            os.rmdir(old)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            os.replace(tmp, path)
+        s.set(zips=meta["zips"], entries=meta["entries"])
+    return path
+
+
+# ----------------------------
+# Lookup
+# ----------------------------
+class ZipNeighborTable:
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        # Read-only memory maps: pages are shared by every process using the same table
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+        self.zips, self.offsets, self.neighbors, self.dist, self.cuts = (arrays[n] for n in _ARRAYS)
+        self.max_radius: float = self.meta["max_radius"]
+        self._radius_col = {_units(r): i for i, r in enumerate(self.meta["radii"])}
+        self._zip_str = [f"{z:05d}" for z in self.zips.tolist()]
+
+    def __len__(self) -> int:
+        return len(self.zips)
+
+    def neighbor_indices(self, zip_code: str, radius_miles: float) -> Optional[np.ndarray]:
+        """Indices (into self.zips) of the ZIPs in the radius box, nearest first; None if not answerable."""
+        units = radius_miles * 100
+        if radius_miles > self.max_radius or abs(units - round(units)) > 1e-6 or not zip_code.isdigit():
+            return None  # beyond the table, or finer than its hundredth-of-a-mile resolution
+        key = int(zip_code)
+        i = int(np.searchsorted(self.zips, key))
+        if i >= len(self.zips) or self.zips[i] != key:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        col = self._radius_col.get(_units(radius_miles))
+        if col is not None:
+            cut = int(self.cuts[i, col])
+        else:
+            cut = int(np.searchsorted(self.dist[start:end], _units(radius_miles), side="right"))
+        return self.neighbors[start:start + cut]
+
+    def neighbors_within(self, zip_code: str, radius_miles: float) -> Optional[List[str]]:
+        """ZIPs in the radius box, nearest first; None when the table cannot answer (unknown ZIP, radius too large)."""
+        idx = self.neighbor_indices(zip_code, radius_miles)
+        if idx is None:
+            return None
+        zs = self._zip_str
+        return [zs[j] for j in idx.tolist()]
+
+    def distances(self, zip_code: str, radius_miles: float) -> Optional[List[float]]:
+        """Box distances in miles matching neighbors_within()."""
+        idx = self.neighbor_indices(zip_code, radius_miles)
+        if idx is None:
+            return None
+        start = int(self.offsets[int(np.searchsorted(self.zips, int(zip_code)))])
+        return (self.dist[start:start + len(idx)] / 100.0).tolist()
+
+
+_table: Optional[ZipNeighborTable] = None
+_table_lock = threading.Lock()
+_table_checked = False
+
+
+def current_table() -> Optional[ZipNeighborTable]:
+    """The persisted table at DEFAULT_PATH if it exists (loaded once); never builds."""
+    global _table, _table_checked
+    if not _table_checked:
+        with _table_lock:
+            if not _table_checked:
+                if os.path.exists(os.path.join(DEFAULT_PATH, "meta.json")):
+                    try:
+                        _table = ZipNeighborTable(DEFAULT_PATH)
+                    except Exception as e:
+                        print(f"⚠️ ZIP neighbour table at {DEFAULT_PATH} unreadable, using on-the-fly lookups ({e})")
+                _table_checked = True
+    return _table
+
+
+def ensure_table() -> Optional[ZipNeighborTable]:
+    """Load the table, building and persisting it first if missing (slow; for prewarm / CLI)."""
+    global _table, _table_checked
+    if current_table() is None and zipcodes is not None:
+        build_table(DEFAULT_PATH)
+        with _table_lock:
+            _table = ZipNeighborTable(DEFAULT_PATH)
+            _table_checked = True
+    return _table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the materialized ZIP neighbour table")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build")
+    p.add_argument("--out", default=DEFAULT_PATH)
+    p.add_argument("--max-radius", type=float, default=MAX_RADIUS)
+    p.add_argument("--radii", type=float, nargs="+", default=list(RADII))
+    args = parser.parse_args()
+    t0 = time.perf_counter()
+    out = build_table(args.out, args.max_radius, args.radii)
+    table = ZipNeighborTable(out)
+    size = sum(os.path.getsize(os.path.join(out, n)) for n in os.listdir(out))
+    print(f"Built {out}: {len(table)} ZIPs, {table.meta['entries']} neighbour entries, "
+          f"{size / 1e6:.1f} MB in {time.perf_counter() - t0:.1f}s")
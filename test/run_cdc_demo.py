@@ -3,17 +3,17 @@
 
 """
 Run a demo of CDC Retrieval QA pipeline:
-- Uses LangChain, HuggingFace embeddings, FAISS, and ChatGroq
+- Uses LangChain, the shared sentence-transformers embedding service, FAISS, and ChatGroq
 - Answers questions about medical topics from CDC pages
 """
 
 from langchain.document_loaders import WebBaseLoader
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.chains import RetrievalQA
 from langchain_groq import ChatGroq
 
 from utils.config import GROQ_API_KEY, CDC_URLS
+from utils.embedding_service import get_embedding_service
 
 # ======================
 # Step 1: Load CDC Pages
@@ -24,7 +24,7 @@ docs = loader.load()
 # ======================
 # Step 2: Create Embeddings & VectorStore
 # ======================
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+embeddings = get_embedding_service("sentence-transformers/all-MiniLM-L6-v2").as_langchain()
 vectorstore = FAISS.from_documents(docs, embeddings)
 
 # ======================
@@ -0,0 +1,45 @@
+# utils/cancel_utils.py
+from __future__ import annotations
+
+import contextvars
+import threading
+from typing import Any, Callable, Optional
+
+# Cancellation signal for the work running in the current context (thread/task).
+# Set by speculative graph branches; checked by the agents and the LLM call helper.
+_cancel_event: contextvars.ContextVar[Optional[threading.Event]] = contextvars.ContextVar(
+    "cancel_event", default=None
+)
+
+
+class Cancelled(BaseException):
+    """
+    Raised inside work whose result is no longer wanted. Like asyncio.CancelledError it is a
+    BaseException, so the `except Exception` fallbacks in the agents do not swallow it.
+    """
+
+
+def current_cancel_event() -> Optional[threading.Event]:
+    return _cancel_event.get()
+
+
+def is_cancelled() -> bool:
+    event = _cancel_event.get()
+    return bool(event and event.is_set())
+
+
+def check_cancelled() -> None:
+    """Raise Cancelled if the current context has been cancelled."""
+    if is_cancelled():
+        raise Cancelled()
+
+
+def run_cancellable(event: threading.Event, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run fn(*args, **kwargs) in a copy of the current context with `event` as its cancel signal."""
+    ctx = contextvars.copy_context()
+
+    def _run():
+        _cancel_event.set(event)
+        return fn(*args, **kwargs)
+
+    return ctx.run(_run)
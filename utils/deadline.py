@@ -0,0 +1,73 @@
+# utils/deadline.py
+"""
+Per-request deadlines, carried in a context variable like the cancel signal in
+utils.cancel_utils, so every fetch and LLM call under a request can see how much time is left.
+
+    with deadline_scope(at=...)   run a block under a deadline (time.monotonic() value);
+                                  nested scopes keep the earlier deadline
+    remaining()                   seconds left (None without a deadline)
+    timeout_for(default)          the timeout for one call: min(default, remaining())
+    check_deadline()              raise DeadlineExceeded once the deadline has passed
+
+The combined graph sets the deadline per request (CombinedState.deadline_s, default
+REQUEST_DEADLINE_S) and each node runs under it.
+"""
+from __future__ import annotations
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+DEFAULT_REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S")) if os.getenv("REQUEST_DEADLINE_S") else None
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed. A TimeoutError, so existing timeout fallbacks apply."""
+
+
+def deadline_after(seconds: Optional[float]) -> Optional[float]:
+    """The deadline `seconds` from now (None for no deadline)."""
+    return None if seconds is None else time.monotonic() + seconds
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+@contextmanager
+def deadline_scope(at: Optional[float]) -> Iterator[Optional[float]]:
+    """Run the block under deadline `at` (or the enclosing one, if earlier); None keeps the current one."""
+    outer = _deadline.get()
+    effective = at if outer is None else (outer if at is None else min(outer, at))
+    token = _deadline.set(effective)
+    try:
+        yield effective
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def expired() -> bool:
+    deadline = _deadline.get()
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def timeout_for(default: Optional[float] = None) -> Optional[float]:
+    """A call's own timeout capped by the time left (None only if neither is set)."""
+    left = remaining()
+    if left is None:
+        return default
+    return left if default is None else min(default, left)
+
+
+def check_deadline(what: str = "request") -> None:
+    if expired():
+        raise DeadlineExceeded(f"Deadline exceeded before {what}.")
@@ -0,0 +1,312 @@
+# utils/embedding_service.py
+"""
+Shared, micro-batched sentence-transformers embedding service.
+
+One EmbeddingService per model per process (get_embedding_service) loads the model once and
+serves every caller:
+
+- Requests from concurrent callers are collected for up to `batch_window_s` (or until
+  `max_batch` texts) and encoded together, so per-call overhead is paid once per batch.
+- Vectors are cached by a hash of the text (LRU, `cache_size` entries); cached texts are
+  answered without queueing.
+- With `workers` > 0, batches are encoded in a pool of worker processes (each loads the model
+  once) so CPU encoding uses several cores; with 0 the model runs in this process.
+
+as_langchain() wraps the service as a LangChain Embeddings object (FAISS, Chroma, retrievers).
+Vectors are the ones HuggingFaceEmbeddings returns for the same model (no normalization).
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BATCH_WINDOW_S = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")) / 1000.0
+MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "50000"))
+
+
+def model_id(model_name: str) -> str:
+    """'all-MiniLM-L6-v2' and 'sentence-transformers/all-MiniLM-L6-v2' are the same model."""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class SentenceTransformerEncoder:
+    """texts -> float32[len(texts), dim]; the model loads on first use (also inside worker processes)."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model = None
+
+    def __getstate__(self):
+        return {"model_name": self.model_name, "_model": None}  # workers load their own copy
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._model = SentenceTransformer(self.model_name)
+        return self._model.encode(texts, batch_size=len(texts), convert_to_numpy=True).astype(np.float32)
+
+
+# ----------------------------
+# Worker processes
+# ----------------------------
+_worker_encoder: Optional[Callable[[List[str]], np.ndarray]] = None
+
+
+def _worker_init(encoder: Callable[[List[str]], np.ndarray]) -> None:
+    global _worker_encoder
+    _worker_encoder = encoder
+    _worker_encoder(["warmup"])  # load the model before the first real batch
+
+
+def _worker_encode(texts: List[str]) -> np.ndarray:
+    return _worker_encoder(texts)
+
+
+# ----------------------------
+# Service
+# ----------------------------
+class _Request:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+
+
+def _key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingService:
+    def __init__(self, model_name: str = DEFAULT_MODEL, batch_window_s: float = BATCH_WINDOW_S,
+                 max_batch: int = MAX_BATCH, workers: int = WORKERS, cache_size: int = CACHE_SIZE,
+                 encoder: Optional[Callable[[List[str]], np.ndarray]] = None):
+        self.model_name = model_id(model_name)
+        self.batch_window_s = batch_window_s
+        self.max_batch = max(1, max_batch)
+        self.cache_size = cache_size
+        self.encoder = encoder or SentenceTransformerEncoder(self.model_name)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if workers > 0:
+            # spawn: workers must not inherit a half-initialized torch / tokenizer state
+            self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_worker_init, initargs=(self.encoder,))
+        self.workers = workers
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._dispatch, name=f"embed[{self.model_name}]", daemon=True)
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "texts": 0, "cache_hits": 0, "batches": 0, "encoded": 0, "encode_s": 0.0,
+                      "errors": 0}
+        self._closed = False
+        self._thread.start()
+
+    # --- cache ---
+    def _cached(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        with self._cache_lock:
+            out = []
+            for k in keys:
+                v = self._cache.get(k)
+                if v is not None:
+                    self._cache.move_to_end(k)
+                out.append(v)
+            return out
+
+    def _store(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            for k, v in zip(keys, vectors):
+                self._cache[k] = v
+                self._cache.move_to_end(k)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _count(self, **deltas: float) -> None:
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self.stats[k] += v
+
+    # --- callers ---
+    def embed(self, texts: Sequence[str], timeout_s: Optional[float] = None) -> np.ndarray:
+        """float32[len(texts), dim], from the cache where possible and one queued request for the rest."""
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [_key(t) for t in texts]
+        found = self._cached(keys)
+        missing = [i for i, v in enumerate(found) if v is None]
+        self._count(requests=1, texts=len(texts), cache_hits=len(texts) - len(missing))
+        if missing:
+            if self._closed:
+                raise RuntimeError("embedding service is closed")
+            req = _Request([texts[i] for i in missing])
+            self._queue.put(req)
+            for i, v in zip(missing, req.future.result(timeout=timeout_s)):
+                found[i] = v
+        return np.stack(found)
+
+    def embed_one(self, text: str, timeout_s: Optional[float] = None) -> np.ndarray:
+        return self.embed([text], timeout_s)[0]
+
+    def as_langchain(self) -> "ServiceEmbeddings":
+        return ServiceEmbeddings(self)
+
+    # --- dispatcher ---
+    def _collect(self, first: _Request) -> List[_Request]:
+        """The first request plus whatever arrives within the batch window (up to max_batch texts)."""
+        batch, size = [first], len(first.texts)
+        deadline = time.monotonic() + self.batch_window_s
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                req = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is None:
+                self._queue.put(None)  # close() sentinel: finish this batch first
+                break
+            batch.append(req)
+            size += len(req.texts)
+        return batch
+
+    def _dispatch(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            # Each distinct text is encoded once per batch, in chunks of at most max_batch
+            unique: Dict[bytes, str] = {}
+            for req in batch:
+                for t in req.texts:
+                    unique.setdefault(_key(t), t)
+            keys = list(unique)
+            chunks = [keys[i:i + self.max_batch] for i in range(0, len(keys), self.max_batch)]
+            if self._pool is None:
+                t0 = time.perf_counter()
+                try:
+                    vectors = {k: v for chunk in chunks
+                               for k, v in zip(chunk, self.encoder([unique[k] for k in chunk]))}
+                except BaseException as e:
+                    self._fail(batch, e)
+                    continue
+                self._resolve(batch, vectors, time.perf_counter() - t0, len(chunks))
+            else:
+                self._submit_to_pool(batch, unique, chunks)
+
+    def _submit_to_pool(self, batch: List[_Request], unique: Dict[bytes, str], chunks: List[List[bytes]]) -> None:
+        """Hand chunks to the worker pool without waiting, so the next batch can be collected meanwhile."""
+        vectors: Dict[bytes, np.ndarray] = {}
+        left = [len(chunks)]
+        lock = threading.Lock()
+        t0 = time.perf_counter()
+
+        def done(fut: Future, chunk: List[bytes]) -> None:
+            try:
+                out = fut.result()
+            except BaseException as e:
+                self._fail(batch, e)
+                return
+            with lock:
+                vectors.update(zip(chunk, out))
+                left[0] -= 1
+                last = left[0] == 0
+            if last:
+                self._resolve(batch, vectors, time.perf_counter() - t0, len(chunks))
+
+        for chunk in chunks:
+            fut = self._pool.submit(_worker_encode, [unique[k] for k in chunk])
+            fut.add_done_callback(lambda f, c=chunk: done(f, c))
+
+    def _resolve(self, batch: List[_Request], vectors: Dict[bytes, np.ndarray], encode_s: float, calls: int) -> None:
+        keys = list(vectors)
+        self._store(keys, np.stack([vectors[k] for k in keys]))
+        self._count(batches=calls, encoded=len(keys), encode_s=encode_s)
+        for req in batch:
+            if not req.future.done():
+                req.future.set_result([vectors[_key(t)] for t in req.texts])
+
+    def _fail(self, batch: List[_Request], error: BaseException) -> None:
+        self._count(errors=1)
+        for req in batch:
+            if not req.future.done():
+                req.future.set_exception(error)
+
+    # --- lifecycle ---
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            s = dict(self.stats)
+        return {
+            **s,
+            "model": self.model_name,
+            "workers": self.workers,
+            "cached_vectors": len(self._cache),
+            "mean_batch": round(s["encoded"] / s["batches"], 2) if s["batches"] else 0.0,
+            "cache_hit_rate": round(s["cache_hits"] / s["texts"], 4) if s["texts"] else 0.0,
+        }
+
+
+class ServiceEmbeddings(Embeddings):
+    """LangChain Embeddings backed by an EmbeddingService."""
+
+    def __init__(self, service: EmbeddingService):
+        self.service = service
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.service.embed(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.service.embed_one(text).tolist()
+
+
+# ----------------------------
+# Process-wide services
+# ----------------------------
+_services: Dict[str, EmbeddingService] = {}
+_services_lock = threading.Lock()
+
+
+def get_embedding_service(model_name: str = DEFAULT_MODEL, **kwargs: Any) -> EmbeddingService:
+    """The shared service for a model (created on first use; kwargs only apply then)."""
+    key = model_id(model_name)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = _services[key] = EmbeddingService(key, **kwargs)
+        return service
+
+
+def embedding_summary() -> Dict[str, Dict[str, Any]]:
+    return {name: s.summary() for name, s in _services.items()}
+
+
+@atexit.register
+def _close_services() -> None:
+    for s in list(_services.values()):
+        s.close()
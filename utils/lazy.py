@@ -0,0 +1,43 @@
+# utils/lazy.py
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """
+    A zero-arg factory whose result is built on first `get()` and then reused (thread-safe).
+    Used to defer agent/LLM-client construction (and their heavy imports) until a route
+    actually needs them.
+    """
+
+    def __init__(self, factory: Callable[[], T], name: str = ""):
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._built = False
+        self._lock = threading.Lock()
+        self.name = name or getattr(factory, "__name__", "lazy")
+        self.build_seconds: Optional[float] = None
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def get(self) -> T:
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    t0 = time.perf_counter()
+                    self._value = self._factory()
+                    self.build_seconds = time.perf_counter() - t0
+                    self._built = True
+        return self._value  # type: ignore[return-value]
+
+
+def resolve(obj: Any) -> Any:
+    """Return obj.get() for a Lazy, otherwise obj itself."""
+    return obj.get() if isinstance(obj, Lazy) else obj
@@ -0,0 +1,355 @@
+# utils/llm_utils.py
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.cancel_utils import Cancelled, check_cancelled, current_cancel_event
+from utils.deadline import check_deadline, timeout_for
+from utils.metrics import LatencyWindow
+from utils.rate_limit import abandon_run
+from utils.token_utils import count_message_tokens, count_tokens, token_ledger
+from utils.tracing import span, tracer
+
+# A single long-lived event loop runs all deadline-bound LLM calls. Reusing one loop keeps
+# the async HTTP clients inside the chat models bound to a live loop between calls.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+# How often a blocked caller re-checks its cancel signal.
+_CANCEL_POLL_S = 0.05
+
+# Hedged requests (HedgePolicy): LLM_HEDGE=1 hedges the caregiver and provider summary calls
+# to the other provider (Groq <-> OpenAI) once they run past this percentile of recent latency
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+# Share of secondary-won calls whose primary is left to finish, for an uncensored latency baseline
+HEDGE_BASELINE_FRACTION = float(os.getenv("LLM_HEDGE_BASELINE", "0.1"))
+
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+        return _loop
+
+
+def model_name(llm: Any) -> str:
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__)
+
+
+def invoke_with_timeout(llm: Any, messages: Any, timeout_s: Optional[float] = None, stage: str = "call",
+                        hedge: Optional["HedgePolicy"] = None) -> Any:
+    """
+    Invoke a chat model and return its response. Traced as span `llm.<stage>` with the model
+    name, the prompt's token count (counted before the call), token usage and cost; each call
+    is also recorded in utils.token_utils.token_ledger.
+
+    - The request deadline in context (utils.deadline), if any, caps timeout_s.
+    - timeout_s=None, no hedge, deadline or cancel signal in context: plain blocking `llm.invoke`.
+    - Otherwise the call runs as `ainvoke` on a background loop and is cancelled (HTTP request
+      included) once `timeout_s` elapses (raises TimeoutError) or the current context is
+      cancelled (raises Cancelled, see utils.cancel_utils).
+    - hedge: a HedgePolicy that may also send the messages to its secondary model; the span
+      then records `hedged` and the model that answered.
+    """
+    check_deadline(f"LLM call {stage}")
+    timeout_s = timeout_for(timeout_s)
+    model = model_name(llm)
+    estimated = count_message_tokens(messages, model)
+    with span(f"llm.{stage}", model=model, timeout_s=timeout_s, estimated_input_tokens=estimated) as s:
+        try:
+            response, served_by, hedged = _invoke(llm, messages, timeout_s, hedge, stage)
+        except BaseException as e:
+            token_ledger.record(stage, model, estimated, error=type(e).__name__)
+            raise
+        usage = getattr(response, "usage_metadata", None) or {}
+        served_model = model_name(served_by)
+        record = token_ledger.record(stage, served_model, estimated, usage.get("input_tokens"), usage.get("output_tokens"))
+        s.set(
+            input_tokens=usage.get("input_tokens", 0),
+            output_tokens=usage.get("output_tokens", 0),
+            cost_usd=record.cost_usd or 0.0,
+        )
+        if hedge is not None:
+            s.set(hedged=hedged, served_model=served_model)
+        return response
+
+
+def _invoke(llm: Any, messages: Any, timeout_s: Optional[float],
+            hedge: Optional["HedgePolicy"] = None, stage: str = "call") -> Tuple[Any, Any, bool]:
+    """(response, model that answered, whether the call was hedged)."""
+    check_cancelled()
+    cancel_event = current_cancel_event()
+    if timeout_s is None and cancel_event is None and hedge is None:
+        return llm.invoke(messages), llm, False
+    if timeout_s is not None and timeout_s <= 0:
+        raise TimeoutError("No time left for the LLM call.")
+
+    coro = hedge.ainvoke(llm, messages, stage) if hedge is not None else _served(llm, _ainvoke(llm, messages))
+    if timeout_s is not None:
+        coro = asyncio.wait_for(coro, timeout_s)
+    future = asyncio.run_coroutine_threadsafe(coro, _background_loop())
+    if cancel_event is not None:
+        while not concurrent.futures.wait([future], timeout=_CANCEL_POLL_S).done:
+            if cancel_event.is_set():
+                future.cancel()
+                raise Cancelled()
+    try:
+        return future.result()
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"LLM call exceeded {timeout_s:.2f}s") from None
+
+
+async def _served(llm: Any, call) -> Tuple[Any, Any, bool]:
+    return await call, llm, False
+
+
+async def _ainvoke(llm: Any, messages: Any) -> Any:
+    """llm.ainvoke that gives the call's rate-limiter slot back if the call is cancelled."""
+    run_id = uuid.uuid4()
+    try:
+        return await llm.ainvoke(messages, config={"run_id": run_id})
+    except asyncio.CancelledError:
+        abandon_run(llm, run_id)
+        raise
+
+
+# ----------------------------
+# Hedged requests
+# ----------------------------
+class HedgePolicy:
+    """
+    Hedged LLM calls against tail latency. If the primary model has not answered after the
+    `percentile` of its recent latencies (default_delay_s until min_samples calls are seen),
+    the same messages also go to `secondary`; the first successful answer wins and the other
+    call is cancelled. Hedging pauses while more than max_hedge_rate of calls were hedged, so
+    a slow provider can't double the load.
+
+    Latency of a cancelled primary is unknown (only "longer than the served call"), so it is
+    not recorded: the delay window holds completed primary calls only. Those miss exactly the
+    slow calls hedging cuts off, so for `baseline_fraction` of the calls the secondary wins,
+    the primary is left to finish in the background; its latency is recorded with weight
+    1 / baseline_fraction, which puts the tail back into the window. p99_saved_s compares that
+    baseline with the served latency (None until a cut-off primary has been sampled).
+
+    The call that lost is recorded in token_ledger under stage "<stage>.hedge_loser": its
+    usage when it finished, else its estimated prompt tokens (output unknown).
+    """
+
+    def __init__(self, secondary: Any, percentile: float = HEDGE_PERCENTILE, min_samples: int = 20,
+                 default_delay_s: float = 2.0, min_delay_s: float = 0.25, max_hedge_rate: float = 0.25,
+                 baseline_fraction: float = HEDGE_BASELINE_FRACTION):
+        self.secondary = secondary
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.default_delay_s = default_delay_s
+        self.min_delay_s = min_delay_s
+        self.max_hedge_rate = max_hedge_rate
+        self.baseline_fraction = baseline_fraction
+        self.primary_latency = LatencyWindow()
+        self.served_latency = LatencyWindow()
+        self.stats = {"calls": 0, "hedged": 0, "secondary_wins": 0, "skipped": 0, "censored": 0,
+                      "baseline_samples": 0}
+        self._lock = threading.Lock()
+
+    def delay_s(self) -> float:
+        """How long the primary may take before the call is hedged."""
+        if len(self.primary_latency) < self.min_samples:
+            return self.default_delay_s
+        return max(self.min_delay_s, self.primary_latency.p(self.percentile))
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            calls, hedged = self.stats["calls"], self.stats["hedged"]
+            ok = calls < self.min_samples or hedged < self.max_hedge_rate * calls
+            self.stats["skipped"] += not ok
+            return ok
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for k, v in deltas.items():
+                self.stats[k] += v
+
+    async def ainvoke(self, llm: Any, messages: Any, stage: str = "call") -> Tuple[Any, Any, bool]:
+        """(response, model that answered, whether the call was hedged)."""
+        t0 = time.perf_counter()
+        primary = asyncio.ensure_future(_ainvoke(llm, messages))
+        primary_done_at: Dict[str, float] = {}
+        primary.add_done_callback(lambda _: primary_done_at.setdefault("t", time.perf_counter()))
+        models = {primary: llm}
+        winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.delay_s())
+            if not done and self._may_hedge():
+                models[asyncio.ensure_future(_ainvoke(self.secondary, messages))] = self.secondary
+            pending, error = set(models), None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task
+                        break
+                    error = error or task.exception()
+            if winner is None:
+                raise error
+            return winner.result(), models[winner], len(models) > 1
+        finally:
+            hedged = len(models) > 1
+            # Sample: let a cut-off primary finish for the uncensored baseline
+            keep = (winner is not None and winner is not primary and not primary.done()
+                    and random.random() < self.baseline_fraction)
+            for task, model in models.items():
+                if task is winner or task.done():
+                    continue
+                if task is primary and keep:
+                    task.add_done_callback(lambda t: self._finish_baseline(t, t0, stage, llm, messages))
+                    continue
+                task.cancel()
+                if winner is not None:
+                    self._record_loser(stage, model, messages)
+                    if task is primary:
+                        self._count(censored=1)
+            if winner is not None:
+                if primary.done() and not primary.cancelled() and primary.exception() is None:
+                    self.primary_latency.record(primary_done_at.get("t", time.perf_counter()) - t0)
+                self.served_latency.record(time.perf_counter() - t0)
+                self._count(calls=1, hedged=hedged, secondary_wins=winner is not primary)
+
+    def _finish_baseline(self, task: "asyncio.Future", t0: float, stage: str, llm: Any, messages: Any) -> None:
+        """A sampled primary that was left running has finished (on the event loop)."""
+        elapsed = time.perf_counter() - t0
+        if task.cancelled() or task.exception() is not None:
+            self._count(censored=1)
+            self._record_loser(stage, llm, messages)
+            return
+        # Inverse-probability weight: stands for every cut-off primary that was not sampled
+        for _ in range(max(1, round(1.0 / self.baseline_fraction))):
+            self.primary_latency.record(elapsed)
+        self._count(baseline_samples=1)
+        self._record_loser(stage, llm, messages, getattr(task.result(), "usage_metadata", None))
+
+    @staticmethod
+    def _record_loser(stage: str, llm: Any, messages: Any, usage: Optional[Dict[str, Any]] = None) -> None:
+        model = model_name(llm)
+        usage = usage or {}
+        token_ledger.record(f"{stage}.hedge_loser", model, count_message_tokens(messages, model),
+                            usage.get("input_tokens"), usage.get("output_tokens"))
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+        primary, served = self.primary_latency.summary(), self.served_latency.summary()
+        # Without a sampled baseline the primary window lacks the cut-off (slowest) calls
+        uncensored = stats["censored"] == 0 or stats["baseline_samples"] > 0
+        return {
+            **stats,
+            "hedge_rate": round(stats["hedged"] / stats["calls"], 4) if stats["calls"] else 0.0,
+            "secondary": model_name(self.secondary),
+            "delay_s": round(self.delay_s(), 3),
+            "primary_latency": primary,
+            "served_latency": served,
+            "p99_saved_s": round(primary["p99"] - served["p99"], 3) if uncensored and primary["count"] else None,
+        }
+
+
+def _secondary_for(llm: Any) -> Optional[Any]:
+    """A model on the other provider (Groq <-> OpenAI), if its API key is set."""
+    from utils.rate_limit import attach_rate_limiter, provider_of
+
+    temperature = getattr(llm, "temperature", 0.0) or 0.0
+    if provider_of(llm) == "groq":
+        if not os.getenv("OPENAI_API_KEY"):
+            return None
+        from langchain_openai import ChatOpenAI
+        secondary = ChatOpenAI(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), temperature=temperature,
+                               include_response_headers=True)
+    else:
+        if not os.getenv("GROQ_API_KEY"):
+            return None
+        from langchain_groq import ChatGroq
+        secondary = ChatGroq(model=os.getenv("GROQ_HEDGE_MODEL") or "openai/gpt-oss-20b", temperature=temperature)
+    attach_rate_limiter(secondary)
+    return secondary
+
+
+def hedge_from_env(llm: Any) -> Optional[HedgePolicy]:
+    """HedgePolicy for `llm` onto the other provider when LLM_HEDGE=1 (None otherwise)."""
+    if not HEDGE_ENABLED:
+        return None
+    secondary = _secondary_for(llm)
+    if secondary is None:
+        print(f"⚠️ LLM_HEDGE=1 but no API key for a secondary provider to {model_name(llm)}; not hedging.")
+        return None
+    return HedgePolicy(secondary)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback that records `llm.<stage>` and `retriever.<stage>` spans for chains
+    we don't call directly (e.g. the CDC RetrievalQA chain), and token_ledger records for
+    their LLM calls.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._starts: Dict[Any, float] = {}
+        self._prompts: Dict[Any, tuple] = {}  # run id -> (model, estimated input tokens)
+
+    def _start(self, run_id: Any) -> None:
+        self._starts[run_id] = time.perf_counter()
+
+    def _elapsed_ms(self, run_id: Any) -> float:
+        return (time.perf_counter() - self._starts.pop(run_id, time.perf_counter())) * 1000.0
+
+    @staticmethod
+    def _model(kwargs: Dict[str, Any]) -> str:
+        params = kwargs.get("invocation_params") or {}
+        return str(params.get("model_name") or params.get("model") or params.get("_type") or "unknown")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        model = self._model(kwargs)
+        self._prompts[run_id] = (model, sum(count_message_tokens(batch, model) for batch in messages))
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        model = self._model(kwargs)
+        self._prompts[run_id] = (model, sum(count_tokens(p, model) for p in prompts))
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        model, estimated = self._prompts.pop(run_id, ("unknown", 0))
+        record = token_ledger.record(self.stage, model, estimated, usage.get("prompt_tokens"),
+                                     usage.get("completion_tokens"))
+        tracer.record(
+            f"llm.{self.stage}", self._elapsed_ms(run_id),
+            input_tokens=usage.get("prompt_tokens", 0),
+            output_tokens=usage.get("completion_tokens", 0),
+            estimated_input_tokens=estimated,
+            cost_usd=record.cost_usd or 0.0,
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        model, estimated = self._prompts.pop(run_id, ("unknown", 0))
+        token_ledger.record(self.stage, model, estimated, error=type(error).__name__)
+        tracer.record(f"llm.{self.stage}", self._elapsed_ms(run_id), error=type(error).__name__)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs) -> None:
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs) -> None:
+        tracer.record(f"retriever.{self.stage}", self._elapsed_ms(run_id), docs=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs) -> None:
+        tracer.record(f"retriever.{self.stage}", self._elapsed_ms(run_id), error=type(error).__name__)
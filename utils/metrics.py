@@ -0,0 +1,67 @@
+# utils/metrics.py
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..100). Returns 0.0 for an empty input."""
+    data = sorted(values)
+    if not data:
+        return 0.0
+    rank = max(1, math.ceil(q / 100.0 * len(data)))
+    return data[min(rank, len(data)) - 1]
+
+
+class LatencyWindow:
+    """
+    Thread-safe rolling window of recent latencies (seconds): the last `maxlen` samples, and
+    with max_age_s only those recorded within that many seconds (older ones age out).
+    """
+
+    def __init__(self, maxlen: int = 500, max_age_s: Optional[float] = None):
+        self._values: deque = deque(maxlen=maxlen)  # (time.monotonic(), seconds)
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+
+    def _expire(self) -> None:
+        if self.max_age_s is not None:
+            cutoff = time.monotonic() - self.max_age_s
+            while self._values and self._values[0][0] < cutoff:
+                self._values.popleft()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append((time.monotonic(), float(seconds)))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    def values(self) -> List[float]:
+        with self._lock:
+            self._expire()
+            return [v for _, v in self._values]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._expire()
+            return len(self._values)
+
+    def p(self, q: float, default: float = 0.0) -> float:
+        vals = self.values()
+        return percentile(vals, q) if vals else default
+
+    def summary(self) -> Dict[str, float]:
+        vals = self.values()
+        return {
+            "count": len(vals),
+            "p50": percentile(vals, 50),
+            "p95": percentile(vals, 95),
+            "p99": percentile(vals, 99),
+            "max": max(vals) if vals else 0.0,
+        }
@@ -0,0 +1,363 @@
+# utils/rate_limit.py
+"""
+Process-wide client-side rate limiting for LLM APIs: one limiter per (provider, model).
+
+Each limiter combines:
+  - token buckets for requests/min and tokens/min (a call reserves its estimated tokens up
+    front; the difference to the real usage is settled when it finishes)
+  - an adaptive concurrency limit (AIMD): +1 after `limit` successful calls, halved on a
+    rate-limit error (at most once per round of in-flight calls)
+  - feedback from rate-limit response headers: x-ratelimit-remaining-* / x-ratelimit-reset-*
+    cap the buckets (and pause them at zero), x-ratelimit-limit-tokens sets the tokens/min
+    rate when none is configured, and retry-after pauses the limiter after a 429
+
+Limiters attach to LangChain chat models as callbacks (attach_rate_limiter), so every call
+through the model acquires from its limiter: direct invokes, batch()/abatch(), and chains
+that call the model internally (the CDC RetrievalQA chain). on_chat_model_start waits for a
+concurrency slot and bucket budget; on_llm_end / on_llm_error release the slot and feed back
+usage, headers and 429s.
+
+Limits come from the environment (unset: learned from headers, else unlimited):
+  <PROVIDER>_RPM, <PROVIDER>_TPM     e.g. OPENAI_TPM=200000, GROQ_RPM=30
+  LLM_MAX_CONCURRENCY                upper bound of the adaptive concurrency limit (default 16)
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.cancel_utils import Cancelled, current_cancel_event
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# A slot whose call never reported back (e.g. abandoned on a timeout) is reclaimed after this long
+LEASE_S = 300.0
+# Pause after a 429 without retry-after / reset headers
+DEFAULT_RETRY_AFTER_S = 1.0
+# How often a waiting caller re-checks its cancel signal
+_POLL_S = 0.05
+
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def parse_duration(value: Any) -> Optional[float]:
+    """Seconds from a rate-limit reset header: '1s', '6m0s', '2m59.56s', '120ms', '7.66', ..."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    units = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", text)
+    return sum(float(n) * units[u] for n, u in parts) if parts else None
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Refills at `per_minute` / 60 per second up to one minute's quota; per_minute=None is unlimited."""
+
+    def __init__(self, per_minute: Optional[float] = None):
+        self.per_minute = per_minute
+        self.level = per_minute or 0.0
+        self.paused_until = 0.0
+        self._updated = time.monotonic()
+
+    def set_rate(self, per_minute: float) -> None:
+        self._refill(time.monotonic())
+        self.per_minute = per_minute
+        self.level = min(self.level, per_minute)
+
+    def _refill(self, now: float) -> None:
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level + (now - self._updated) * self.per_minute / 60.0)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` (the level may go negative); returns seconds until it is covered."""
+        wait = max(0.0, self.paused_until - now)
+        if not self.per_minute:
+            return wait
+        self._refill(now)
+        self.level -= amount
+        return max(wait, -self.level * 60.0 / self.per_minute if self.level < 0 else 0.0)
+
+    def settle(self, amount: float) -> None:
+        """Adjust a reservation by the difference to the real amount (negative gives back)."""
+        if self.per_minute:
+            self.level = min(self.per_minute, self.level - amount)
+
+    def observe(self, remaining: Optional[float], reset_s: Optional[float], now: float) -> None:
+        """Server-reported remaining quota: never assume more than that; pause at zero until reset."""
+        if remaining is None:
+            return
+        if self.per_minute:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+        if remaining <= 0:
+            self.pause(reset_s if reset_s is not None else DEFAULT_RETRY_AFTER_S, now)
+
+    def pause(self, seconds: float, now: float) -> None:
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class RateLimiter:
+    """Token buckets + AIMD concurrency limit for one provider / model (see module docstring)."""
+
+    def __init__(self, name: str, rpm: Optional[float] = None, tpm: Optional[float] = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, min_concurrency: int = 1):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._tpm_configured = tpm is not None
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self._in_flight: Dict[Any, Tuple[float, float]] = {}  # run id -> (started, reserved tokens)
+        self._last_decrease = 0.0
+        self._avg_output_tokens = 256.0
+        self._cond = threading.Condition()
+        self._abandoned: "OrderedDict[Any, None]" = OrderedDict()  # cancelled before admission
+        self.stats = {"calls": 0, "rate_limited": 0, "errors": 0, "waited_s": 0.0, "reclaimed": 0, "abandoned": 0}
+
+    # --- acquire / release ---
+    def acquire(self, run_id: Any, input_tokens: float) -> float:
+        """Wait for a concurrency slot and bucket budget; returns seconds waited. Raises Cancelled."""
+        cancel = current_cancel_event()
+        t0 = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._reclaim(now)
+                if len(self._in_flight) < int(self.limit):
+                    break
+                self._cond.wait(_POLL_S)
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled()
+            if run_id in self._abandoned:
+                del self._abandoned[run_id]
+                raise Cancelled()
+            estimate = input_tokens + self._avg_output_tokens
+            self._in_flight[run_id] = (now, estimate)
+            wait = max(self.requests.reserve(1, now), self.tokens.reserve(estimate, now))
+        deadline = time.monotonic() + wait
+        while (left := deadline - time.monotonic()) > 0:
+            if cancel is None:
+                time.sleep(left)
+            elif cancel.wait(min(left, _POLL_S)):
+                with self._cond:
+                    self._in_flight.pop(run_id, None)
+                    self._cond.notify_all()
+                raise Cancelled()
+        waited = time.monotonic() - t0
+        with self._cond:
+            self.stats["waited_s"] += waited
+        return waited
+
+    def release(self, run_id: Any, *, ok: bool = False, tokens_used: Optional[float] = None,
+                output_tokens: Optional[float] = None, headers: Optional[Mapping[str, Any]] = None,
+                rate_limited: bool = False) -> None:
+        with self._cond:
+            now = time.monotonic()
+            started, estimate = self._in_flight.pop(run_id, (now, 0.0))
+            self.stats["calls"] += 1
+            if tokens_used is not None:
+                self.tokens.settle(tokens_used - estimate)
+            if output_tokens:
+                self._avg_output_tokens = 0.9 * self._avg_output_tokens + 0.1 * output_tokens
+            if headers:
+                self._apply_headers(headers, now)
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+                # Multiplicative decrease, once per round: calls started before the last
+                # decrease were admitted under the old limit and say nothing new.
+                if started >= self._last_decrease:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2.0)
+                    self._last_decrease = now
+                retry_after = parse_duration(_header(headers, "retry-after")) if headers else None
+                pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER_S
+                self.requests.pause(pause, now)
+                self.tokens.pause(pause, now)
+            elif ok:
+                # Additive increase: about +1 per `limit` successful calls
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            else:
+                self.stats["errors"] += 1
+            self._cond.notify_all()
+
+    def abandon(self, run_id: Any) -> None:
+        """
+        A call its caller cancelled (hedge loser, timeout): free its slot without feedback. A
+        cancelled asyncio call never reports back, and its admission may still be pending in
+        an executor thread; that admission then gives up instead of taking a slot.
+        """
+        with self._cond:
+            if self._in_flight.pop(run_id, None) is None:
+                self._abandoned[run_id] = None
+                while len(self._abandoned) > 1024:
+                    self._abandoned.popitem(last=False)
+            self.stats["abandoned"] += 1
+            self._cond.notify_all()
+
+    def _reclaim(self, now: float) -> None:
+        for run_id, (started, _) in list(self._in_flight.items()):
+            if now - started > LEASE_S:
+                del self._in_flight[run_id]
+                self.stats["reclaimed"] += 1
+
+    def _apply_headers(self, headers: Mapping[str, Any], now: float) -> None:
+        limit_tokens = _number(_header(headers, "x-ratelimit-limit-tokens"))
+        if limit_tokens and not self._tpm_configured and limit_tokens != self.tokens.per_minute:
+            self.tokens.set_rate(limit_tokens)
+        self.requests.observe(_number(_header(headers, "x-ratelimit-remaining-requests")),
+                              parse_duration(_header(headers, "x-ratelimit-reset-requests")), now)
+        self.tokens.observe(_number(_header(headers, "x-ratelimit-remaining-tokens")),
+                            parse_duration(_header(headers, "x-ratelimit-reset-tokens")), now)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self.stats,
+                "waited_s": round(self.stats["waited_s"], 3),
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": len(self._in_flight),
+                "rpm": self.requests.per_minute,
+                "tpm": self.tokens.per_minute,
+            }
+
+
+def _header(headers: Optional[Mapping[str, Any]], name: str) -> Any:
+    if not headers:
+        return None
+    value = headers.get(name)
+    if value is None:
+        value = next((v for k, v in headers.items() if str(k).lower() == name), None)
+    return value
+
+
+# ----------------------------
+# LangChain integration
+# ----------------------------
+def _estimate_tokens(texts: List[str]) -> float:
+    return sum(len(t) for t in texts) / 4.0
+
+
+def _is_rate_limit_error(error: BaseException) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "ratelimit" in type(error).__name__.lower()
+
+
+class _AdmitHandler(BaseCallbackHandler):
+    """Blocks a model call until its limiter admits it (runs off the event loop for async calls)."""
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        texts = [str(getattr(m, "content", m)) for batch in messages for m in batch]
+        self.limiter.acquire(run_id, _estimate_tokens(texts))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self.limiter.acquire(run_id, _estimate_tokens(prompts))
+
+
+class _FeedbackHandler(BaseCallbackHandler):
+    """Releases the slot and reports usage / headers / 429s. Inline: never waits on an executor."""
+
+    run_inline = True
+
+    def __init__(self, limiter: RateLimiter):
+        self.limiter = limiter
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        total, output = usage.get("total_tokens"), usage.get("completion_tokens")
+        headers = None
+        for gens in response.generations:
+            for gen in gens:
+                message = getattr(gen, "message", None)
+                meta = getattr(message, "usage_metadata", None) or {}
+                if total is None and meta:
+                    total, output = meta.get("total_tokens"), meta.get("output_tokens")
+                headers = headers or (gen.generation_info or {}).get("headers") \
+                    or (getattr(message, "response_metadata", None) or {}).get("headers")
+        self.limiter.release(run_id, ok=True, tokens_used=total, output_tokens=output, headers=headers)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        self.limiter.release(run_id, headers=dict(headers) if headers else None,
+                             rate_limited=_is_rate_limit_error(error))
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(provider: str, model: str) -> RateLimiter:
+    """The process-wide limiter for a provider / model (created from the environment on first use)."""
+    key = (provider.lower(), model)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            prefix = re.sub(r"\W", "_", provider.upper())
+            limiter = _limiters[key] = RateLimiter(
+                f"{provider}/{model}", rpm=_env_float(f"{prefix}_RPM"), tpm=_env_float(f"{prefix}_TPM"),
+            )
+        return limiter
+
+
+def provider_of(llm: Any) -> str:
+    cls = type(llm).__name__.lower()
+    for provider in ("groq", "openai", "anthropic"):
+        if provider in cls:
+            return provider
+    return getattr(llm, "_llm_type", None) or cls
+
+
+def attach_rate_limiter(llm: Any, provider: Optional[str] = None) -> RateLimiter:
+    """Route every call through `llm` via its shared limiter (idempotent); returns the limiter."""
+    from utils.llm_utils import model_name
+
+    limiter = limiter_for(provider or provider_of(llm), model_name(llm))
+    callbacks = getattr(llm, "callbacks", None)
+    handlers = callbacks.handlers if hasattr(callbacks, "handlers") else list(callbacks or [])
+    if any(getattr(h, "limiter", None) is limiter for h in handlers):
+        return limiter
+    new = [_AdmitHandler(limiter), _FeedbackHandler(limiter)]
+    if hasattr(callbacks, "add_handler"):
+        for handler in new:
+            callbacks.add_handler(handler)
+    else:
+        llm.callbacks = handlers + new
+    return limiter
+
+
+def abandon_run(llm: Any, run_id: Any) -> None:
+    """Free the limiter slot of a cancelled call through `llm` (see RateLimiter.abandon)."""
+    callbacks = getattr(llm, "callbacks", None)
+    handlers = callbacks.handlers if hasattr(callbacks, "handlers") else list(callbacks or [])
+    for handler in handlers:
+        if isinstance(handler, _AdmitHandler):
+            handler.limiter.abandon(run_id)
+
+
+def rate_limit_summary() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.summary() for limiter in limiters}
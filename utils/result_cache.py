@@ -0,0 +1,114 @@
+# utils/result_cache.py
+"""
+Versioned LRU + TTL result cache with single-flight coalescing.
+
+- Entries expire after `ttl_s` and the least recently used entry is evicted past `maxsize`.
+- Every lookup carries the version of the data it was computed from (e.g. the provider
+  directory version); the first lookup with a new version drops everything cached for
+  older versions.
+- Concurrent misses on the same key run the computation once; the other callers wait for
+  it and share its result (or its exception, which is not cached). If the computing caller
+  is cancelled, a waiting caller computes it instead.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ResultCache:
+    def __init__(self, maxsize: int = 1024, ttl_s: Optional[float] = 900.0, name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self.name = name
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()  # key -> (stored_at, value)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _check_version(self, version: Optional[str]) -> None:
+        # Called with the lock held
+        if version != self.version:
+            if self._entries:
+                self.stats["invalidations"] += 1
+            self._entries.clear()
+            self.version = version
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any], version: Optional[str] = None) -> Tuple[Any, str]:
+        """
+        Returns (value, outcome) with outcome 'hit' | 'miss' | 'coalesced'.
+        `key` should not include the version; pass it separately.
+        """
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl_s is None or time.monotonic() - stored_at < self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return value, "hit"
+                del self._entries[key]
+                self.stats["expirations"] += 1
+
+            flight_key = (version, key)
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if isinstance(flight.error, Exception):
+                raise flight.error
+            if flight.error is not None:
+                # The leader was cancelled / interrupted, which says nothing about this caller: retry
+                return self.get_or_compute(key, compute, version)
+            return flight.value, "coalesced"
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(flight_key, None)
+                # Store only if the data version did not move on while computing
+                if flight.error is None and self.maxsize > 0 and version == self.version:
+                    self._entries[key] = (time.monotonic(), flight.value)
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+                        self.stats["evictions"] += 1
+            flight.done.set()
+        return flight.value, "miss"
+
+    def summary(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "version": self.version,
+            "hit_rate": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,200 @@
+# utils/semantic_cache.py
+"""
+Semantic answer cache: answers keyed by question *meaning* instead of exact text.
+
+- A question is normalized (case, punctuation, whitespace); an exact normalized match is a
+  hit without embedding anything.
+- Otherwise the question is embedded and compared (cosine similarity) with every cached
+  question; the best match at or above `threshold` is a hit. The index is a small in-memory
+  matrix of unit vectors, rebuilt only when entries change.
+- Entries expire after `ttl_s` and the least recently used entry is evicted past `maxsize`.
+- Every lookup carries the version of the data the answers came from (for the CDC QA chain:
+  embedding model + corpus hash), and only sees answers stored under that version. Entries are
+  kept per version, so chains over different corpora (or an old and a rebuilt chain during a
+  reload) can share one cache; past `max_versions` the least recently used version is dropped.
+"""
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_PUNCT = re.compile(r"[^\w\s]")
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(_PUNCT.sub(" ", (text or "").lower()).split())
+
+
+class _Entry:
+    __slots__ = ("question", "vector", "value", "stored_at", "hits")
+
+    def __init__(self, question: str, vector: Optional[np.ndarray], value: Any):
+        self.question = question
+        self.vector = vector
+        self.value = value
+        self.stored_at = time.monotonic()
+        self.hits = 0
+
+
+def _unit(vector: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+class _Partition:
+    """The entries of one data version, with their lazily stacked vectors."""
+    __slots__ = ("entries", "matrix", "keys")
+
+    def __init__(self):
+        self.entries: "OrderedDict[str, _Entry]" = OrderedDict()  # normalized question -> entry
+        self.matrix: Optional[np.ndarray] = None                  # stacked unit vectors (lazy)
+        self.keys: List[str] = []                                 # row -> normalized question
+
+    def drop(self, key: str) -> None:
+        del self.entries[key]
+        self.matrix = None
+
+    def index(self) -> Optional[np.ndarray]:
+        if self.matrix is None:
+            self.keys = [k for k, e in self.entries.items() if e.vector is not None]
+            if self.keys:
+                self.matrix = np.stack([self.entries[k].vector for k in self.keys])
+        return self.matrix
+
+
+class SemanticCache:
+    def __init__(self, threshold: float = 0.9, maxsize: int = 512, ttl_s: Optional[float] = 86400.0,
+                 name: str = "semantic_cache", max_versions: int = 4):
+        self.threshold = threshold
+        self.maxsize = maxsize          # entries per version
+        self.ttl_s = ttl_s
+        self.name = name
+        self.max_versions = max(1, max_versions)
+        self._parts: "OrderedDict[Optional[str], _Partition]" = OrderedDict()  # version -> partition, LRU
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "exact_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0,
+                      "invalidations": 0}
+
+    def __len__(self) -> int:
+        return sum(len(p.entries) for p in self._parts.values())
+
+    @property
+    def version(self) -> Optional[str]:
+        """The most recently used version."""
+        return next(reversed(self._parts), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._parts.clear()
+
+    # --- internals (lock held) ---
+    def _partition(self, version: Optional[str], create: bool = False) -> Optional[_Partition]:
+        part = self._parts.get(version)
+        if part is not None:
+            self._parts.move_to_end(version)
+        elif create:
+            part = self._parts[version] = _Partition()
+            while len(self._parts) > self.max_versions:
+                self._parts.popitem(last=False)  # least recently used version
+                self.stats["invalidations"] += 1
+        return part
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl_s is not None and time.monotonic() - entry.stored_at >= self.ttl_s
+
+    def _hit(self, part: _Partition, key: str, entry: _Entry) -> Any:
+        part.entries.move_to_end(key)
+        entry.hits += 1
+        self.stats["hits"] += 1
+        return entry.value
+
+    # --- public ---
+    def lookup_exact(self, question: str, version: Optional[str] = None) -> Optional[Any]:
+        """The cached answer for the same normalized question (no embedding needed)."""
+        key = normalize_question(question)
+        with self._lock:
+            part = self._partition(version)
+            entry = part.entries.get(key) if part is not None else None
+            if entry is None:
+                return None
+            if self._expired(entry):
+                part.drop(key)
+                self.stats["expirations"] += 1
+                return None
+            self.stats["exact_hits"] += 1
+            return self._hit(part, key, entry)
+
+    def lookup(self, vector: Sequence[float], version: Optional[str] = None) -> Optional[Tuple[Any, float]]:
+        """(answer, similarity) of the most similar cached question at or above the threshold."""
+        query = _unit(vector)
+        with self._lock:
+            part = self._partition(version)
+            while part is not None:
+                matrix = part.index()
+                if matrix is None:
+                    return None
+                sims = matrix @ query
+                best = int(np.argmax(sims))
+                similarity = float(sims[best])
+                if similarity < self.threshold:
+                    return None
+                key = part.keys[best]
+                entry = part.entries[key]
+                if not self._expired(entry):
+                    return self._hit(part, key, entry), similarity
+                part.drop(key)  # expired: look again without it
+                self.stats["expirations"] += 1
+            return None
+
+    def store(self, question: str, value: Any, vector: Optional[Sequence[float]] = None,
+              version: Optional[str] = None) -> None:
+        """Cache an answer; without a vector it can only be found by an exact (normalized) match."""
+        key = normalize_question(question)
+        if not key or self.maxsize <= 0:
+            return
+        with self._lock:
+            part = self._partition(version, create=True)
+            if key in part.entries:
+                part.drop(key)
+            part.entries[key] = _Entry(question, None if vector is None else _unit(vector), value)
+            part.matrix = None
+            self.stats["stores"] += 1
+            while len(part.entries) > self.maxsize:
+                part.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get_or_compute(self, question: str, embed: Callable[[str], Sequence[float]], compute: Callable[[], Any],
+                       version: Optional[str] = None) -> Tuple[Any, str, Optional[float]]:
+        """
+        Returns (value, outcome, similarity) with outcome 'exact' | 'hit' | 'miss'. The question
+        is embedded at most once (the vector found on a miss is stored with the new answer).
+        """
+        value = self.lookup_exact(question, version)
+        if value is not None:
+            return value, "exact", 1.0
+        vector = embed(question)
+        found = self.lookup(vector, version)
+        if found is not None:
+            return found[0], "hit", found[1]
+        with self._lock:
+            self.stats["misses"] += 1
+        value = compute()
+        self.store(question, value, vector, version)
+        return value, "miss", None
+
+    def summary(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "size": len(self),
+            "version": self.version,
+            "versions": len(self._parts),
+            "threshold": self.threshold,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,72 @@
+# utils/startup_profile.py
+"""
+Startup profiler behind `main.py --profile-startup`.
+
+Wraps builtins.__import__ to attribute first-time import cost to top-level packages
+(self time, so langchain_core is not double counted under langgraph), and records
+named initialization phases.
+"""
+from __future__ import annotations
+
+import builtins
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+class StartupProfiler:
+    def __init__(self, process_start: float):
+        self.process_start = process_start
+        self.phases: List[Tuple[str, float]] = []
+        self.import_self: Dict[str, float] = {}
+        self._stack: List[float] = []  # child time accumulated per open import frame
+        self._orig_import = None
+
+    def install(self) -> None:
+        self._orig_import = builtins.__import__
+        orig = self._orig_import
+
+        def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+            # Only the main thread is profiled; the frame stack is not thread-safe.
+            if level or name in sys.modules or threading.current_thread() is not threading.main_thread():
+                return orig(name, globals, locals, fromlist, level)
+            self._stack.append(0.0)
+            t0 = time.perf_counter()
+            try:
+                return orig(name, globals, locals, fromlist, level)
+            finally:
+                total = time.perf_counter() - t0
+                children = self._stack.pop()
+                top = name.split(".")[0]
+                self.import_self[top] = self.import_self.get(top, 0.0) + (total - children)
+                if self._stack:
+                    self._stack[-1] += total
+
+        builtins.__import__ = timed_import
+
+    def uninstall(self) -> None:
+        if self._orig_import is not None:
+            builtins.__import__ = self._orig_import
+            self._orig_import = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - t0))
+
+    def add_phase(self, name: str, seconds: float) -> None:
+        self.phases.append((name, seconds))
+
+    def report(self, label: str = "time to prompt", top: int = 15) -> str:
+        elapsed = time.perf_counter() - self.process_start
+        lines = [f"Startup profile ({label}: {elapsed * 1000:.0f} ms)", "", "Phases:"]
+        lines += [f"  {name:<40} {sec * 1000:>9.1f} ms" for name, sec in self.phases]
+        lines += ["", f"Imports (self time, top {top} packages):"]
+        ranked = sorted(self.import_self.items(), key=lambda kv: kv[1], reverse=True)[:top]
+        lines += [f"  {name:<40} {sec * 1000:>9.1f} ms" for name, sec in ranked]
+        return "\n".join(lines)
@@ -0,0 +1,318 @@
+# utils/token_utils.py
+"""
+Token accounting and budget-aware prompt compaction.
+
+    count_tokens(text, model)           tokens in a string (tiktoken; ~4 chars/token without it)
+    warm_encodings(models)              load tiktoken encodings at startup (not on the first call)
+    count_message_tokens(messages, m)   tokens in a chat prompt, incl. per-message overhead
+    estimate_cost(model, in, out)       USD from PRICES_PER_MTOK (override with LLM_PRICES)
+    token_ledger                        per-call records (stage, model, tokens, cost) + summary()
+    compact_text(text, budget, model)   normalize whitespace, drop boilerplate / duplicate lines,
+                                        then trim lowest-priority note sections to the budget
+    fit_lines(lines, budget, model)     leading lines (already ranked) that fit the budget
+
+Every LLM call through utils.llm_utils (invoke_with_timeout, TracingCallbackHandler) counts its
+prompt before the call and adds a record to token_ledger after it.
+
+LLM_PRICES is JSON, e.g. {"gpt-4o-mini": [0.15, 0.60]} (USD per million input / output tokens).
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# USD per million (input, output) tokens; list prices, override or extend with LLM_PRICES
+PRICES_PER_MTOK: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "openai/gpt-oss-20b": (0.10, 0.50),
+    "openai/gpt-oss-120b": (0.15, 0.75),
+}
+PRICES_PER_MTOK.update({k: tuple(v) for k, v in json.loads(os.getenv("LLM_PRICES") or "{}").items()})
+
+# Chat formatting overhead (role markers etc.) per message and per prompt
+_TOKENS_PER_MESSAGE = 4
+_TOKENS_PER_PROMPT = 3
+_CHARS_PER_TOKEN = 4.0
+
+_warned = False
+_tiktoken_failed = False
+_encoding_lock = threading.Lock()
+
+
+# ----------------------------
+# Counting
+# ----------------------------
+@lru_cache(maxsize=32)
+def _load_encoding(model: str):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model.rsplit("/", 1)[-1])
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def _encoding(model: str):
+    """tiktoken encoding for a model (o200k_base for unknown ones); None when tiktoken can't load."""
+    global _warned, _tiktoken_failed
+    if _tiktoken_failed:
+        return None
+    # One load at a time: a request arriving during warm_encodings() waits for it instead of
+    # starting a second download of the same encoding file
+    with _encoding_lock:
+        if _tiktoken_failed:
+            return None
+        try:
+            return _load_encoding(model)
+        except Exception as e:  # not installed, or the encoding file can't be downloaded (offline)
+            _tiktoken_failed = True  # don't retry (and wait on the network again) for other models
+            if not _warned:
+                _warned = True
+                print(f"⚠️ tiktoken unavailable, estimating tokens from characters ({type(e).__name__})")
+            return None
+
+
+def warm_encodings(models: Iterable[str] = ()) -> bool:
+    """
+    Load the encodings for `models` (default: OPENAI_MODEL and the o200k_base fallback) now,
+    at startup / prewarm time, so the first LLM call doesn't download them. With tiktoken
+    installed but no network, point TIKTOKEN_CACHE_DIR at a pre-populated cache. Returns
+    False when counting falls back to characters.
+    """
+    for m in list(models) or [os.getenv("OPENAI_MODEL", "gpt-4o-mini"), ""]:
+        if _encoding(m) is None:
+            return False
+    return True
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    enc = _encoding(model or "")
+    if enc is None:
+        return max(1, round(len(text) / _CHARS_PER_TOKEN))
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: Any, model: Optional[str] = None) -> int:
+    """Prompt tokens for a list of chat messages (or a plain string prompt)."""
+    if isinstance(messages, str):
+        return count_tokens(messages, model)
+    total = _TOKENS_PER_PROMPT
+    for m in messages:
+        content = getattr(m, "content", m)
+        total += _TOKENS_PER_MESSAGE + count_tokens(content if isinstance(content, str) else str(content), model)
+    return total
+
+
+def estimate_cost(model: Optional[str], input_tokens: int, output_tokens: int) -> Optional[float]:
+    """USD for one call; None for models without a known price."""
+    price = PRICES_PER_MTOK.get(model or "")
+    if price is None:
+        return None
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+# ----------------------------
+# Ledger
+# ----------------------------
+@dataclass
+class TokenRecord:
+    stage: str
+    model: str
+    input_tokens: int
+    output_tokens: int
+    estimated_input_tokens: int  # counted before the call
+    cost_usd: Optional[float] = None
+    error: Optional[str] = None
+
+
+class TokenLedger:
+    """Thread-safe ring buffer of per-call token / cost records."""
+
+    def __init__(self, maxlen: int = 10000):
+        self._records: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, model: str, estimated_input_tokens: int, input_tokens: Optional[int] = None,
+               output_tokens: Optional[int] = None, error: Optional[str] = None) -> TokenRecord:
+        """Add one call; provider-reported usage wins over the estimate when present."""
+        inp = input_tokens or estimated_input_tokens
+        out = output_tokens or 0
+        rec = TokenRecord(stage, model, inp, out, estimated_input_tokens, estimate_cost(model, inp, out), error)
+        with self._lock:
+            self._records.append(rec)
+        return rec
+
+    def records(self) -> List[TokenRecord]:
+        with self._lock:
+            return list(self._records)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """Per stage: calls, errors, input / output tokens (total and max input) and cost."""
+        out: Dict[str, Dict[str, Any]] = {}
+        for r in self.records():
+            st = out.setdefault(r.stage, {"calls": 0, "errors": 0, "input_tokens": 0, "output_tokens": 0,
+                                          "max_input_tokens": 0, "cost_usd": 0.0})
+            st["calls"] += 1
+            st["errors"] += r.error is not None
+            st["input_tokens"] += r.input_tokens
+            st["output_tokens"] += r.output_tokens
+            st["max_input_tokens"] = max(st["max_input_tokens"], r.input_tokens)
+            st["cost_usd"] += r.cost_usd or 0.0
+        for st in out.values():
+            st["cost_usd"] = round(st["cost_usd"], 6)
+        return out
+
+    def export_jsonl(self, path: str) -> int:
+        records = self.records()
+        with open(path, "w", encoding="utf-8") as f:
+            for r in records:
+                f.write(json.dumps(asdict(r)) + "\n")
+        return len(records)
+
+
+# Process-wide ledger
+token_ledger = TokenLedger()
+
+
+# ----------------------------
+# Compaction
+# ----------------------------
+_BOILERPLATE = re.compile(
+    r"^(?:"
+    r"[-=_*#~. ]{3,}"                                           # separator rules
+    r"|page \d+(?: of \d+)?"
+    r"|(?:electronically )?signed(?: electronically)? by\b.*"
+    r"|(?:printed|generated|faxed|dictated|transcribed) (?:on|by|at)\b.*"
+    r"|(?:confidential(?:ity)?(?: notice)?|disclaimer|privileged (?:and|&) confidential)\b.*"
+    r"|this (?:message|e-?mail|document|communication|fax)\b.*\b(?:confidential|privileged|intended (?:only )?for)\b.*"
+    r"|if you (?:have )?received this\b.*\bin error\b.*"
+    r"|please do not reply\b.*"
+    r"|-*\s*(?:original|forwarded) message\s*-*"
+    r"|sent from my \w+.*"
+    r")$",
+    re.IGNORECASE,
+)
+_HEADER = re.compile(r"^(?:([A-Za-z][A-Za-z /&()-]{1,40}):(?:\s.*)?|([A-Z][A-Z /&()-]{2,40}))$")
+
+# Section priority by heading (lower = kept longer); other headings get _DEFAULT_PRIORITY
+_SECTION_PRIORITY: List[Tuple[re.Pattern, int]] = [
+    (re.compile(r"\b(?:assessment|plan|impression|diagnos|medication|allerg|instruction|follow|discharge|"
+                r"recommend|summary)", re.I), 0),
+    (re.compile(r"\b(?:review of systems|ros|social|family|past|surgical|vital|exam)\b", re.I), 2),
+]
+_DEFAULT_PRIORITY = 1
+_TRIMMED = "[...]"
+
+
+@dataclass
+class Compaction:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    dropped_lines: int = 0      # boilerplate + duplicates
+    trimmed_lines: int = 0      # removed to meet the budget
+
+
+def _section_priority(header: str) -> int:
+    h = header.split(":", 1)[0]
+    for pattern, priority in _SECTION_PRIORITY:
+        if pattern.search(h):
+            return priority
+    return _DEFAULT_PRIORITY
+
+
+def _clean_lines(text: str) -> Tuple[List[str], int]:
+    """Whitespace-normalized lines without boilerplate or repeated lines; blank runs collapse to one."""
+    out: List[str] = []
+    seen = set()
+    dropped = 0
+    for raw in text.splitlines():
+        line = " ".join(raw.split())
+        if not line:
+            if out and out[-1]:
+                out.append("")
+            continue
+        if _BOILERPLATE.match(line):
+            dropped += 1
+            continue
+        if not _HEADER.match(line):  # headings legitimately repeat (one per visit)
+            key = line.lower()
+            if key in seen:
+                dropped += 1
+                continue
+            seen.add(key)
+        out.append(line)
+    while out and not out[-1]:
+        out.pop()
+    return out, dropped
+
+
+def compact_text(text: str, budget_tokens: Optional[int] = None, model: Optional[str] = None) -> Compaction:
+    """
+    Compact a note for a prompt. Whitespace, boilerplate and duplicate lines always go; if the
+    rest is still over `budget_tokens`, lines are trimmed from the end of the lowest-priority
+    sections (later sections first among equals) until it fits, leaving a "[...]" marker.
+    Section order is kept; budget_tokens=None/0 disables trimming.
+    """
+    before = count_tokens(text, model)
+    lines, dropped = _clean_lines(text)
+    cost = [count_tokens(line, model) + 1 for line in lines]  # +1 for the newline
+    total = sum(cost)
+    trimmed = 0
+    if budget_tokens and total > budget_tokens:
+        # sections: [start, end) line ranges with a priority; the preamble counts as a default section
+        starts = [0] + [i for i, line in enumerate(lines) if i and _HEADER.match(line)]
+        sections = [
+            [_section_priority(lines[s]) if _HEADER.match(lines[s]) else _DEFAULT_PRIORITY, s, e, e]
+            for s, e in zip(starts, starts[1:] + [len(lines)])
+        ]
+        marker_cost = count_tokens(_TRIMMED, model) + 1
+        for sec in sorted(sections, key=lambda sec: (-sec[0], -sec[1])):
+            if total <= budget_tokens:
+                break
+            _, start, end, _ = sec
+            if end == start:
+                continue
+            total += marker_cost
+            while end > start and total > budget_tokens:
+                end -= 1
+                total -= cost[end]
+                trimmed += 1
+            sec[2] = end
+        kept: List[str] = []
+        for _, start, end, orig_end in sections:
+            kept.extend(lines[start:end])
+            if end < orig_end and (not kept or kept[-1] != _TRIMMED):
+                kept.append(_TRIMMED)
+        if any(line and line != _TRIMMED for line in kept):
+            lines = kept  # else a single line is over the whole budget: hard cut below
+    out = "\n".join(lines)
+    if budget_tokens and count_tokens(out, model) > budget_tokens:
+        out = out[: int(budget_tokens * _CHARS_PER_TOKEN)] + " " + _TRIMMED
+    return Compaction(out, before, count_tokens(out, model), dropped, trimmed)
+
+
+def fit_lines(lines: Iterable[str], budget_tokens: Optional[int], model: Optional[str] = None) -> str:
+    """The leading lines (best-ranked first) within the budget, plus '(N more not shown)'."""
+    lines = list(lines)
+    if not budget_tokens:
+        return "\n".join(lines)
+    used = 0
+    for i, line in enumerate(lines):
+        used += count_tokens(line, model) + 1
+        if used > budget_tokens and i:
+            return "\n".join(lines[:i] + [f"({len(lines) - i} more not shown)"])
+    return "\n".join(lines)
@@ -0,0 +1,260 @@
+# utils/tracing.py
+"""
+Lightweight span-based tracing (stdlib only, works offline).
+
+    from utils.tracing import span
+
+    with span("filter.zip", rows_in=len(rows)) as s:
+        out = ...
+        s.set(rows_out=len(out))
+
+Finished spans are kept in an in-memory ring buffer and, if HEALTHLIGHT_TRACE_FILE is set,
+appended to that file as JSON lines. The file is written by a background thread in batches
+(every FLUSH_INTERVAL_S, or sooner past FLUSH_BATCH spans) with the file kept open, so a
+finished span costs a list append on the request path; tracer.flush() writes what is pending
+and runs at exit and before a fork. Summaries give count and p50/p95/p99 per span name:
+
+    python -m utils.tracing trace.jsonl
+"""
+from __future__ import annotations
+
+import atexit
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from utils.metrics import percentile
+
+# Background export: write pending spans at least this often, and sooner past FLUSH_BATCH of them
+FLUSH_INTERVAL_S = 0.5
+FLUSH_BATCH = 512
+
+_ids = itertools.count(1)
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "trace_id", "start", "duration_ms", "attrs", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attrs: Dict[str, Any]):
+        self.name = name
+        self.span_id = next(_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self.start = time.time()
+        self.duration_ms = 0.0
+        self.attrs = attrs
+        self.error: Optional[str] = None
+
+    def set(self, **attrs: Any) -> None:
+        """Attach attributes such as rows, tokens, bytes or cache='hit'|'miss'."""
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "trace_id": self.trace_id,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class Tracer:
+    def __init__(self, maxlen: int = 20000, export_path: Optional[str] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.export_path = export_path
+        self._spans: deque = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        # Export state: spans waiting for the writer thread, and the open trace file
+        self._pending: List[Span] = []
+        self._writer: Optional[threading.Thread] = None
+        self._wake = threading.Event()
+        self._io_lock = threading.Lock()
+        self._file = None
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        s = Span(name, _current.get(), attrs)
+        if not self.enabled:
+            yield s
+            return
+        token = _current.set(s)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        except BaseException as e:
+            s.error = type(e).__name__
+            raise
+        finally:
+            s.duration_ms = (time.perf_counter() - t0) * 1000.0
+            _current.reset(token)
+            self._finish(s)
+
+    def record(self, name: str, duration_ms: float, error: Optional[str] = None, **attrs: Any) -> None:
+        """Record an already-measured span (for callback-style instrumentation)."""
+        if not self.enabled:
+            return
+        s = Span(name, _current.get(), attrs)
+        s.start -= duration_ms / 1000.0
+        s.duration_ms = duration_ms
+        s.error = error
+        self._finish(s)
+
+    def _finish(self, s: Span) -> None:
+        with self._lock:
+            self._spans.append(s)
+            if not self.export_path:
+                return
+            self._pending.append(s)  # serialized and written by the writer thread
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+                self._writer.start()
+            if len(self._pending) >= FLUSH_BATCH:
+                self._wake.set()
+
+    # --- export ---
+    def _write_loop(self) -> None:
+        while True:
+            self._wake.wait(FLUSH_INTERVAL_S)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ Could not write trace spans to {self.export_path} ({type(e).__name__}: {e})")
+
+    def flush(self) -> int:
+        """Write pending spans to the trace file now; returns once every span finished so far is written."""
+        with self._io_lock:  # taken first: a batch the writer thread holds is written before we return
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch or not self.export_path:
+                return 0
+            lines = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in batch)
+            if self._file is None:
+                self._file = open(self.export_path, "a", encoding="utf-8")
+            self._file.write(lines)
+            self._file.flush()
+        return len(batch)
+
+    def _after_fork_in_child(self) -> None:
+        # The writer thread does not exist in the child; it starts again with the next span
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = None
+        self._file = None
+        self._pending = []
+
+    def spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._spans.clear()
+
+    def export_jsonl(self, path: str) -> int:
+        """Write all buffered spans to `path` as JSON lines. Returns the number written."""
+        spans = self.spans()
+        with open(path, "w", encoding="utf-8") as f:
+            for s in spans:
+                f.write(json.dumps(s.to_dict(), default=str) + "\n")
+        return len(spans)
+
+    def summarize(self) -> Dict[str, Dict[str, Any]]:
+        return summarize_spans(s.to_dict() for s in self.spans())
+
+
+def summarize_spans(spans: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Per span name: count, errors, p50/p95/p99/max ms, summed numeric attrs and cache hit rate."""
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        grouped.setdefault(s["name"], []).append(s)
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for name, items in sorted(grouped.items()):
+        durations = [i["duration_ms"] for i in items]
+        stats: Dict[str, Any] = {
+            "count": len(items),
+            "errors": sum(1 for i in items if i.get("error")),
+            "p50_ms": round(percentile(durations, 50), 3),
+            "p95_ms": round(percentile(durations, 95), 3),
+            "p99_ms": round(percentile(durations, 99), 3),
+            "max_ms": round(max(durations), 3),
+        }
+        totals: Dict[str, float] = {}
+        cache = {"hit": 0, "miss": 0}
+        for i in items:
+            for k, v in (i.get("attrs") or {}).items():
+                if k == "cache" and v in cache:
+                    cache[v] += 1
+                elif isinstance(v, (int, float)) and not isinstance(v, bool):
+                    totals[k] = totals.get(k, 0) + v
+        if totals:
+            stats["totals"] = totals
+        if cache["hit"] or cache["miss"]:
+            stats["cache_hit_rate"] = round(cache["hit"] / (cache["hit"] + cache["miss"]), 4)
+        out[name] = stats
+    return out
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def format_summary(summary: Dict[str, Dict[str, Any]]) -> str:
+    header = f"{'stage':<40} {'count':>6} {'err':>4} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}"
+    lines = [header, "-" * len(header)]
+    for name, st in summary.items():
+        lines.append(
+            f"{name:<40} {st['count']:>6} {st['errors']:>4} "
+            f"{st['p50_ms']:>10.1f} {st['p95_ms']:>10.1f} {st['p99_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+# Process-wide tracer
+tracer = Tracer(
+    export_path=os.getenv("HEALTHLIGHT_TRACE_FILE") or None,
+    enabled=os.getenv("HEALTHLIGHT_TRACE", "1") != "0",
+)
+
+
+atexit.register(tracer.flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=tracer.flush, after_in_child=tracer._after_fork_in_child)
+
+
+def span(name: str, **attrs: Any):
+    return tracer.span(name, **attrs)
+
+
+def traced(name: str) -> Callable:
+    """Decorator form of `span` for whole functions (e.g. graph nodes)."""
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python -m utils.tracing <trace.jsonl>")
+        sys.exit(2)
+    print(format_summary(summarize_spans(load_jsonl(sys.argv[1]))))